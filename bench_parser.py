@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+保存済みの対局履歴ページを使って、履歴ページのパーサーの性能をオフラインで計測するスクリプト
+ブラウザやネットワークを使わずに、パーサーエンジンごとの処理速度とメモリ使用量を比較する
+"""
+
+import argparse
+import copy
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import List, Dict
+
+import lxml.html
+
+from shogiwars_scraper import PARSER_ENGINES, parse_history_page
+
+
+# ベンチマークに使う保存済みページの置き場所
+DEFAULT_CORPUS_DIR = os.path.join("fixtures", "history")
+
+# 対局数を何倍にした合成ページを作るか
+DEFAULT_SCALES = [1, 10, 100]
+
+# 1つの (エンジン, ページ) を計測し続ける最小時間（秒）
+DEFAULT_MIN_SECONDS = 0.5
+
+# ベースラインから何割遅くなったら失敗とするか
+DEFAULT_THRESHOLD = 0.2
+
+
+def load_corpus(corpus_dir: str) -> Dict[str, str]:
+    """
+    保存済みの履歴ページを読み込む
+
+    Args:
+        corpus_dir: HTMLファイルを置いたディレクトリ
+
+    Returns:
+        ページ名 -> HTML
+    """
+    corpus = {}
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "*.html"))):
+        with open(path, "r", encoding="utf-8") as f:
+            corpus[os.path.splitext(os.path.basename(path))[0]] = f.read()
+
+    return corpus
+
+
+def scale_page(page_source: str, scale: int) -> str:
+    """
+    対局の要素を複製して、対局数をscale倍にしたページを作る
+
+    Args:
+        page_source: 元の履歴ページのHTML
+        scale: 倍率
+
+    Returns:
+        合成したページのHTML
+    """
+    if scale <= 1:
+        return page_source
+
+    root = lxml.html.document_fromstring(page_source)
+    # game_playersを含む対局ごとの要素（バッジと同じ階層）を複製する
+    items = [
+        div.getparent()
+        for div in root.iter("div")
+        if "game_players" in (div.get("class") or "").split() and div.getparent() is not None
+    ]
+    for item in items:
+        anchor = item
+        for _ in range(scale - 1):
+            clone = copy.deepcopy(item)
+            anchor.addnext(clone)
+            anchor = clone
+
+    return lxml.html.tostring(root, encoding="unicode", doctype="<!DOCTYPE html>")
+
+
+def measure(engine: str, page_source: str, min_seconds: float) -> Dict[str, float]:
+    """
+    1つのページを繰り返しパースして速度とピークメモリを計測
+
+    Args:
+        engine: パーサーエンジン
+        page_source: 履歴ページのHTML
+        min_seconds: 計測を続ける最小時間（秒）
+
+    Returns:
+        計測結果
+    """
+    # ピークメモリは1回分のパースで計測する（tracemallocは速度計測と分ける）
+    # tracemallocが追跡するのはPythonのメモリのみで、libxml2内部の確保は含まれない
+    tracemalloc.start()
+    game_urls, _ = parse_history_page(page_source, "", engine)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    iterations = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_seconds or iterations < 3:
+        parse_history_page(page_source, "", engine)
+        iterations += 1
+        elapsed = time.perf_counter() - start
+
+    pages_per_sec = iterations / elapsed
+    return {
+        "games": len(game_urls),
+        "iterations": iterations,
+        "pages_per_sec": pages_per_sec,
+        "games_per_sec": pages_per_sec * len(game_urls),
+        "peak_memory_kb": peak / 1024,
+    }
+
+
+def check_parity(engines: List[str], page_source: str) -> bool:
+    """
+    全てのエンジンが同一の出力を返すかを確認
+    """
+    outputs = [
+        json.dumps(parse_history_page(page_source, "", engine), ensure_ascii=False)
+        for engine in engines
+    ]
+    return all(output == outputs[0] for output in outputs)
+
+
+def compare_with_baseline(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """
+    ベースラインと比べてページ/秒が閾値以上落ちた計測を返す
+
+    Args:
+        results: 今回の計測結果（"エンジン/ページ" -> 計測結果）
+        baseline: ベースラインの計測結果
+        threshold: 許容する速度低下の割合
+
+    Returns:
+        回帰した計測のメッセージのリスト
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        before = baseline[key]["pages_per_sec"]
+        after = result["pages_per_sec"]
+        if before > 0 and after < before * (1 - threshold):
+            regressions.append(f"{key}: {before:.1f} -> {after:.1f} pages/sec ({(after / before - 1) * 100:+.1f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="保存済みの履歴ページで履歴ページのパーサーの性能を計測"
+    )
+    parser.add_argument(
+        "--corpus",
+        default=DEFAULT_CORPUS_DIR,
+        help=f"履歴ページのHTMLを置いたディレクトリ (default: {DEFAULT_CORPUS_DIR})"
+    )
+    parser.add_argument(
+        "--engine",
+        action="append",
+        choices=sorted(PARSER_ENGINES),
+        help="計測するパーサーエンジン（複数指定可、default: 全て）"
+    )
+    parser.add_argument(
+        "--scales",
+        default=",".join(str(scale) for scale in DEFAULT_SCALES),
+        help="対局数を何倍にした合成ページを作るか（カンマ区切り） (default: 1,10,100)"
+    )
+    parser.add_argument(
+        "--min-seconds",
+        type=float,
+        default=DEFAULT_MIN_SECONDS,
+        help=f"1つの計測を続ける最小時間（秒） (default: {DEFAULT_MIN_SECONDS})"
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="計測結果をJSONで保存するファイル"
+    )
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="比較するベースライン（--outputで保存したJSON）"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f"ベースラインから許容する速度低下の割合 (default: {DEFAULT_THRESHOLD})"
+    )
+
+    args = parser.parse_args()
+
+    engines = args.engine or sorted(PARSER_ENGINES)
+    scales = [int(scale) for scale in args.scales.split(",") if scale]
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print(f"エラー: 履歴ページが見つかりません: {args.corpus}")
+        sys.exit(1)
+
+    print(f"ページ数: {len(corpus)}, 倍率: {scales}, エンジン: {engines}\n")
+    print(f"{'engine':<6} {'page':<40} {'games':>6} {'pages/sec':>10} {'games/sec':>11} {'peak KB':>9}")
+    print("-" * 87)
+
+    results: Dict[str, Dict] = {}
+    parity_failures = []
+
+    for name, page_source in corpus.items():
+        for scale in scales:
+            page_name = f"{name}@x{scale}"
+            scaled_source = scale_page(page_source, scale)
+
+            if len(engines) > 1 and not check_parity(engines, scaled_source):
+                parity_failures.append(page_name)
+
+            for engine in engines:
+                result = measure(engine, scaled_source, args.min_seconds)
+                results[f"{engine}/{page_name}"] = result
+                print(f"{engine:<6} {page_name:<40} {result['games']:>6} {result['pages_per_sec']:>10.1f} "
+                      f"{result['games_per_sec']:>11.0f} {result['peak_memory_kb']:>9.0f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n計測結果を保存しました: {args.output}")
+
+    failed = False
+
+    if parity_failures:
+        print(f"\nエラー: エンジン間で出力が一致しないページがあります: {parity_failures}")
+        failed = True
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nエラー: ベースラインから {args.threshold * 100:.0f}% 以上遅くなりました:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            failed = True
+        else:
+            print(f"\nベースラインからの速度低下は {args.threshold * 100:.0f}% 以内です")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
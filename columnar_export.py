@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+"""
+対局データを列指向・辞書符号化したバイナリファイルに書き出す／読み込むモジュール
+対局者名・段位・勝敗・戦型バッジは辞書のインデックス、日時はエポック秒の整数で保持し、
+ビューアがJSONを解析せずに短時間・少ないメモリで読み込めるようにする
+
+ファイル形式:
+    MAGIC (8バイト) + マニフェストの長さ (4バイト, little endian) + マニフェスト (JSON)
+    + 8バイト境界に揃えた各列のデータ（array.arrayのバイト列）
+"""
+
+import argparse
+import glob
+import json
+import os
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta
+from typing import List, Dict, Iterable, Optional
+
+from merge_json import JsonStreamReader
+
+
+MAGIC = b"SWCOL1\n\0"
+
+# 出力ファイルの拡張子（JSONと同じ名前で拡張子だけを変える）
+COLUMNAR_SUFFIX = ".columnar"
+
+# 日時がない対局のエポック秒
+NULL_DATETIME = -(2 ** 63)
+
+# 日時は将棋ウォーズの表示どおりの日本時間（タイムゾーンなし）をUTCとみなしてエポック秒にする
+_EPOCH = datetime(1970, 1, 1)
+
+# 棋譜URLはgame_idから復元できるので、全対局が一致する場合は保存しない
+URL_TEMPLATE = "https://shogiwars.heroz.jp/games/{game_id}?locale=ja"
+
+
+def _datetime_to_epoch(value: Optional[str]) -> int:
+    if not value:
+        return NULL_DATETIME
+    return int((datetime.fromisoformat(value) - _EPOCH).total_seconds())
+
+
+def _epoch_to_datetime(value: int) -> Optional[str]:
+    if value == NULL_DATETIME:
+        return None
+    return (_EPOCH + timedelta(seconds=value)).isoformat()
+
+
+class _Dictionary:
+    """
+    文字列 -> 符号（出現順）の辞書
+    """
+
+    def __init__(self):
+        self.values: List[Optional[str]] = []
+        self._codes: Dict[Optional[str], int] = {}
+
+    def encode(self, value: Optional[str]) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+    def typecode(self) -> str:
+        # 辞書の大きさに合わせて最小の整数型を選ぶ
+        if len(self.values) <= 0xFF:
+            return "B"
+        if len(self.values) <= 0xFFFF:
+            return "H"
+        return "I"
+
+
+def _narrow(values: array, typecode: str) -> array:
+    if values.typecode == typecode:
+        return values
+    return array(typecode, values)
+
+
+def write_columnar(replays: Iterable[Dict], output_file: str, query_params: Dict[str, str]) -> int:
+    """
+    対局データを列指向のファイルに書き出す
+
+    Args:
+        replays: save_to_jsonと同じ形式の対局データ（1件ずつ読み込める列でよい）
+        output_file: 出力ファイル名
+        query_params: 検索に使用したパラメータ（マニフェストに記録する）
+
+    Returns:
+        書き出した対局数
+    """
+    names = _Dictionary()
+    classes = _Dictionary()
+    results = _Dictionary()
+    badges = _Dictionary()
+
+    datetimes = array("q")
+    sente_name = array("I")
+    gote_name = array("I")
+    sente_class = array("I")
+    gote_class = array("I")
+    sente_result = array("I")
+    gote_result = array("I")
+    # 戦型バッジはCSR形式（対局iのバッジは badge_codes[badge_offsets[i]:badge_offsets[i+1]]）
+    badge_offsets = array("I", [0])
+    badge_codes = array("I")
+    game_ids: List[str] = []
+    urls: List[str] = []
+    urls_match_template = True
+
+    for replay in replays:
+        game_id = replay["game_id"]
+        sente = replay.get("sente") or {}
+        gote = replay.get("gote") or {}
+
+        game_ids.append(game_id)
+        urls.append(replay["url"])
+        if urls_match_template and replay["url"] != URL_TEMPLATE.format(game_id=game_id):
+            urls_match_template = False
+
+        datetimes.append(_datetime_to_epoch(replay.get("datetime")))
+        sente_name.append(names.encode(sente.get("name")))
+        gote_name.append(names.encode(gote.get("name")))
+        sente_class.append(classes.encode(sente.get("class")))
+        gote_class.append(classes.encode(gote.get("class")))
+        sente_result.append(results.encode(sente.get("result")))
+        gote_result.append(results.encode(gote.get("result")))
+        for badge in replay.get("badges") or []:
+            badge_codes.append(badges.encode(badge))
+        badge_offsets.append(len(badge_codes))
+
+    count = len(game_ids)
+
+    # 文字列の列はUTF-8を連結し、終端位置の配列と組にする
+    def string_column(values: List[str]) -> tuple[array, bytes]:
+        offsets = array("I", [0])
+        encoded = []
+        total = 0
+        for value in values:
+            data = value.encode("utf-8")
+            encoded.append(data)
+            total += len(data)
+            offsets.append(total)
+        return offsets, b"".join(encoded)
+
+    game_id_offsets, game_id_bytes = string_column(game_ids)
+    columns: Dict[str, object] = {
+        "datetime": datetimes,
+        "sente_name": _narrow(sente_name, names.typecode()),
+        "gote_name": _narrow(gote_name, names.typecode()),
+        "sente_class": _narrow(sente_class, classes.typecode()),
+        "gote_class": _narrow(gote_class, classes.typecode()),
+        "sente_result": _narrow(sente_result, results.typecode()),
+        "gote_result": _narrow(gote_result, results.typecode()),
+        "badge_offsets": badge_offsets,
+        "badge_codes": _narrow(badge_codes, badges.typecode()),
+        "game_id_offsets": game_id_offsets,
+        "game_id_data": game_id_bytes,
+    }
+    if not urls_match_template:
+        url_offsets, url_bytes = string_column(urls)
+        columns["url_offsets"] = url_offsets
+        columns["url_data"] = url_bytes
+
+    valid_datetimes = [value for value in datetimes if value != NULL_DATETIME]
+
+    # 各列の位置を決めてからマニフェストを書く
+    column_specs = {}
+    blobs = []
+    offset = 0
+    for name, column in columns.items():
+        if isinstance(column, array):
+            data = column.tobytes()
+            spec = {"typecode": column.typecode, "length": len(column)}
+        else:
+            data = column
+            spec = {"typecode": "bytes", "length": len(column)}
+        spec["offset"] = offset
+        spec["size"] = len(data)
+        column_specs[name] = spec
+        padding = -len(data) % 8
+        blobs.append(data + b"\0" * padding)
+        offset += len(data) + padding
+
+    manifest = {
+        "version": 1,
+        "count": count,
+        "params": query_params,
+        "byteorder": sys.byteorder,
+        "datetime": {
+            "unit": "s",
+            "timezone": "naive",
+            "null": NULL_DATETIME,
+            "min": _epoch_to_datetime(min(valid_datetimes)) if valid_datetimes else None,
+            "max": _epoch_to_datetime(max(valid_datetimes)) if valid_datetimes else None,
+        },
+        "url_template": URL_TEMPLATE if urls_match_template else None,
+        "dictionaries": {
+            "names": names.values,
+            "classes": classes.values,
+            "results": results.values,
+            "badges": badges.values,
+        },
+        "columns": column_specs,
+    }
+    manifest_bytes = json.dumps(manifest, ensure_ascii=False).encode("utf-8")
+    header_size = len(MAGIC) + 4 + len(manifest_bytes)
+    header_padding = -header_size % 8
+
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(manifest_bytes)))
+        f.write(manifest_bytes)
+        f.write(b"\0" * header_padding)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_file, output_file)
+
+    print(f"Saved {count} games to {output_file} (columnar)")
+    return count
+
+
+def read_manifest(path: str) -> Dict:
+    """
+    列のデータを読まずにマニフェストだけを読み込む（対象月や件数の確認用）
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a columnar replay file")
+        (length,) = struct.unpack("<I", f.read(4))
+        return json.loads(f.read(length).decode("utf-8"))
+
+
+class ColumnarReplays:
+    """
+    列指向ファイルから読み込んだ対局データ
+    各列は array.array、辞書は文字列のリストで保持する
+    """
+
+    def __init__(self, manifest: Dict, columns: Dict[str, object]):
+        self.manifest = manifest
+        self.params = manifest["params"]
+        self.dictionaries = manifest["dictionaries"]
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return self.manifest["count"]
+
+    def _string(self, name: str, index: int) -> str:
+        offsets = self.columns[f"{name}_offsets"]
+        return self.columns[f"{name}_data"][offsets[index]:offsets[index + 1]].decode("utf-8")
+
+    def game_id(self, index: int) -> str:
+        return self._string("game_id", index)
+
+    def badges(self, index: int) -> List[str]:
+        offsets = self.columns["badge_offsets"]
+        codes = self.columns["badge_codes"]
+        values = self.dictionaries["badges"]
+        return [values[code] for code in codes[offsets[index]:offsets[index + 1]]]
+
+    def replay(self, index: int) -> Dict:
+        """
+        1対局分をsave_to_jsonと同じ形式の辞書に戻す
+        """
+        names = self.dictionaries["names"]
+        classes = self.dictionaries["classes"]
+        results = self.dictionaries["results"]
+        columns = self.columns
+
+        game_id = self.game_id(index)
+        template = self.manifest["url_template"]
+        return {
+            "url": template.format(game_id=game_id) if template else self._string("url", index),
+            "game_id": game_id,
+            "sente": {
+                "name": names[columns["sente_name"][index]],
+                "class": classes[columns["sente_class"][index]],
+                "result": results[columns["sente_result"][index]]
+            },
+            "gote": {
+                "name": names[columns["gote_name"][index]],
+                "class": classes[columns["gote_class"][index]],
+                "result": results[columns["gote_result"][index]]
+            },
+            "datetime": _epoch_to_datetime(columns["datetime"][index]),
+            "badges": self.badges(index)
+        }
+
+    def to_replays(self) -> List[Dict]:
+        return [self.replay(index) for index in range(len(self))]
+
+
+def load_columnar(path: str) -> ColumnarReplays:
+    """
+    列指向ファイルを読み込む
+
+    Args:
+        path: write_columnarで書き出したファイル
+
+    Returns:
+        列ごとの配列と辞書
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path}: not a columnar replay file")
+    (length,) = struct.unpack_from("<I", data, len(MAGIC))
+    header_size = len(MAGIC) + 4 + length
+    manifest = json.loads(data[len(MAGIC) + 4:header_size].decode("utf-8"))
+    base = header_size + (-header_size % 8)
+
+    swap = manifest["byteorder"] != sys.byteorder
+    view = memoryview(data)
+    columns: Dict[str, object] = {}
+    for name, spec in manifest["columns"].items():
+        start = base + spec["offset"]
+        chunk = view[start:start + spec["size"]]
+        if spec["typecode"] == "bytes":
+            columns[name] = bytes(chunk)
+        else:
+            column = array(spec["typecode"])
+            column.frombytes(chunk)
+            if swap:
+                column.byteswap()
+            columns[name] = column
+
+    return ColumnarReplays(manifest, columns)
+
+
+def columnar_path(json_file: str) -> str:
+    """
+    JSONの出力ファイルに対応する列指向ファイルのパス
+    """
+    return os.path.splitext(json_file)[0] + COLUMNAR_SUFFIX
+
+
+def export_json_file(json_file: str, output_file: Optional[str] = None) -> int:
+    """
+    save_to_jsonで保存したファイルを列指向ファイルに変換（JSONは少しずつ読み込む）
+
+    Args:
+        json_file: 入力のJSONファイル
+        output_file: 出力ファイル名（未指定の場合は拡張子を .columnar に変えたもの）
+
+    Returns:
+        書き出した対局数
+    """
+    reader = JsonStreamReader(json_file)
+    try:
+        params = reader.header.get("params", {})
+        return write_columnar(reader, output_file or columnar_path(json_file), params)
+    finally:
+        reader.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="対局データのJSONファイルを列指向・辞書符号化したファイルに変換"
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="*",
+        help="変換するJSONファイルまたはglobパターン (default: result/game_replays_*.json)"
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="変換後に読み込み直し、元のJSONと同じ対局データになることを確認する"
+    )
+
+    args = parser.parse_args()
+
+    patterns = args.inputs or [os.path.join("result", "game_replays_*.json")]
+    json_files = []
+    for pattern in patterns:
+        json_files.extend(sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern])
+
+    failed = False
+    for json_file in json_files:
+        export_json_file(json_file)
+        if args.verify:
+            with open(json_file, "r", encoding="utf-8") as f:
+                expected = json.load(f).get("replays", [])
+            if load_columnar(columnar_path(json_file)).to_replays() != expected:
+                print(f"エラー: 変換結果が元のJSONと一致しません: {json_file}")
+                failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+対局ページ（/games/{game_id}）から抽出した指し手のキャッシュ
+終局した対局の指し手は変わらないため、game_idをキーに一度保存すれば無効化は不要
+"""
+
+import hashlib
+import html
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from typing import List, Dict, Iterable, Optional
+
+
+# デフォルトのキャッシュの場所
+DEFAULT_KIFU_CACHE_DIR = os.path.join("cache", "kifu")
+
+# 対局ページのReactコンポーネントに渡されるプロパティ（HTMLエスケープされたJSON）
+_REACT_PROPS_RE = re.compile(r'data-react-props="([^"]*)"')
+
+# 旧形式の対局ページの指し手（例: receiveMove("+7776FU,L599\t-3334FU,L597")）
+_RECEIVE_MOVE_RE = re.compile(r'receiveMove\("([^"]*)"\)')
+
+# receiveMoveの指し手の区切り
+_MOVE_SEPARATOR_RE = re.compile(r"\\t|\t")
+
+# CSA形式の指し手（例: +7776FU）
+_CSA_MOVE_RE = re.compile(r'^[+-]\d{4}[A-Z]{2}$')
+
+
+def _find_moves(value) -> Optional[List[Dict]]:
+    """
+    プロパティのJSONから指し手のリスト（{"m": "+7776FU", "t": 599} の配列）を探す
+    空のリストは指し手と関係ないプロパティの場合があるため、指し手のリストとして扱わない
+    """
+    if isinstance(value, dict):
+        moves = value.get("moves")
+        if isinstance(moves, list) and moves and all(isinstance(move, dict) and "m" in move for move in moves):
+            return moves
+        for child in value.values():
+            found = _find_moves(child)
+            if found is not None:
+                return found
+    elif isinstance(value, list):
+        for child in value:
+            found = _find_moves(child)
+            if found is not None:
+                return found
+    return None
+
+
+def extract_moves(page_source: str) -> List[Dict]:
+    """
+    対局ページのHTMLから指し手を抽出
+
+    Args:
+        page_source: 対局ページのHTML
+
+    Returns:
+        指し手のリスト（{"move": CSA形式の指し手, "time": 消費時間などのサイトの時間の値}）
+        終局の表記（例: SENTE_WIN_TORYO）は指し手に含めない
+
+    Raises:
+        ValueError: 指し手が見つからない場合（CSA形式の指し手が1つもない場合を含む）
+    """
+    for match in _REACT_PROPS_RE.finditer(page_source):
+        try:
+            props = json.loads(html.unescape(match.group(1)))
+        except json.JSONDecodeError:
+            continue
+        moves = _find_moves(props)
+        if moves is not None:
+            moves = [
+                {"move": move["m"], "time": move.get("t")}
+                for move in moves
+                if isinstance(move["m"], str) and _CSA_MOVE_RE.match(move["m"])
+            ]
+            if moves:
+                return moves
+
+    match = _RECEIVE_MOVE_RE.search(page_source)
+    if match:
+        moves = []
+        # 区切りはJavaScriptの文字列のエスケープ（\t）のまま、またはタブ
+        for item in _MOVE_SEPARATOR_RE.split(match.group(1)):
+            move, _, time_value = item.partition(",L")
+            if _CSA_MOVE_RE.match(move):
+                moves.append({"move": move, "time": int(time_value) if time_value.isdigit() else None})
+        if moves:
+            return moves
+
+    raise ValueError("move list not found in the game page")
+
+
+class KifuCache:
+    """
+    game_idごとの指し手のキャッシュ（複数スレッドから保存できる）
+    cache/kifu/[game_idのSHA-1の先頭2文字]/[game_id].json に1局ずつ保存する
+    """
+
+    def __init__(self, path: str = DEFAULT_KIFU_CACHE_DIR):
+        """
+        Args:
+            path: キャッシュのディレクトリ（なければ作成する）
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _path(self, game_id: str) -> str:
+        # 1つのディレクトリに数万ファイルが並ばないように分散させる
+        shard = hashlib.sha1(game_id.encode("utf-8")).hexdigest()[:2]
+        return os.path.join(self.path, shard, game_id + ".json")
+
+    def has(self, game_id: str) -> bool:
+        return os.path.exists(self._path(game_id))
+
+    def missing(self, game_ids: Iterable[str]) -> List[str]:
+        """
+        キャッシュにないgame_id（重複を除き、指定順）
+        """
+        seen = set()
+        missing = []
+        for game_id in game_ids:
+            if game_id in seen:
+                continue
+            seen.add(game_id)
+            if not self.has(game_id):
+                missing.append(game_id)
+        return missing
+
+    def get(self, game_id: str) -> Optional[List[Dict]]:
+        """
+        キャッシュした指し手（なければNone）
+        """
+        try:
+            with open(self._path(game_id), "r", encoding="utf-8") as f:
+                return json.load(f)["moves"]
+        except FileNotFoundError:
+            return None
+
+    def put(self, game_id: str, moves: List[Dict]):
+        """
+        指し手を保存（空の指し手は保存しない。保存すると二度と取得し直さないため）
+
+        Raises:
+            ValueError: 指し手が空の場合
+        """
+        if not moves:
+            raise ValueError(f"refusing to cache an empty move list: {game_id}")
+        path = self._path(game_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        record = {
+            "game_id": game_id,
+            "moves": moves,
+            "fetched_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        # 書きかけのファイルがキャッシュ済みと見なされないように、一時ファイルから置き換える
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
@@ -1,118 +1,498 @@
 #!/usr/bin/env python
 """
-既存の古いフォーマットのJSONファイルを新しいフォーマット（1ファイルに全組み合わせ）にマージするスクリプト
+複数の対局データのJSONファイルを1つのファイルにマージするスクリプト
+各ファイルを少しずつ読み込み、日時の降順に並んだ対局の列をk-wayマージする
+日時の順に並んでいないファイル（スクレイパーの出力は組み合わせの順）は、1ファイルずつ並べ替えて一時ファイルに書き出してからマージする
+（ファイル数や月数によらず、メモリには各ファイルの読み込みバッファと、並べ替え中の1ファイルだけを保持する）
 """
 
+import argparse
+import glob
+import heapq
 import json
 import os
-from typing import List, Dict, Set
+import tempfile
+from typing import List, Dict, Iterator, Optional, Set
 
-def merge_json_files(input_files: List[str], output_file: str):
+import profiling
+
+
+# 1回に読み込むバイト数（文字数）
+READ_CHUNK_SIZE = 64 * 1024
+
+# ディレクトリを指定した場合に読み込むファイル
+DIRECTORY_PATTERN = "game_replays_*.json"
+
+# k-wayマージで同時に開くファイル数の上限（超える場合は何段階かに分けてマージする）
+DEFAULT_MAX_OPEN_FILES = 64
+
+
+class JsonStreamReader:
     """
-    複数のJSONファイルをマージして1つのファイルに統合
+    {"params": {...}, "replays": [...]} 形式のJSONファイルを少しずつ読み込むリーダー
+    replays以外のキーはそのまま読み込み、replaysの要素は1件ずつ返す
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "r", encoding="utf-8")
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        # replays以外のトップレベルのキー
+        self.header: Dict = {}
+        self._in_replays = False
+        self._read_header()
+
+    def close(self):
+        self._file.close()
+
+    def _fill(self) -> bool:
+        """
+        バッファに続きを読み込む（読み込めなければFalse）
+        """
+        if self._eof:
+            return False
+        chunk = self._file.read(READ_CHUNK_SIZE)
+        if not chunk:
+            self._eof = True
+            return False
+        # 処理済みの部分は捨てる
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        """
+        空白を読み飛ばして次の1文字を返す（ファイルの終わりなら空文字）
+        """
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise ValueError(f"{self.path}: expected '{char}' at offset {self._pos}")
+        self._pos += 1
+
+    def _decode_value(self):
+        """
+        次の値を1つデコードする（値が途中で切れている場合は読み足して再試行する）
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # 数値などは末尾が切れていても成功するので、バッファの終わりに接していれば読み足す
+            if end == len(self._buffer) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _read_header(self):
+        """
+        replaysの配列の手前までを読み込む
+        """
+        self._expect("{")
+        while self._peek() != "}":
+            key = self._decode_value()
+            self._expect(":")
+            if key == "replays":
+                self._expect("[")
+                self._in_replays = True
+                # replaysの後ろにキーがある場合はreplaysを読み終えてから読む
+                return
+            self.header[key] = self._decode_value()
+            if self._peek() == ",":
+                self._pos += 1
+
+    def _read_trailer(self):
+        """
+        replaysの配列より後ろのキーを読み込む
+        """
+        while self._peek() == ",":
+            self._pos += 1
+            key = self._decode_value()
+            self._expect(":")
+            self.header[key] = self._decode_value()
+        self._expect("}")
+
+    def __iter__(self) -> Iterator[Dict]:
+        if not self._in_replays:
+            return
+        first = True
+        while True:
+            char = self._peek()
+            if char == "]":
+                self._pos += 1
+                break
+            if not first:
+                self._expect(",")
+            yield self._decode_value()
+            first = False
+        self._in_replays = False
+        self._read_trailer()
+
+
+def sort_key(replay: Dict) -> str:
+    """
+    対局の並び順のキー（日時のない対局は最後に並ぶ）
+    """
+    return replay.get("datetime") or ""
+
+
+def is_sorted_file(path: str) -> bool:
+    """
+    ファイルの対局が日時の降順に並んでいるかを、少しずつ読み込んで確認
+    """
+    reader = JsonStreamReader(path)
+    try:
+        previous = None
+        for replay in reader:
+            key = sort_key(replay)
+            if previous is not None and key > previous:
+                return False
+            previous = key
+        return True
+    finally:
+        reader.close()
+
+
+def write_sorted_run(path: str, run_dir: str) -> str:
+    """
+    ファイルの対局を日時の降順に並べ替え、1行に1件のNDJSONの一時ファイルに書き出す
+    （並べ替えのためにメモリに載せるのはこのファイルの対局だけ）
 
     Args:
-        input_files: 入力ファイルのリスト
-        output_file: 出力ファイル名
+        path: JSONファイル
+        run_dir: 一時ファイルを書き出すディレクトリ
+
+    Returns:
+        書き出した一時ファイルのパス
+    """
+    reader = JsonStreamReader(path)
+    try:
+        replays = sorted(reader, key=sort_key, reverse=True)
+    finally:
+        reader.close()
+
+    fd, run_path = tempfile.mkstemp(suffix=".ndjson", dir=run_dir)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for replay in replays:
+            f.write(json.dumps(replay, ensure_ascii=False) + "\n")
+    return run_path
+
+
+def iter_file_replays(path: str, run_path: Optional[str] = None) -> Iterator[Dict]:
+    """
+    ファイルの対局を日時の降順で返す
+
+    Args:
+        path: JSONファイル（日時の降順に並んでいる場合は少しずつ読み込む）
+        run_path: 並べ替え済みの一時ファイル（write_sorted_run の結果）。指定時はこちらを1行ずつ読み込む
+    """
+    if run_path is not None:
+        with open(run_path, "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+        return
+
+    reader = JsonStreamReader(path)
+    try:
+        yield from reader
+    finally:
+        reader.close()
+
+
+def expand_inputs(inputs: List[str], exclude: Optional[str] = None) -> List[str]:
+    """
+    ファイル・globパターン・ディレクトリを入力ファイルのリストに展開
+
+    Args:
+        inputs: ファイル、globパターン、またはディレクトリ
+        exclude: 除外するファイル（出力ファイル）
+
+    Returns:
+        重複を除いた入力ファイルのリスト（指定順）
+    """
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matched = sorted(glob.glob(os.path.join(item, DIRECTORY_PATTERN)))
+        elif glob.has_magic(item):
+            matched = sorted(glob.glob(item))
+        else:
+            matched = [item]
+        if not matched:
+            print(f"警告: ファイルが見つかりません: {item}")
+        paths.extend(matched)
+
+    excluded = os.path.abspath(exclude) if exclude else None
+    unique = []
+    seen: Set[str] = set()
+    for path in paths:
+        absolute = os.path.abspath(path)
+        if absolute in seen or absolute == excluded:
+            continue
+        seen.add(absolute)
+        unique.append(path)
+    return unique
+
+
+def merge_params(headers: List[Dict]) -> Dict:
+    """
+    各ファイルのparamsから、マージしたファイルのparamsを作る
     """
-    all_replays = []
-    seen_game_ids: Set[str] = set()
     user = None
-    month = None
     opponent = None
+    months = set()
+    for header in headers:
+        params = header.get("params") or {}
+        if user is None:
+            user = params.get("user")
+        if opponent is None:
+            opponent = params.get("opponent")
+        if params.get("month"):
+            months.add(params["month"])
+
+    if len(months) > 1:
+        month = f"{min(months)}〜{max(months)}"
+    else:
+        month = next(iter(months), None)
+
+    return {
+        "user": user,
+        "opponent": opponent if opponent else "(all)",
+        "month": month,
+        "gtype": "(all)",
+        "opponent_type": "(all)",
+        "init_pos_type": "(all)",
+        "limit": "(all)"
+    }
+
+
+def merge_json_files(input_files: List[str], output_file: str, max_open_files: int = DEFAULT_MAX_OPEN_FILES) -> int:
+    """
+    複数のJSONファイルをマージして1つのファイルに統合
+    各ファイルの対局（日時の降順）をk-wayマージし、game_idで重複排除しながら書き出す
+
+    Args:
+        input_files: 入力ファイルのリスト（先に指定したファイルの対局が優先される）
+        output_file: 出力ファイル名
+        max_open_files: 同時に開くファイル数の上限（2以上）
 
+    Returns:
+        書き出した対局数
+    """
+    if max_open_files < 2:
+        raise ValueError(f"max_open_files must be at least 2: {max_open_files}")
     print(f"マージ対象ファイル: {len(input_files)}個")
 
+    # 並べ替えた一時ファイルは出力ファイルと同じディレクトリに作り、マージ後に削除する
+    with tempfile.TemporaryDirectory(prefix=".merge_runs_", dir=os.path.dirname(os.path.abspath(output_file))) as run_dir:
+        return _merge_files(input_files, output_file, run_dir, max_open_files)
+
+
+def _iter_tagged(source: tuple) -> Iterator[tuple[Dict, int]]:
+    """
+    マージの入力の対局を (対局, 入力ファイルのインデックス) で返す
+    入力は ("file", 入力ファイルのインデックス, JSONファイル, 並べ替え済みの一時ファイル) か、
+    ("merged", 途中までマージした一時ファイル)
+    """
+    if source[0] == "file":
+        _, index, path, run_path = source
+        for replay in iter_file_replays(path, run_path):
+            yield replay, index
+        return
+
+    with open(source[1], "r", encoding="utf-8") as f:
+        for line in f:
+            index, replay = json.loads(line)
+            yield replay, index
+
+
+def _heap_merge(sources: List[tuple]) -> Iterator[tuple[Dict, int]]:
+    # 同じ日時の対局は入力の順に並ぶ（heapq.mergeは同じキーなら先の入力を優先する）
+    return heapq.merge(
+        *(_iter_tagged(source) for source in sources),
+        key=lambda item: sort_key(item[0]),
+        reverse=True
+    )
+
+
+def _reduce_sources(sources: List[tuple], run_dir: str, max_open_files: int) -> List[tuple]:
+    """
+    入力が同時に開けるファイル数を超える間、max_open_files個ずつ一時ファイルにマージして減らす
+    （重複排除は最後のマージで行うため、途中の一時ファイルには入力ファイルのインデックスとともに全ての対局を書き出す）
+    """
+    while len(sources) > max_open_files:
+        print(f"入力が{len(sources)}個あるため、{max_open_files}個ずつ一時ファイルにマージします")
+        reduced = []
+        for offset in range(0, len(sources), max_open_files):
+            group = sources[offset:offset + max_open_files]
+            if len(group) == 1:
+                reduced.append(group[0])
+                continue
+            fd, run_path = tempfile.mkstemp(suffix=".ndjson", dir=run_dir)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                for replay, index in _heap_merge(group):
+                    f.write(json.dumps([index, replay], ensure_ascii=False) + "\n")
+            # マージし終えた途中の一時ファイルは削除する
+            for source in group:
+                if source[0] == "merged":
+                    os.remove(source[1])
+            reduced.append(("merged", run_path))
+        sources = reduced
+    return sources
+
+
+def _merge_files(input_files: List[str], output_file: str, run_dir: str, max_open_files: int) -> int:
+    files = []
+    headers = []
     for file_path in input_files:
         if not os.path.exists(file_path):
             print(f"警告: ファイルが見つかりません: {file_path}")
             continue
 
-        print(f"\n読み込み中: {file_path}")
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        reader = JsonStreamReader(file_path)
+        headers.append(reader.header)
+        reader.close()
 
-        # paramsから情報を取得
-        params = data.get('params', {})
-        if user is None:
-            user = params.get('user')
-        if month is None:
-            month = params.get('month')
-        if opponent is None:
-            opponent = params.get('opponent')
+        run_path = None
+        with profiling.phase("scan"):
+            if not is_sorted_file(file_path):
+                print(f"日時の降順に並んでいないため、並べ替えて一時ファイルに書き出します: {file_path}")
+                run_path = write_sorted_run(file_path, run_dir)
+        files.append((file_path, run_path))
 
-        # replaysを統合（重複排除）
-        replays = data.get('replays', [])
-        duplicates = 0
-        new_games = 0
+    # ファイルごとの 対局数, 新規追加, 重複スキップ
+    stats = [[0, 0, 0] for _ in files]
 
-        for replay in replays:
-            game_id = replay.get('game_id')
-            if game_id and game_id not in seen_game_ids:
-                all_replays.append(replay)
-                seen_game_ids.add(game_id)
-                new_games += 1
-            else:
-                duplicates += 1
-
-        print(f"  - 対局数: {len(replays)}")
-        print(f"  - 新規追加: {new_games}")
-        print(f"  - 重複スキップ: {duplicates}")
+    # 同じ日時の対局はファイルの指定順に並ぶ
+    sources = [("file", index, path, run_path) for index, (path, run_path) in enumerate(files)]
+    with profiling.phase("merge"):
+        sources = _reduce_sources(sources, run_dir, max_open_files)
+    merged = _heap_merge(sources)
 
-    # 日時順にソート（降順）
-    all_replays.sort(key=lambda x: x.get('datetime', ''), reverse=True)
-
-    # 統合データを作成
-    merged_data = {
-        "params": {
-            "user": user,
-            "opponent": opponent if opponent else "(all)",
-            "month": month,
-            "gtype": "(all)",
-            "opponent_type": "(all)",
-            "init_pos_type": "(all)",
-            "limit": "(all)"
-        },
-        "replays": all_replays
-    }
+    def indent_json(value, level: int) -> str:
+        return json.dumps(value, ensure_ascii=False, indent=2).replace("\n", "\n" + " " * level)
 
-    # ファイルに保存
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(merged_data, f, ensure_ascii=False, indent=2)
+    count = 0
+    # game_idには日時が含まれるので、重複は同じ日時の中だけで調べればよい
+    current_key = None
+    seen_game_ids: Set[str] = set()
+
+    tmp_file = output_file + ".tmp"
+    # 読み込み・マージ・書き出しは遅延評価で一体になっているため、まとめて1つの段階として計測する
+    with profiling.phase("merge"), open(tmp_file, "w", encoding="utf-8") as f:
+        f.write('{\n  "params": ' + indent_json(merge_params(headers), 2) + ',\n  "replays": [')
+        for replay, index in merged:
+            stats[index][0] += 1
+            key = sort_key(replay)
+            if key != current_key:
+                current_key = key
+                seen_game_ids = set()
+
+            game_id = replay.get("game_id")
+            if not game_id or game_id in seen_game_ids:
+                stats[index][2] += 1
+                continue
+            seen_game_ids.add(game_id)
+            stats[index][1] += 1
+
+            f.write(("\n" if count == 0 else ",\n") + "    " + indent_json(replay, 4))
+            count += 1
+        f.write("\n  ]\n}" if count else "]\n}")
+    os.replace(tmp_file, output_file)
+
+    for (file_path, _), (total, new_games, duplicates) in zip(files, stats):
+        print(f"\n{file_path}")
+        print(f"  - 対局数: {total}")
+        print(f"  - 新規追加: {new_games}")
+        print(f"  - 重複スキップ: {duplicates}")
 
     print(f"\n{'='*60}")
     print(f"マージ完了！")
-    print(f"  - 総対局数: {len(all_replays)}")
+    print(f"  - 総対局数: {count}")
     print(f"  - 出力ファイル: {output_file}")
     print(f"{'='*60}\n")
 
+    return count
+
+
 def main():
-    # マージ対象のファイル
-    base_dir = "/Users/ohakado/my_workspace/my_shogiwars/result"
-    input_files = [
-        os.path.join(base_dir, "game_replays_s1_2025-12_ohakado.json"),
-        os.path.join(base_dir, "game_replays_s1_normal_normal_2025-12_ohakado.json"),
-        os.path.join(base_dir, "game_replays_sf_closed_event_normal_2025-12_ohakado.json")
-    ]
+    parser = argparse.ArgumentParser(
+        description="複数の対局データのJSONファイルを1つのファイルにマージ"
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        help=f"入力ファイル・globパターン・ディレクトリ（ディレクトリの場合は {DIRECTORY_PATTERN}）"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        required=True,
+        help="出力ファイル名（入力に含まれていても入力からは除外される）"
+    )
+    parser.add_argument(
+        "--max-open-files",
+        type=int,
+        default=DEFAULT_MAX_OPEN_FILES,
+        help=f"同時に開くファイル数の上限。入力がこれより多い場合は何段階かに分けてマージする (default: {DEFAULT_MAX_OPEN_FILES})"
+    )
+    parser.add_argument(
+        "--backup",
+        default=None,
+        help="マージ後に入力ファイルを移動するバックアップディレクトリ"
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        default=None,
+        help="cProfileとtracemallocで処理段階ごとの関数の処理時間とメモリ確保を計測し、レポートを書き出す（ディレクトリ省略時: tmp/profile/日時）"
+    )
 
-    output_file = os.path.join(base_dir, "game_replays_2025-12_ohakado.json")
+    args = parser.parse_args()
+    if args.max_open_files < 2:
+        parser.error("--max-open-files must be at least 2")
+
+    input_files = expand_inputs(args.inputs, exclude=args.output)
+    if not input_files:
+        print("エラー: マージ対象のファイルがありません")
+        return
 
     # マージ実行
-    merge_json_files(input_files, output_file)
+    if args.profile is not None:
+        profiling.start(args.profile or None)
+    try:
+        merge_json_files(input_files, args.output, args.max_open_files)
+    finally:
+        profiling.stop()
 
     # 古いファイルをバックアップディレクトリに移動
-    backup_dir = os.path.join(base_dir, "backup")
-    os.makedirs(backup_dir, exist_ok=True)
+    if args.backup:
+        os.makedirs(args.backup, exist_ok=True)
 
-    print("古いファイルをバックアップディレクトリに移動中...")
-    for file_path in input_files:
-        if os.path.exists(file_path):
-            filename = os.path.basename(file_path)
-            backup_path = os.path.join(backup_dir, filename)
-            os.rename(file_path, backup_path)
-            print(f"  - {filename} -> backup/{filename}")
+        print("古いファイルをバックアップディレクトリに移動中...")
+        for file_path in input_files:
+            if os.path.exists(file_path):
+                filename = os.path.basename(file_path)
+                backup_path = os.path.join(args.backup, filename)
+                os.rename(file_path, backup_path)
+                print(f"  - {filename} -> {backup_path}")
 
     print("\n完了！")
 
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""
+将棋ウォーズの対局履歴ページを再現するローカルのモックサーバー
+SHOGIWARS_BASE_URL をこのサーバーに向けると、サイトにアクセスせずに巡回・並列取得・最終ページの判定を確認できる
+
+(gtype, opponent_type, init_pos_type) ごとの対局数を指定すると、1ページ10局ずつの履歴ページを返す
+対局がない組み合わせ・範囲外のページには、対局なしの表示（NO_GAMES_MARKERS の先頭）を返す
+Cloudflareで保護されたサイトと同じく、通常のページもチャレンジ用の検出スクリプトを読み込む
+"""
+
+import argparse
+import hashlib
+import http.server
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit, parse_qs
+
+from shogiwars_scraper import NO_GAMES_MARKERS
+
+
+# 1ページの対局数（サイトと同じ）
+PAGE_SIZE = 10
+
+# Cloudflareのチャレンジページ
+CHALLENGE_PAGE = """<!DOCTYPE html>
+<html><head><title>Just a moment...</title></head>
+<body><script src="/cdn-cgi/challenge-platform/h/g/orchestrate/chl_page/v1"></script></body>
+</html>
+"""
+
+
+def _game_item(user: str, month: str, combination: tuple[str, str, str], index: int) -> str:
+    """
+    1局分の要素（対局ごとに異なる対戦相手・日時・勝敗）
+    """
+    seed = int(hashlib.sha1("/".join(combination).encode("utf-8")).hexdigest()[:6], 16)
+    opponent = f"rival{(seed + index) % 1000}"
+    # 新しい順に並ぶように、indexが大きいほど古い日時にする
+    day = 28 - index % 28
+    seconds = 86399 - (index // 28) * 97 - seed % 97
+    timestamp = f"{month.replace('-', '')}{day:02d}_{seconds // 3600:02d}{seconds % 3600 // 60:02d}{seconds % 60:02d}"
+    sente, gote = (user, opponent) if index % 2 == 0 else (opponent, user)
+    result = "sente_win" if index % 3 else "sente_lose"
+    return f"""    <div class="contents_history_item">
+      <div class="game_players">
+        <div class="left_player">
+          <img class="win_lose_img" src="/assets/{result}.png" alt="">
+        </div>
+        <div class="player_names">
+          <div class="player_name_text_left">{sente}</div>
+          <div class="player_dan_text_left">五段</div>
+          <div class="player_name_text_right">{gote}</div>
+          <div class="player_dan_text_right">四段</div>
+        </div>
+        <a class="game_replay_link" href="/games/{sente}-{gote}-{timestamp}?locale=ja">棋譜</a>
+      </div>
+      <div class="game_badges">
+        <a class="badge_text" href="/games/history?tag=%E8%A7%92%E6%8F%9B%E3%82%8F%E3%82%8A&amp;locale=ja">#角換わり</a>
+      </div>
+    </div>
+"""
+
+
+def history_page(user: str, month: str, combination: tuple[str, str, str], page: int, total_games: int) -> str:
+    """
+    履歴ページのHTML
+    """
+    last_page = (total_games + PAGE_SIZE - 1) // PAGE_SIZE
+    indexes = range((page - 1) * PAGE_SIZE, min(total_games, page * PAGE_SIZE))
+    if indexes:
+        items = "".join(_game_item(user, month, combination, index) for index in indexes)
+    else:
+        items = f"    <p class=\"no_games\">{NO_GAMES_MARKERS[0]}</p>\n"
+    links = "".join(
+        f'<a href="/games/history?page={number}&amp;locale=ja">{number}</a>'
+        for number in range(1, last_page + 1)
+    )
+    return f"""<!DOCTYPE html>
+<html lang="ja">
+<head><meta charset="utf-8"><title>対局履歴 | 将棋ウォーズ</title>
+<script src="/cdn-cgi/challenge-platform/scripts/jsd/main.js"></script></head>
+<body>
+  <div class="contents">
+    <div class="contents_history">
+{items}    </div>
+    <div class="pagination">{links}</div>
+  </div>
+</body>
+</html>
+"""
+
+
+class MockHistoryServer:
+    """
+    バックグラウンドのスレッドで動く履歴ページのモックサーバー
+    """
+
+    def __init__(
+        self, games: Dict[tuple[str, str, str], int], port: int = 0, delay: float = 0.0,
+        content_type: str = "text/html; charset=utf-8", challenge: bool = False
+    ):
+        """
+        Args:
+            games: (gtype, opponent_type, init_pos_type) -> 対局数（指定のない組み合わせは対局なし）
+            port: 待ち受けるポート（0なら空いているポート）
+            delay: 1ページを返すまでの遅延（秒）。並列取得の効果を確認する場合に指定する
+            content_type: Content-Typeヘッダー（charsetのない応答の復号を確認する場合は "text/html"）
+            challenge: Trueなら、cf_clearanceのCookieがないリクエストにCloudflareのチャレンジページを返す
+        """
+        self.games = games
+        self.delay = delay
+        self.content_type = content_type
+        self.challenge = challenge
+        # チャレンジページを返したリクエストの数
+        self.challenges = 0
+        # 受け付けたリクエストのURL（パスとクエリ）
+        self.requests: List[str] = []
+        # 同時に処理していたリクエストの最大数（並列に取得されたかの確認用）
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def _handle(self, handler: http.server.BaseHTTPRequestHandler):
+        with self._lock:
+            self.requests.append(handler.path)
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            self._respond(handler)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _respond(self, handler: http.server.BaseHTTPRequestHandler):
+        split = urlsplit(handler.path)
+        if split.path != "/games/history":
+            handler.send_error(404)
+            return
+
+        if self.challenge and "cf_clearance=" not in handler.headers.get("Cookie", ""):
+            with self._lock:
+                self.challenges += 1
+            body = CHALLENGE_PAGE.encode("utf-8")
+            handler.send_response(403)
+            handler.send_header("Content-Type", "text/html; charset=utf-8")
+            handler.send_header("cf-mitigated", "challenge")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+            return
+
+        query = parse_qs(split.query)
+
+        def param(name: str, default: str) -> str:
+            values = query.get(name)
+            return values[0] if values else default
+
+        # "10min"の場合はgtypeパラメータが送信されない
+        combination = (param("gtype", "10min"), param("opponent_type", "normal"), param("init_pos_type", "normal"))
+        body = history_page(
+            param("user_id", ""), param("month", ""), combination, int(param("page", "1")),
+            self.games.get(combination, 0)
+        ).encode("utf-8")
+        if self.delay:
+            time.sleep(self.delay)
+        handler.send_response(200)
+        handler.send_header("Content-Type", self.content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def start(self) -> "MockHistoryServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockHistoryServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="対局履歴ページのモックサーバーを起動"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="待ち受けるポート (default: 8000)"
+    )
+    parser.add_argument(
+        "--games",
+        action="append",
+        default=None,
+        help="組み合わせごとの対局数（例: 10min/normal/normal=35、複数指定可） (default: 10min/normal/normal=35)"
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.0,
+        help="1ページを返すまでの遅延（秒） (default: 0)"
+    )
+
+    args = parser.parse_args()
+
+    games = {}
+    for item in args.games or ["10min/normal/normal=35"]:
+        combination, _, count = item.partition("=")
+        parts = tuple(combination.split("/"))
+        if len(parts) != 3 or not count.isdigit():
+            parser.error(f"--games must be gtype/opponent_type/init_pos_type=count: {item}")
+        games[parts] = int(count)
+
+    server = MockHistoryServer(games, port=args.port, delay=args.delay)
+    print(f"Serving mock history pages at {server.base_url} (SHOGIWARS_BASE_URL={server.base_url})")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
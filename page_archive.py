@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""
+履歴ページのアーカイブ
+取得した履歴ページをgzipで圧縮し、内容のSHA-256をキーに保存する（同じ内容のページは1つだけ保存される）
+(ユーザー, 月, 組み合わせ, ページ) からページへの対応は追記型の索引（NDJSON）に記録する
+
+RecordingFetcher は取得したページをアーカイブに記録し、ReplayFetcher はサイトの代わりにアーカイブからページを返す
+どちらもフェッチャー（fetch(url, page_stats)）として scrape_game_urls にそのまま渡せる
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit, parse_qs
+
+
+# デフォルトのアーカイブの場所
+DEFAULT_ARCHIVE_DIR = "archive"
+
+# 索引のファイル名
+INDEX_FILENAME = "index.ndjson"
+
+# gzipの圧縮レベル（履歴ページは9にしてもほとんど小さくならない）
+COMPRESS_LEVEL = 6
+
+
+def page_key_from_url(url: str) -> tuple[str, str, str, str, str, int]:
+    """
+    履歴ページのURLから (ユーザー, 月, gtype, opponent_type, init_pos_type, ページ) を取り出す
+    """
+    query = parse_qs(urlsplit(url).query)
+
+    def param(name: str, default: Optional[str] = None) -> Optional[str]:
+        values = query.get(name)
+        return values[0] if values else default
+
+    # "10min"の場合はgtypeパラメータが送信されない
+    return (
+        param("user_id"),
+        param("month"),
+        param("gtype", "10min"),
+        param("opponent_type", "normal"),
+        param("init_pos_type", "normal"),
+        int(param("page", "1")),
+    )
+
+
+class PageNotArchived(LookupError):
+    """
+    リプレイ時にアーカイブにないページを要求した
+    """
+
+
+class PageArchive:
+    """
+    履歴ページの圧縮・内容アドレス型のアーカイブ（複数スレッドから記録できる）
+    """
+
+    def __init__(self, path: str = DEFAULT_ARCHIVE_DIR):
+        """
+        Args:
+            path: アーカイブのディレクトリ（なければ作成する）
+        """
+        self.path = path
+        self.index_path = os.path.join(path, INDEX_FILENAME)
+        # ページのキー -> 内容のSHA-256
+        self.index: Dict[tuple, str] = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(path, "objects"), exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 中断時に書きかけになった最後の行は無視する
+                    continue
+                key = (record["user"], record["month"], record["gtype"], record["opponent_type"],
+                       record["init_pos_type"], record["page"])
+                # 同じページを記録し直した場合は新しい方が有効
+                self.index[key] = record["sha256"]
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.path, "objects", digest[:2], digest + ".html.gz")
+
+    def put(self, key: tuple[str, str, str, str, str, int], page_source: str) -> str:
+        """
+        ページを記録
+
+        Args:
+            key: (ユーザー, 月, gtype, opponent_type, init_pos_type, ページ)
+            page_source: ページのHTML
+
+        Returns:
+            内容のSHA-256
+        """
+        data = page_source.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        object_path = self._object_path(digest)
+
+        # 同じ内容がすでにあれば書かない（空のページなどは多くのキーで共有される）
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            # スレッドごとに一時ファイルを分けてから置き換える
+            tmp_path = f"{object_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0))
+            os.replace(tmp_path, object_path)
+
+        user, month, gtype, opponent_type, init_pos_type, page = key
+        record = {
+            "user": user,
+            "month": month,
+            "gtype": gtype,
+            "opponent_type": opponent_type,
+            "init_pos_type": init_pos_type,
+            "page": page,
+            "sha256": digest,
+            "fetched_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        with self._lock:
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.index[key] = digest
+        return digest
+
+    def get(self, key: tuple[str, str, str, str, str, int]) -> str:
+        """
+        記録したページのHTMLを返す（記録がなければPageNotArchived）
+        """
+        digest = self.index.get(key)
+        if digest is None:
+            raise PageNotArchived(f"Page not in archive: {key}")
+        with open(self._object_path(digest), "rb") as f:
+            return gzip.decompress(f.read()).decode("utf-8")
+
+    def users(self) -> List[str]:
+        """
+        記録されているユーザー
+        """
+        return sorted({key[0] for key in self.index})
+
+    def summary(self) -> Dict[tuple[str, str], Dict[str, int]]:
+        """
+        (ユーザー, 月) ごとの組み合わせ数とページ数
+        """
+        combinations: Dict[tuple[str, str], set] = {}
+        pages: Dict[tuple[str, str], int] = {}
+        for user, month, gtype, opponent_type, init_pos_type, _ in self.index:
+            combinations.setdefault((user, month), set()).add((gtype, opponent_type, init_pos_type))
+            pages[(user, month)] = pages.get((user, month), 0) + 1
+        return {
+            key: {"combinations": len(combinations[key]), "pages": pages[key]}
+            for key in sorted(pages)
+        }
+
+
+class RecordingFetcher:
+    """
+    フェッチャーが取得したページをアーカイブに記録する
+    """
+
+    def __init__(self, fetcher, archive: PageArchive):
+        """
+        Args:
+            fetcher: 実際に取得するフェッチャー（SeleniumFetcher/HttpFetcher）
+            archive: 記録先のアーカイブ
+        """
+        self.fetcher = fetcher
+        self.archive = archive
+
+    def fetch(self, url: str, page_stats: Optional[Dict] = None) -> str:
+        # 取得に失敗したページは記録しない（例外はそのまま呼び出し元に返す）
+        page_source = self.fetcher.fetch(url, page_stats)
+        self.archive.put(page_key_from_url(url), page_source)
+        return page_source
+
+
+class ReplayFetcher:
+    """
+    サイトの代わりにアーカイブからページを返す
+    """
+
+    def __init__(self, archive: PageArchive):
+        """
+        Args:
+            archive: 記録済みのアーカイブ
+        """
+        self.archive = archive
+
+    def fetch(self, url: str, page_stats: Optional[Dict] = None) -> str:
+        start = time.monotonic()
+        page_source = self.archive.get(page_key_from_url(url))
+        if page_stats is not None:
+            page_stats["archive_seconds"] = time.monotonic() - start
+        return page_source
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="履歴ページのアーカイブの内容を表示"
+    )
+    parser.add_argument(
+        "archive",
+        nargs="?",
+        default=DEFAULT_ARCHIVE_DIR,
+        help=f"アーカイブのディレクトリ (default: {DEFAULT_ARCHIVE_DIR})"
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(os.path.join(args.archive, INDEX_FILENAME)):
+        print(f"エラー: アーカイブが見つかりません: {args.archive}")
+        return
+
+    archive = PageArchive(args.archive)
+    summary = archive.summary()
+    for (user, month), counts in summary.items():
+        print(f"{user} {month}: {counts['combinations']} combinations, {counts['pages']} pages")
+
+    objects = set(archive.index.values())
+    stored_bytes = sum(os.path.getsize(archive._object_path(digest)) for digest in objects)
+    print(f"\n{len(archive.index)} pages, {len(objects)} unique objects, {stored_bytes / 1024:.0f} KB compressed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+--profile 用のプロファイラー
+処理段階（phase）ごとにcProfileで関数ごとの処理時間を、tracemallocでメモリ確保の多い行を集計する
+
+処理段階が入れ子になった場合、cProfileは内側の段階の間は外側の段階の計測を止める（時間は内側の段階だけに数える）
+tracemallocの確保量は段階の開始時と終了時の差分で、内側の段階の確保も含む
+
+計測するのはプロファイリングを開始したスレッド（メインスレッド）の段階だけで、ワーカースレッドや
+asyncio.to_thread の中の段階は計測しない（Python 3.12以降のcProfileは同時に1つしか有効にできないため）
+ページの巡回と解析を計測する場合は --workers 1 の sync エンジンで実行する
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from typing import List, Dict, Optional
+
+
+# --profile でディレクトリを省略した場合の出力先
+DEFAULT_PROFILE_DIR = os.path.join("tmp", "profile")
+
+# レポートに載せる関数と確保箇所の数
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 20
+
+# tracemallocで保存するスタックの深さ
+TRACEMALLOC_FRAMES = 1
+
+
+class Profiler:
+    """
+    処理段階ごとのcProfileとtracemallocの集計
+    """
+
+    def __init__(self, output_dir: str):
+        """
+        Args:
+            output_dir: レポートの出力先ディレクトリ
+        """
+        self.output_dir = output_dir
+        # 処理段階 -> 計測済みのcProfile（呼び出しごと・スレッドごと）
+        self.profiles: Dict[str, List[cProfile.Profile]] = {}
+        # 処理段階 -> {確保箇所 -> 確保量の増分（バイト）}
+        self.allocations: Dict[str, Dict[str, int]] = {}
+        # 処理段階 -> 呼び出し回数
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # 実行中の処理段階のcProfileのスタック（計測するスレッドのみ）
+        self._stack: List[cProfile.Profile] = []
+        # 計測するスレッド（start() を呼んだスレッド）
+        self._thread_id: Optional[int] = None
+        # cProfileを有効にできなかった場合に一度だけ警告する
+        self._warned = False
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        withブロックを処理段階として計測（計測するスレッド以外では何もしない）
+        計測に失敗しても、withブロックの処理は止めない
+        """
+        if threading.get_ident() != self._thread_id:
+            yield
+            return
+
+        stack = self._stack
+        # 同時に有効にできるcProfileは1つなので、外側の段階は止める
+        if stack:
+            stack[-1].disable()
+        profile = cProfile.Profile()
+        before = tracemalloc.take_snapshot()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # 他のプロファイラーが有効な場合など
+            if not self._warned:
+                self._warned = True
+                print(f"Warning: profiling phase '{name}' skipped: {e}")
+            if stack:
+                stack[-1].enable()
+            yield
+            return
+
+        stack.append(profile)
+        try:
+            yield
+        finally:
+            profile.disable()
+            after = tracemalloc.take_snapshot()
+            stack.pop()
+            if stack:
+                stack[-1].enable()
+            self._record(name, profile, after.compare_to(before, "lineno"))
+
+    def _record(self, name: str, profile: cProfile.Profile, diffs):
+        with self._lock:
+            self.profiles.setdefault(name, []).append(profile)
+            self.calls[name] = self.calls.get(name, 0) + 1
+            sites = self.allocations.setdefault(name, {})
+            for diff in diffs:
+                if diff.size_diff <= 0:
+                    continue
+                frame = diff.traceback[0]
+                site = f"{frame.filename}:{frame.lineno}"
+                sites[site] = sites.get(site, 0) + diff.size_diff
+
+    def write_reports(self) -> List[str]:
+        """
+        処理段階ごとのレポートを書き出す
+
+        Returns:
+            書き出したファイルのパス
+        """
+        tracemalloc.stop()
+        os.makedirs(self.output_dir, exist_ok=True)
+        written = []
+
+        with self._lock:
+            for name, profiles in self.profiles.items():
+                stats = pstats.Stats(profiles[0])
+                for profile in profiles[1:]:
+                    stats.add(profile)
+
+                # snakevizなどで開けるバイナリ形式
+                pstats_path = os.path.join(self.output_dir, f"{name}.pstats")
+                stats.dump_stats(pstats_path)
+                written.append(pstats_path)
+
+                text = io.StringIO()
+                text.write(f"phase: {name} ({self.calls[name]} calls)\n\n")
+                stats.stream = text
+                stats.strip_dirs()
+                for sort_key in ("cumulative", "tottime"):
+                    text.write(f"=== top {TOP_FUNCTIONS} by {sort_key} ===\n")
+                    stats.sort_stats(sort_key).print_stats(TOP_FUNCTIONS)
+
+                text.write(f"=== top {TOP_ALLOCATIONS} allocation sites (net growth during the phase) ===\n")
+                sites = sorted(self.allocations.get(name, {}).items(), key=lambda item: item[1], reverse=True)
+                for site, size in sites[:TOP_ALLOCATIONS]:
+                    text.write(f"{size / 1024:>12.1f} KB  {site}\n")
+
+                report_path = os.path.join(self.output_dir, f"{name}.txt")
+                with open(report_path, "w", encoding="utf-8") as f:
+                    f.write(text.getvalue())
+                written.append(report_path)
+
+        return written
+
+    def print_summary(self):
+        """
+        処理段階ごとの呼び出し回数・処理時間・確保量の増分を表示
+        """
+        print(f"\n{'phase':<14} {'calls':>6} {'seconds':>9} {'net alloc':>12}")
+        print("-" * 44)
+        with self._lock:
+            for name, profiles in self.profiles.items():
+                stats = pstats.Stats(profiles[0])
+                for profile in profiles[1:]:
+                    stats.add(profile)
+                allocated = sum(self.allocations.get(name, {}).values())
+                print(f"{name:<14} {self.calls[name]:>6} {stats.total_tt:>8.2f}s {allocated / 1024:>9.0f} KB")
+
+
+# 有効なプロファイラー（--profile を指定していなければNone）
+_active: Optional[Profiler] = None
+
+
+def start(output_dir: Optional[str] = None) -> Profiler:
+    """
+    プロファイリングを開始（以降、phase() で囲んだ処理が計測される）
+
+    Args:
+        output_dir: レポートの出力先（Noneなら tmp/profile/YYYYmmdd_HHMMSS）
+    """
+    global _active
+    if output_dir is None:
+        output_dir = os.path.join(DEFAULT_PROFILE_DIR, datetime.now().strftime("%Y%m%d_%H%M%S"))
+    _active = Profiler(output_dir)
+    _active.start()
+    print(f"Profiling enabled (cProfile + tracemalloc): reports will be written to {output_dir}")
+    return _active
+
+
+def stop():
+    """
+    プロファイリングを終了してレポートを書き出す
+    """
+    global _active
+    if _active is None:
+        return
+    profiler, _active = _active, None
+    started = time.monotonic()
+    profiler.print_summary()
+    written = profiler.write_reports()
+    print(f"Profile reports written to {profiler.output_dir} ({len(written)} files, "
+          f"{time.monotonic() - started:.1f}s)")
+
+
+def phase(name: str):
+    """
+    処理段階を計測するコンテキストマネージャ（プロファイリングが無効なら何もしない）
+    """
+    if _active is None:
+        return nullcontext()
+    return _active.phase(name)
@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+"""
+対局データの転置索引
+戦型バッジ・対局者名・段位・勝敗・月の値ごとに、その値を持つ対局の位置のリスト（ポスティングリスト）を保存し、
+全対局を走査せずにAND/OR/NOTの組み合わせで絞り込む
+
+ポスティングリストは、件数が少ない値は位置の昇順の配列（array('I')）、多い値はビットマップで保存する
+検索時はビットマップをPythonのintとして扱い、AND/ORは整数のビット演算1回で計算する
+
+ファイル形式:
+    MAGIC (8バイト) + マニフェストの長さ (4バイト, little endian) + マニフェスト (JSON)
+    + 8バイト境界に揃えた各ポスティングリストとgame_idの一覧
+"""
+
+import argparse
+import glob
+import json
+import os
+import struct
+import sys
+import time
+from array import array
+from typing import List, Dict, Iterable, Iterator, Optional
+
+from merge_json import JsonStreamReader
+
+
+MAGIC = b"SWIDX1\n\0"
+
+# デフォルトの索引ファイル
+DEFAULT_INDEX_PATH = os.path.join("result", "replays.index")
+
+# 索引を作る項目
+FIELDS = {
+    "badge": "戦型バッジ",
+    "player": "対局者名（先手・後手のどちらか）",
+    "sente": "先手の名前",
+    "gote": "後手の名前",
+    "class": "段位（先手・後手のどちらか）",
+    "sente_class": "先手の段位",
+    "gote_class": "後手の段位",
+    "win": "勝った対局者の名前",
+    "lose": "負けた対局者の名前",
+    "month": "対局の月（YYYY-MM）",
+}
+
+# 位置の配列（4バイト/件）がビットマップ（全対局数/8バイト）より小さい間は配列で保存する
+_SPARSE_RATIO = 32
+
+# バイト値 -> 立っているビットの位置
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+
+
+class PostingList:
+    """
+    対局の位置の集合（位置の昇順の配列またはビットマップ）
+    """
+
+    __slots__ = ("total", "_positions", "_bits")
+
+    def __init__(self, total: int, positions: Optional[array] = None, bits: Optional[int] = None):
+        """
+        Args:
+            total: 全対局数（NOTの計算に使う）
+            positions: 位置の昇順の配列
+            bits: 位置をビットとして立てた整数
+        """
+        self.total = total
+        self._positions = positions
+        self._bits = bits
+
+    @property
+    def bits(self) -> int:
+        if self._bits is None:
+            bitmap = bytearray((self.total + 7) // 8)
+            for position in self._positions:
+                bitmap[position >> 3] |= 1 << (position & 7)
+            self._bits = int.from_bytes(bitmap, "little")
+        return self._bits
+
+    def _is_sparse(self) -> bool:
+        return self._positions is not None and self._bits is None
+
+    def __len__(self) -> int:
+        if self._bits is not None:
+            # int.bit_count() はPython 3.10以降なので、3.9でも動くように数える
+            return bin(self._bits).count("1")
+        return len(self._positions)
+
+    def __and__(self, other: "PostingList") -> "PostingList":
+        if self._is_sparse() and other._is_sparse():
+            small, large = sorted((self._positions, other._positions), key=len)
+            members = set(large)
+            return PostingList(self.total, positions=array("I", (p for p in small if p in members)))
+        if self._is_sparse() or other._is_sparse():
+            # 少ない方の位置だけをビットマップで確認する
+            sparse, dense = (self, other) if self._is_sparse() else (other, self)
+            bitmap = dense.bits.to_bytes((self.total + 7) // 8, "little")
+            return PostingList(self.total, positions=array(
+                "I", (p for p in sparse._positions if bitmap[p >> 3] >> (p & 7) & 1)
+            ))
+        return PostingList(self.total, bits=self.bits & other.bits)
+
+    def __or__(self, other: "PostingList") -> "PostingList":
+        if self._is_sparse() and other._is_sparse() and (len(self) + len(other)) * _SPARSE_RATIO < self.total:
+            return PostingList(self.total, positions=array("I", sorted(set(self._positions) | set(other._positions))))
+        return PostingList(self.total, bits=self.bits | other.bits)
+
+    def __invert__(self) -> "PostingList":
+        return PostingList(self.total, bits=self.bits ^ ((1 << self.total) - 1))
+
+    def positions(self, limit: Optional[int] = None) -> List[int]:
+        """
+        位置の昇順のリスト（limit件まで）
+        """
+        if self._positions is not None:
+            return list(self._positions[:limit])
+        result = []
+        for byte_index, byte in enumerate(self._bits.to_bytes((self.total + 7) // 8, "little")):
+            if not byte:
+                continue
+            for bit in _BYTE_BITS[byte]:
+                result.append(byte_index * 8 + bit)
+            if limit is not None and len(result) >= limit:
+                return result[:limit]
+        return result
+
+
+def _game_terms(replay: Dict) -> Iterator[tuple[str, str]]:
+    """
+    対局が索引に持つ (項目, 値)
+    """
+    for badge in replay.get("badges") or []:
+        yield "badge", badge
+    for side in ("sente", "gote"):
+        player = replay.get(side) or {}
+        name = player.get("name")
+        class_name = player.get("class")
+        if name:
+            yield "player", name
+            yield side, name
+            if player.get("result") in ("win", "lose"):
+                yield player["result"], name
+        if class_name:
+            yield "class", class_name
+            yield f"{side}_class", class_name
+    if replay.get("datetime"):
+        yield "month", replay["datetime"][:7]
+
+
+def build_index(replays: Iterable[Dict], output_file: str, sources: Optional[List[str]] = None) -> int:
+    """
+    対局データから索引ファイルを作る（同じgame_idの対局は最初の1件だけを使う）
+
+    Args:
+        replays: 対局データ
+        output_file: 索引ファイル
+        sources: 元のファイル（索引が古くなったかの確認用にサイズと更新時刻を記録する）
+
+    Returns:
+        索引に含めた対局数
+    """
+    postings: Dict[str, Dict[str, array]] = {field: {} for field in FIELDS}
+    game_ids: List[str] = []
+    seen = set()
+
+    for replay in replays:
+        game_id = replay.get("game_id")
+        if not game_id or game_id in seen:
+            continue
+        seen.add(game_id)
+        position = len(game_ids)
+        game_ids.append(game_id)
+        for field, value in set(_game_terms(replay)):
+            postings[field].setdefault(value, array("I")).append(position)
+
+    total = len(game_ids)
+    blobs = []
+    offset = 0
+
+    def add_blob(data: bytes) -> Dict:
+        nonlocal offset
+        spec = {"offset": offset, "size": len(data)}
+        padding = -len(data) % 8
+        blobs.append(data + b"\0" * padding)
+        offset += len(data) + padding
+        return spec
+
+    fields = {}
+    for field, values in postings.items():
+        fields[field] = {}
+        for value, positions in sorted(values.items()):
+            if len(positions) * _SPARSE_RATIO < total:
+                spec = add_blob(positions.tobytes())
+                spec["kind"] = "array"
+            else:
+                spec = add_blob(PostingList(total, positions=positions).bits.to_bytes((total + 7) // 8, "little"))
+                spec["kind"] = "bitmap"
+            spec["count"] = len(positions)
+            fields[field][value] = spec
+
+    manifest = {
+        "version": 1,
+        "count": total,
+        "byteorder": sys.byteorder,
+        "sources": [
+            {"path": path, "size": os.path.getsize(path), "mtime": os.path.getmtime(path)}
+            for path in (sources or [])
+        ],
+        "game_ids": add_blob("\n".join(game_ids).encode("utf-8")),
+        "fields": fields,
+    }
+    manifest_bytes = json.dumps(manifest, ensure_ascii=False).encode("utf-8")
+    header_size = len(MAGIC) + 4 + len(manifest_bytes)
+    header_padding = -header_size % 8
+
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(manifest_bytes)))
+        f.write(manifest_bytes)
+        f.write(b"\0" * header_padding)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_file, output_file)
+
+    print(f"Indexed {total} games into {output_file} "
+          f"({sum(len(values) for values in fields.values())} terms, {os.path.getsize(output_file) / 1024:.0f} KB)")
+    return total
+
+
+def build_index_files(input_files: List[str], output_file: str = DEFAULT_INDEX_PATH) -> int:
+    """
+    JSONファイルを少しずつ読み込んで索引を作る（先に指定したファイルの対局が優先される）
+    """
+    def iter_replays():
+        for path in input_files:
+            reader = JsonStreamReader(path)
+            try:
+                yield from reader
+            finally:
+                reader.close()
+
+    return build_index(iter_replays(), output_file, sources=input_files)
+
+
+class ReplayIndex:
+    """
+    索引ファイルの読み込みと検索（ポスティングリストは最初に使うときに読み込む）
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path}: not a replay index file")
+            (length,) = struct.unpack("<I", f.read(4))
+            self.manifest = json.loads(f.read(length).decode("utf-8"))
+            header_size = len(MAGIC) + 4 + length
+            f.seek(header_size + (-header_size % 8))
+            self._data = f.read()
+        self.path = path
+        self.total = self.manifest["count"]
+        self._swap = self.manifest["byteorder"] != sys.byteorder
+        self._cache: Dict[tuple[str, str], PostingList] = {}
+        self._game_ids: Optional[List[str]] = None
+
+    def _blob(self, spec: Dict) -> bytes:
+        return self._data[spec["offset"]:spec["offset"] + spec["size"]]
+
+    def values(self, field: str) -> Dict[str, int]:
+        """
+        項目の値 -> 対局数
+        """
+        if field not in self.manifest["fields"]:
+            raise ValueError(f"unknown field: {field} (available: {', '.join(FIELDS)})")
+        return {value: spec["count"] for value, spec in self.manifest["fields"][field].items()}
+
+    def lookup(self, field: str, value: str) -> PostingList:
+        """
+        項目が値に一致する対局（値がない場合は空）
+        """
+        key = (field, value)
+        if key in self._cache:
+            return self._cache[key]
+        if field not in self.manifest["fields"]:
+            raise ValueError(f"unknown field: {field} (available: {', '.join(FIELDS)})")
+        spec = self.manifest["fields"][field].get(value)
+        if spec is None:
+            postings = PostingList(self.total, positions=array("I"))
+        elif spec["kind"] == "array":
+            positions = array("I")
+            positions.frombytes(self._blob(spec))
+            if self._swap:
+                positions.byteswap()
+            postings = PostingList(self.total, positions=positions)
+        else:
+            postings = PostingList(self.total, bits=int.from_bytes(self._blob(spec), "little"))
+        self._cache[key] = postings
+        return postings
+
+    def query(self, expression: str) -> PostingList:
+        """
+        検索式に一致する対局
+
+        検索式: 項目:値 を AND / OR / NOT と括弧で組み合わせる（項目を並べただけの場合はAND）
+            例: badge:角換わり AND (gote:ohakado OR sente:ohakado) AND NOT class:初段
+        """
+        parser = _QueryParser(self, _tokenize(expression))
+        return parser.parse()
+
+    def game_ids(self, postings: PostingList, limit: Optional[int] = None) -> List[str]:
+        """
+        ポスティングリストの対局のgame_id（索引を作ったときの順、limit件まで）
+        """
+        if self._game_ids is None:
+            self._game_ids = self._blob(self.manifest["game_ids"]).decode("utf-8").split("\n")
+        return [self._game_ids[position] for position in postings.positions(limit)]
+
+    def is_stale(self) -> bool:
+        """
+        索引を作った後に元のファイルが変更・削除されたか
+        """
+        for source in self.manifest["sources"]:
+            path = source["path"]
+            if not os.path.exists(path):
+                return True
+            if os.path.getsize(path) != source["size"] or os.path.getmtime(path) != source["mtime"]:
+                return True
+        return False
+
+
+def _tokenize(expression: str) -> List[str]:
+    return expression.replace("(", " ( ").replace(")", " ) ").split()
+
+
+class _QueryParser:
+    """
+    検索式の再帰下降パーサー（優先順位: NOT > AND > OR）
+    """
+
+    def __init__(self, index: ReplayIndex, tokens: List[str]):
+        self.index = index
+        self.tokens = tokens
+        self.pos = 0
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def parse(self) -> PostingList:
+        result = self._or()
+        if self._peek() is not None:
+            raise ValueError(f"unexpected token: {self._peek()}")
+        return result
+
+    def _or(self) -> PostingList:
+        result = self._and()
+        while self._peek() == "OR":
+            self.pos += 1
+            result = result | self._and()
+        return result
+
+    def _and(self) -> PostingList:
+        result = self._not()
+        while self._peek() not in (None, "OR", ")"):
+            if self._peek() == "AND":
+                self.pos += 1
+            result = result & self._not()
+        return result
+
+    def _not(self) -> PostingList:
+        if self._peek() == "NOT":
+            self.pos += 1
+            return ~self._not()
+        return self._term()
+
+    def _term(self) -> PostingList:
+        token = self._peek()
+        if token is None:
+            raise ValueError("unexpected end of query")
+        self.pos += 1
+        if token == "(":
+            result = self._or()
+            if self._peek() != ")":
+                raise ValueError("missing ')'")
+            self.pos += 1
+            return result
+        field, separator, value = token.partition(":")
+        if not separator:
+            raise ValueError(f"expected field:value, got {token}")
+        return self.index.lookup(field, value)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="対局データの転置索引（作成・検索）"
+    )
+    parser.add_argument(
+        "--index",
+        default=DEFAULT_INDEX_PATH,
+        help=f"索引ファイル (default: {DEFAULT_INDEX_PATH})"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="JSONファイルから索引を作る")
+    build_parser.add_argument(
+        "paths",
+        nargs="*",
+        help="JSONファイル (default: result/game_replays_*.json)"
+    )
+
+    query_parser = subparsers.add_parser("query", help="検索式に一致する対局のgame_idを表示する")
+    query_parser.add_argument(
+        "expression",
+        help="検索式（例: 'badge:角換わり AND (sente:ohakado OR gote:ohakado)'）"
+    )
+    query_parser.add_argument("--limit", type=int, default=None, help="表示する最大件数")
+    query_parser.add_argument("--count", action="store_true", help="件数だけを表示する")
+
+    values_parser = subparsers.add_parser("values", help="項目の値と対局数を表示する")
+    values_parser.add_argument("field", choices=list(FIELDS), help="項目")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        paths = args.paths or sorted(glob.glob(os.path.join("result", "game_replays_*.json")))
+        build_index_files(paths, args.index)
+        return
+
+    index = ReplayIndex(args.index)
+    if index.is_stale():
+        print(f"警告: 索引を作った後に元のファイルが変更されています（build で作り直してください）", file=sys.stderr)
+
+    if args.command == "values":
+        for value, count in sorted(index.values(args.field).items(), key=lambda item: -item[1]):
+            print(f"{count:>7}  {value}")
+        return
+
+    start = time.perf_counter()
+    try:
+        postings = index.query(args.expression)
+    except ValueError as e:
+        print(f"エラー: {e}")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start
+
+    if not args.count:
+        for game_id in index.game_ids(postings, args.limit):
+            print(game_id)
+    print(f"{len(postings)}件 ({elapsed * 1000:.3f} ms)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+"""
+対局データの集計（ロールアップ）
+出力ファイルごとに、月 × gtype × opponent_type × 先手/後手 × 戦型バッジ × 相手の段位 ごとの勝敗数と、
+月 × 対戦相手 ごとの勝敗数を保持し、新しく追加された対局の分だけ更新する
+ダッシュボードなどは対局の一覧を走査する代わりに、この集計を足し合わせて答えられる
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+from typing import List, Dict, Callable, Iterable, Optional, Set
+
+from merge_json import JsonStreamReader
+
+
+ROLLUP_VERSION = 2
+
+# 全対局の出力ファイルの集計を表す対戦相手の値（scraperの検索パラメータと同じ）
+ALL_OPPONENTS = "(all)"
+
+# 戦型バッジの次元で、バッジによらない全対局を表す値
+# （1局に複数のバッジがあるため、バッジごとの行を足すと対局数が重複する）
+ALL_BADGES = "*"
+
+# 集計の次元（cellsの各行の先頭に並ぶ順）
+DIMENSIONS = ["month", "gtype", "opponent_type", "side", "badge", "opponent_class"]
+
+RESULTS = ("win", "lose", "draw")
+
+
+def rollup_path(output_file: str) -> str:
+    """
+    出力ファイルに対応する集計ファイルのパス（result/game_replays_2024-10_ohakado.rollup）
+    game_replays_*.json のglobに含まれないように拡張子を変える
+    """
+    return os.path.splitext(output_file)[0] + ".rollup"
+
+
+class ReplayRollup:
+    """
+    1人のユーザーから見た勝敗数の集計
+    """
+
+    def __init__(self, user: str, month: Optional[str] = None, opponent: str = ALL_OPPONENTS):
+        """
+        Args:
+            user: 集計の視点となるユーザーID（先手/後手・勝敗・相手の段位はこのユーザーから見た値）
+            month: 出力ファイルの対象月
+            opponent: 出力ファイルの対戦相手（全対局の出力ファイルなら ALL_OPPONENTS）
+        """
+        self.user = user
+        self.month = month
+        self.opponent = opponent
+        # (month, gtype, opponent_type, side, badge, opponent_class) -> [win, lose, draw]
+        self.cells: Dict[tuple, List[int]] = {}
+        # (month, 対戦相手) -> [win, lose, draw]
+        self.opponents: Dict[tuple, List[int]] = {}
+        # 集計済みのgame_id -> (gtype, opponent_type)（作り直すときに、今回取得していない対局の組み合わせに使う）
+        self.games: Dict[str, tuple[str, str]] = {}
+
+    @classmethod
+    def load(cls, path: str, user: str, month: Optional[str] = None, opponent: str = ALL_OPPONENTS) -> "ReplayRollup":
+        """
+        集計ファイルを読み込む（ファイルがない場合や、形式・ユーザーが異なる場合は空の集計）
+        """
+        rollup = cls(user, month, opponent)
+        if not os.path.exists(path):
+            return rollup
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != ROLLUP_VERSION or data.get("user") != user:
+            return rollup
+
+        for row in data["cells"]:
+            rollup.cells[tuple(row[:len(DIMENSIONS)])] = list(row[len(DIMENSIONS):])
+        for row in data["opponents"]:
+            rollup.opponents[tuple(row[:2])] = list(row[2:])
+        rollup.games = {game_id: tuple(combination) for game_id, combination in data["games"].items()}
+        return rollup
+
+    def save(self, path: str):
+        """
+        集計ファイルを書き出す（一時ファイルから置き換える）
+        """
+        data = {
+            "version": ROLLUP_VERSION,
+            "user": self.user,
+            "month": self.month,
+            "opponent": self.opponent,
+            "dimensions": DIMENSIONS,
+            "results": list(RESULTS),
+            "cells": [list(key) + counts for key, counts in sorted(self.cells.items(), key=_sort_key)],
+            "opponents": [list(key) + counts for key, counts in sorted(self.opponents.items(), key=_sort_key)],
+            "games": {game_id: list(self.games[game_id]) for game_id in sorted(self.games)},
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def add(self, replay: Dict, gtype: str, opponent_type: str) -> bool:
+        """
+        1局を集計に加える
+
+        Args:
+            replay: 対局データ
+            gtype: 対局のゲームタイプ
+            opponent_type: 対局の対戦相手タイプ
+
+        Returns:
+            加えた場合True（集計済みの対局や、ユーザーが対局者でない対局はFalse）
+        """
+        game_id = replay.get("game_id")
+        if not game_id or game_id in self.games:
+            return False
+
+        sente = replay.get("sente") or {}
+        gote = replay.get("gote") or {}
+        if sente.get("name") == self.user:
+            side, player, opponent = "sente", sente, gote
+        elif gote.get("name") == self.user:
+            side, player, opponent = "gote", gote, sente
+        else:
+            return False
+
+        result = player.get("result")
+        if result not in RESULTS:
+            return False
+        column = RESULTS.index(result)
+        month = (replay.get("datetime") or "")[:7] or None
+
+        for badge in [ALL_BADGES] + list(dict.fromkeys(replay.get("badges") or [])):
+            key = (month, gtype, opponent_type, side, badge, opponent.get("class"))
+            self.cells.setdefault(key, [0, 0, 0])[column] += 1
+        self.opponents.setdefault((month, opponent.get("name")), [0, 0, 0])[column] += 1
+        self.games[game_id] = (gtype, opponent_type)
+        return True
+
+    def query(self, group_by: Optional[str] = None, **filters) -> Dict[Optional[str], Dict]:
+        """
+        条件に合う集計を足し合わせる
+
+        Args:
+            group_by: 結果を分ける次元（DIMENSIONSのいずれか、"opponent"、またはNone）
+            **filters: 次元 -> 値（badgeを指定しない場合は全対局の行を使う）
+
+        Returns:
+            group_byの値 -> {"games", "win", "lose", "draw", "win_rate"}（group_byがNoneならキーはNone）
+        """
+        totals: Dict[Optional[str], List[int]] = {}
+
+        if group_by == "opponent":
+            if set(filters) - {"month"}:
+                raise ValueError("only month can be combined with group_by='opponent'")
+            for (month, opponent), counts in self.opponents.items():
+                if "month" in filters and month != filters["month"]:
+                    continue
+                _accumulate(totals, opponent, counts)
+            return {key: _summary(counts) for key, counts in totals.items()}
+
+        unknown = set(filters) - set(DIMENSIONS)
+        if unknown or (group_by is not None and group_by not in DIMENSIONS):
+            raise ValueError(f"unknown dimension: {', '.join(sorted(unknown)) or group_by}")
+        # バッジで分けない場合は全対局の行だけを使う（バッジごとの行は対局が重複する）
+        if group_by != "badge" and "badge" not in filters:
+            filters = {**filters, "badge": ALL_BADGES}
+
+        positions = {name: index for index, name in enumerate(DIMENSIONS)}
+        for key, counts in self.cells.items():
+            if any(key[positions[name]] != value for name, value in filters.items()):
+                continue
+            if group_by == "badge" and key[positions["badge"]] == ALL_BADGES:
+                continue
+            _accumulate(totals, key[positions[group_by]] if group_by else None, counts)
+        return {key: _summary(counts) for key, counts in totals.items()}
+
+
+def _sort_key(item):
+    # Noneを含むキーを並べ替えられるように文字列にする
+    return tuple("" if value is None else str(value) for value in item[0])
+
+
+def _accumulate(totals: Dict, key, counts: List[int]):
+    current = totals.setdefault(key, [0, 0, 0])
+    for index, count in enumerate(counts):
+        current[index] += count
+
+
+def _summary(counts: List[int]) -> Dict:
+    win, lose, draw = counts
+    games = win + lose + draw
+    return {
+        "games": games,
+        "win": win,
+        "lose": lose,
+        "draw": draw,
+        "win_rate": win / (win + lose) if win + lose else None,
+    }
+
+
+class RollupUpdate:
+    """
+    出力ファイルを書き出しながら、その対局を集計に加える（集計のために出力ファイルを読み直さない）
+    書き出した対局を全て add に渡してから finish を呼ぶ
+    """
+
+    def __init__(
+        self,
+        output_file: str,
+        user: str,
+        default_combination: tuple[str, str],
+        game_combinations: Optional[Dict[str, tuple[str, str]]] = None,
+        month: Optional[str] = None,
+        opponent: str = ALL_OPPONENTS
+    ):
+        """
+        Args:
+            output_file: 出力ファイル（集計は rollup_path(output_file) に保存する）
+            user: 集計の視点となるユーザーID
+            default_combination: 組み合わせが分からない対局の (gtype, opponent_type)
+            game_combinations: 今回取得した対局の game_id -> (gtype, opponent_type)
+            month: 出力ファイルの対象月
+            opponent: 出力ファイルの対戦相手（全対局の出力ファイルなら ALL_OPPONENTS）
+        """
+        self.path = rollup_path(output_file)
+        self.default_combination = default_combination
+        self.game_combinations = game_combinations or {}
+        self.rollup = ReplayRollup.load(self.path, user, month, opponent)
+        self.added = 0
+        self._seen: Set[str] = set()
+
+    def _combination_of(self, replay: Dict, previous: Dict[str, tuple[str, str]]) -> tuple[str, str]:
+        # 今回取得した対局の組み合わせ、前回集計したときの組み合わせ、パラメータの値の順に使う
+        game_id = replay.get("game_id")
+        return self.game_combinations.get(game_id) or previous.get(game_id) or self.default_combination
+
+    def add(self, replay: Dict):
+        """
+        出力ファイルに書き出した1局を渡す（集計済みの対局は数えない）
+        """
+        self._seen.add(replay.get("game_id"))
+        if self.rollup.add(replay, *self._combination_of(replay, self.rollup.games)):
+            self.added += 1
+
+    def finish(self, iter_replays: Callable[[], Iterable[Dict]]) -> tuple[int, bool]:
+        """
+        集計ファイルを保存する
+
+        Args:
+            iter_replays: 出力ファイルの全ての対局を返す関数（作り直す場合だけ呼ばれる）
+
+        Returns:
+            (加えた対局数, 作り直したか)
+        """
+        # 集計済みの対局が出力ファイルから消えている場合（--limit で取得し直した場合など）は作り直す
+        rebuilt = not self.rollup.games.keys() <= self._seen
+        if rebuilt:
+            previous = self.rollup.games
+            self.rollup = ReplayRollup(self.rollup.user, self.rollup.month, self.rollup.opponent)
+            self.added = sum(
+                1 for replay in iter_replays() if self.rollup.add(replay, *self._combination_of(replay, previous))
+            )
+
+        self.rollup.save(self.path)
+        return self.added, rebuilt
+
+
+def update_rollup(
+    output_file: str,
+    user: str,
+    iter_replays: Callable[[], Iterable[Dict]],
+    default_combination: tuple[str, str],
+    game_combinations: Optional[Dict[str, tuple[str, str]]] = None,
+    month: Optional[str] = None,
+    opponent: str = ALL_OPPONENTS
+) -> tuple[int, bool]:
+    """
+    出力ファイルの集計を、まだ集計していない対局の分だけ更新する（引数は RollupUpdate と同じ）
+
+    Returns:
+        (加えた対局数, 作り直したか)
+    """
+    update = RollupUpdate(output_file, user, default_combination, game_combinations, month, opponent)
+    for replay in iter_replays():
+        update.add(replay)
+    return update.finish(iter_replays)
+
+
+def build_rollup_file(input_file: str) -> tuple[int, bool]:
+    """
+    保存済みのJSONファイルの集計を作る（組み合わせはファイルのparamsの値、全組み合わせモードのファイルでは "(all)"）
+    前回の集計に記録された対局の組み合わせは引き継ぐ
+    """
+    reader = JsonStreamReader(input_file)
+    params = reader.header.get("params") or {}
+    reader.close()
+
+    def iter_replays():
+        file_reader = JsonStreamReader(input_file)
+        try:
+            yield from file_reader
+        finally:
+            file_reader.close()
+
+    combination = (params.get("gtype", "(all)"), params.get("opponent_type", "(all)"))
+    return update_rollup(
+        input_file, params.get("user"), iter_replays, combination,
+        month=params.get("month"), opponent=params.get("opponent", ALL_OPPONENTS)
+    )
+
+
+def default_rollup_paths(paths: List[str]) -> List[str]:
+    """
+    足し合わせる集計ファイルを選ぶ
+    同じユーザー・月に全対局の集計があれば、対戦相手ごとの集計（同じ対局を重複して数える）は除く
+    """
+    scopes = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        scopes[path] = (data.get("user"), data.get("month"), data.get("opponent", ALL_OPPONENTS))
+
+    with_all = {(user, month) for user, month, opponent in scopes.values() if opponent == ALL_OPPONENTS}
+    return [
+        path for path, (user, month, opponent) in scopes.items()
+        if opponent == ALL_OPPONENTS or (user, month) not in with_all
+    ]
+
+
+def sum_rollups(paths: List[str], group_by: Optional[str] = None, filters: Optional[Dict[str, str]] = None) -> Dict[Optional[str], List[int]]:
+    """
+    集計ファイルを足し合わせる（古い形式の集計ファイルは警告して飛ばす）
+
+    Returns:
+        group_byの値 -> [win, lose, draw]
+    """
+    totals: Dict[Optional[str], List[int]] = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != ROLLUP_VERSION:
+            print(f"Warning: {path} was written by an older version - rebuild it with `replay_rollup.py build`")
+            continue
+        result = ReplayRollup.load(path, data.get("user")).query(group_by, **(filters or {}))
+        for key, summary in result.items():
+            _accumulate(totals, key, [summary[name] for name in RESULTS])
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="対局データの勝敗数の集計（作成・検索）"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="保存済みのJSONファイルの集計を作る・更新する")
+    build_parser.add_argument(
+        "paths",
+        nargs="*",
+        help="JSONファイル (default: result/game_replays_*.json)"
+    )
+
+    query_parser = subparsers.add_parser("query", help="集計を足し合わせて表示する")
+    query_parser.add_argument(
+        "paths",
+        nargs="*",
+        help="集計ファイル (default: result/game_replays_*.rollup)"
+    )
+    query_parser.add_argument(
+        "--by",
+        default=None,
+        choices=DIMENSIONS + ["opponent"],
+        help="結果を分ける次元"
+    )
+    for dimension in DIMENSIONS:
+        query_parser.add_argument(f"--{dimension.replace('_', '-')}", dest=dimension, default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        paths = args.paths or sorted(glob.glob(os.path.join("result", "game_replays_*.json")))
+        for path in paths:
+            added, rebuilt = build_rollup_file(path)
+            print(f"{rollup_path(path)}: {'rebuilt with' if rebuilt else 'added'} {added} games")
+        return
+
+    paths = args.paths or default_rollup_paths(sorted(glob.glob(os.path.join("result", "game_replays_*.rollup"))))
+    filters = {dimension: getattr(args, dimension) for dimension in DIMENSIONS if getattr(args, dimension)}
+
+    try:
+        totals = sum_rollups(paths, args.by, filters)
+    except ValueError as e:
+        print(f"エラー: {e}")
+        sys.exit(1)
+
+    print(f"{args.by or '':<20} {'games':>7} {'win':>6} {'lose':>6} {'draw':>6} {'win%':>7}")
+    print("-" * 56)
+    for key, counts in sorted(totals.items(), key=lambda item: "" if item[0] is None else str(item[0])):
+        summary = _summary(counts)
+        rate = f"{summary['win_rate'] * 100:.1f}" if summary["win_rate"] is not None else "-"
+        label = "(all)" if args.by is None else str(key)
+        print(f"{label:<20} {summary['games']:>7} {summary['win']:>6} {summary['lose']:>6} {summary['draw']:>6} {rate:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+"""
+対局データをSQLiteに保存するストア
+game_idを主キーとしてupsertし、日時・対局者名・段位・勝敗・戦型バッジの索引で検索する
+検索結果は従来のJSON形式（{"params", "replays"}）に書き出せる
+"""
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import sys
+from typing import List, Dict, Iterable, Optional
+
+
+# デフォルトのデータベースの場所
+DEFAULT_DB_PATH = os.path.join("result", "replays.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    game_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    datetime TEXT,
+    sente_name TEXT,
+    sente_class TEXT,
+    sente_result TEXT,
+    gote_name TEXT,
+    gote_class TEXT,
+    gote_result TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_games_datetime ON games (datetime);
+CREATE INDEX IF NOT EXISTS idx_games_sente_name ON games (sente_name, datetime);
+CREATE INDEX IF NOT EXISTS idx_games_gote_name ON games (gote_name, datetime);
+CREATE INDEX IF NOT EXISTS idx_games_sente_class ON games (sente_class);
+CREATE INDEX IF NOT EXISTS idx_games_gote_class ON games (gote_class);
+CREATE INDEX IF NOT EXISTS idx_games_sente_result ON games (sente_result);
+CREATE INDEX IF NOT EXISTS idx_games_gote_result ON games (gote_result);
+
+CREATE TABLE IF NOT EXISTS badges (
+    game_id TEXT NOT NULL REFERENCES games (game_id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    badge TEXT NOT NULL,
+    PRIMARY KEY (game_id, position)
+);
+CREATE INDEX IF NOT EXISTS idx_badges_badge ON badges (badge, game_id);
+"""
+
+_UPSERT_GAME = """
+INSERT INTO games (
+    game_id, url, datetime,
+    sente_name, sente_class, sente_result,
+    gote_name, gote_class, gote_result
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (game_id) DO UPDATE SET
+    url = excluded.url,
+    datetime = excluded.datetime,
+    sente_name = excluded.sente_name,
+    sente_class = excluded.sente_class,
+    sente_result = excluded.sente_result,
+    gote_name = excluded.gote_name,
+    gote_class = excluded.gote_class,
+    gote_result = excluded.gote_result
+"""
+
+_GAME_COLUMNS = (
+    "game_id, url, datetime, sente_name, sente_class, sente_result, gote_name, gote_class, gote_result"
+)
+
+
+class ReplayStore:
+    """
+    対局データのSQLiteストア
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        """
+        Args:
+            path: データベースファイルのパス（なければ作成する）
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def upsert(self, replays: Iterable[Dict]) -> int:
+        """
+        対局データをgame_idで重複排除して保存（既存の対局は上書き）
+
+        Args:
+            replays: scrape_pageが返す形式の対局データ
+
+        Returns:
+            保存した対局数
+        """
+        count = 0
+        with self.conn:
+            for replay in replays:
+                game_id = replay.get("game_id")
+                if not game_id:
+                    continue
+                sente = replay.get("sente") or {}
+                gote = replay.get("gote") or {}
+                self.conn.execute(_UPSERT_GAME, (
+                    game_id, replay["url"], replay.get("datetime"),
+                    sente.get("name"), sente.get("class"), sente.get("result"),
+                    gote.get("name"), gote.get("class"), gote.get("result"),
+                ))
+                # バッジは順序ごと置き換える
+                self.conn.execute("DELETE FROM badges WHERE game_id = ?", (game_id,))
+                self.conn.executemany(
+                    "INSERT INTO badges (game_id, position, badge) VALUES (?, ?, ?)",
+                    [(game_id, position, badge) for position, badge in enumerate(replay.get("badges") or [])]
+                )
+                count += 1
+        return count
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+
+    def query(
+        self,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        player: Optional[str] = None,
+        opponent: Optional[str] = None,
+        opponent_class: Optional[str] = None,
+        result: Optional[str] = None,
+        badge: Optional[str] = None,
+        limit: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        条件に合う対局を日時の降順で返す
+
+        Args:
+            since: この日時以降（ISO形式の前方一致で比較、例: "2024-10"）
+            until: この日時より前（例: "2024-11"）
+            player: 対局者（指定時は段位と勝敗をこの対局者から見た相手・結果として扱う）
+            opponent: 対戦相手の名前
+            opponent_class: 対戦相手の段位
+            result: playerから見た勝敗（"win"/"lose"/"draw"）
+            badge: 戦型バッジ
+            limit: 最大件数
+
+        Returns:
+            対局データのリスト（scrape_pageと同じ形式）
+        """
+        if result is not None and player is None:
+            raise ValueError("result filter requires player")
+
+        # (自分の手番, 相手の手番) ごとに条件を組み立て、どちらかに合えばよい
+        sides = [("sente", "gote"), ("gote", "sente")]
+
+        branches = []
+        params: List = []
+        for own, other in sides:
+            conditions = []
+            branch_params: List = []
+            if player is not None:
+                conditions.append(f"{own}_name = ?")
+                branch_params.append(player)
+            if opponent is not None:
+                conditions.append(f"{other}_name = ?")
+                branch_params.append(opponent)
+            if opponent_class is not None:
+                conditions.append(f"{other}_class = ?")
+                branch_params.append(opponent_class)
+            if result is not None:
+                conditions.append(f"{own}_result = ?")
+                branch_params.append(result)
+            if since is not None:
+                conditions.append("datetime >= ?")
+                branch_params.append(since)
+            if until is not None:
+                conditions.append("datetime < ?")
+                branch_params.append(until)
+            if badge is not None:
+                conditions.append("game_id IN (SELECT game_id FROM badges WHERE badge = ?)")
+                branch_params.append(badge)
+            where = " AND ".join(conditions) if conditions else "1"
+            branches.append(f"SELECT {_GAME_COLUMNS} FROM games WHERE {where}")
+            params.extend(branch_params)
+
+            # 対局者の条件がなければ手番を入れ替えても同じ条件なので1回でよい
+            if player is None and opponent is None and opponent_class is None:
+                break
+
+        # UNIONで重複を除き、各分岐は対応する索引で検索される
+        sql = " UNION ".join(branches) + " ORDER BY datetime DESC, game_id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        rows = self.conn.execute(sql, params).fetchall()
+        return self._rows_to_replays(rows)
+
+    def _rows_to_replays(self, rows: List[tuple]) -> List[Dict]:
+        """
+        検索結果の行を対局データの形式に戻す（バッジは順序どおりに復元する）
+        """
+        badges: Dict[str, List[str]] = {row[0]: [] for row in rows}
+        game_ids = list(badges)
+        # SQLiteの変数の上限を超えないように分割して取得する
+        for offset in range(0, len(game_ids), 500):
+            chunk = game_ids[offset:offset + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for game_id, badge in self.conn.execute(
+                f"SELECT game_id, badge FROM badges WHERE game_id IN ({placeholders}) ORDER BY game_id, position",
+                chunk
+            ):
+                badges[game_id].append(badge)
+
+        return [
+            {
+                "url": url,
+                "game_id": game_id,
+                "sente": {
+                    "name": sente_name,
+                    "class": sente_class,
+                    "result": sente_result
+                },
+                "gote": {
+                    "name": gote_name,
+                    "class": gote_class,
+                    "result": gote_result
+                },
+                "datetime": datetime,
+                "badges": badges[game_id]
+            }
+            for (game_id, url, datetime, sente_name, sente_class, sente_result,
+                 gote_name, gote_class, gote_result) in rows
+        ]
+
+    def export_json(self, output_file: str, user: str, month: str, opponent: str = "") -> int:
+        """
+        1か月分の対局を従来のJSON形式（save_to_jsonと同じ形式）で書き出す
+
+        Args:
+            output_file: 出力ファイル名
+            user: ユーザーID
+            month: 対象月（YYYY-MM形式）
+            opponent: 対戦相手のID（カンマ区切りで複数指定可、空文字なら全対局）。スクレイパーの --opponent と同じく、
+                対局ID（先手-後手-日時）にいずれかのIDを含む対局を大文字小文字を区別せずに選ぶ
+
+        Returns:
+            書き出した対局数
+        """
+        year, mon = (int(part) for part in month.split("-"))
+        next_month = f"{year + mon // 12:04d}-{mon % 12 + 1:02d}"
+        replays = self.query(since=month, until=next_month, player=user)
+        filters = [name.strip().lower() for name in opponent.split(",") if name.strip()]
+        if filters:
+            replays = [replay for replay in replays if any(name in replay["game_id"].lower() for name in filters)]
+
+        output_data = {
+            "params": {
+                "user": user,
+                "opponent": opponent if opponent else "(all)",
+                "month": month,
+                "gtype": "(all)",
+                "opponent_type": "(all)",
+                "init_pos_type": "(all)",
+                "limit": "(all)"
+            },
+            "replays": replays
+        }
+
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(output_data, f, ensure_ascii=False, indent=2)
+
+        return len(replays)
+
+
+def default_export_filename(month: str, user: str, opponent: str = "") -> str:
+    """
+    書き出しのデフォルトのファイル名（スクレイパーの出力 game_replays_[month]_[user].json を上書きしないように拡張子の前に .export を付ける）
+    """
+    suffix = f"_{opponent}" if opponent else ""
+    return os.path.join("result", f"game_replays_{month}_{user}{suffix}.export.json")
+
+
+def import_json_files(store: ReplayStore, paths: List[str]) -> int:
+    """
+    save_to_jsonで保存したファイルをストアに取り込む
+
+    Args:
+        store: 取り込み先のストア
+        paths: JSONファイルのパス
+
+    Returns:
+        取り込んだ対局数（重複を含む）
+    """
+    total = 0
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        count = store.upsert(data.get("replays", []))
+        print(f"読み込み中: {path} ({count}件)")
+        total += count
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="対局データのSQLiteストア（JSONの取り込み・検索・JSONへの書き出し）"
+    )
+    parser.add_argument(
+        "--db",
+        default=DEFAULT_DB_PATH,
+        help=f"データベースファイル (default: {DEFAULT_DB_PATH})"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="JSONファイルを取り込む")
+    import_parser.add_argument(
+        "paths",
+        nargs="*",
+        help="取り込むJSONファイル (default: result/game_replays_*.json)"
+    )
+
+    query_parser = subparsers.add_parser("query", help="条件に合う対局を表示する")
+    query_parser.add_argument("--since", default=None, help="この日時以降（例: 2024-01）")
+    query_parser.add_argument("--until", default=None, help="この日時より前（例: 2025-01）")
+    query_parser.add_argument("--player", default=None, help="対局者（段位・勝敗はこの対局者から見た相手・結果）")
+    query_parser.add_argument("--opponent", default=None, help="対戦相手の名前")
+    query_parser.add_argument("--opponent-class", default=None, help="対戦相手の段位（例: 五段）")
+    query_parser.add_argument("--result", default=None, choices=["win", "lose", "draw"], help="playerから見た勝敗")
+    query_parser.add_argument("--badge", default=None, help="戦型バッジ（例: 角換わり）")
+    query_parser.add_argument("--limit", type=int, default=None, help="最大件数")
+
+    export_parser = subparsers.add_parser("export", help="1か月分の対局を従来のJSON形式で書き出す")
+    export_parser.add_argument("--user", required=True, help="ユーザーID")
+    export_parser.add_argument("--month", required=True, help="対象月 YYYY-MM形式")
+    export_parser.add_argument("--opponent", default="", help="対戦相手のID（カンマ区切りで複数指定可、スクレイパーの --opponent と同じく対局IDの部分一致。未指定の場合は全ての対局）")
+    export_parser.add_argument("--output", default=None, help="出力ファイル名（未指定の場合は自動生成）")
+
+    args = parser.parse_args()
+
+    store = ReplayStore(args.db)
+    try:
+        if args.command == "import":
+            paths = args.paths or sorted(glob.glob(os.path.join("result", "game_replays_*.json")))
+            total = import_json_files(store, paths)
+            print(f"\n{len(paths)}ファイル・{total}件を取り込みました（ストアの対局数: {store.count()}）")
+
+        elif args.command == "query":
+            try:
+                replays = store.query(
+                    since=args.since,
+                    until=args.until,
+                    player=args.player,
+                    opponent=args.opponent,
+                    opponent_class=args.opponent_class,
+                    result=args.result,
+                    badge=args.badge,
+                    limit=args.limit
+                )
+            except ValueError as e:
+                print(f"エラー: {e}")
+                sys.exit(1)
+            for replay in replays:
+                print(json.dumps(replay, ensure_ascii=False))
+            print(f"{len(replays)}件", file=sys.stderr)
+
+        elif args.command == "export":
+            if args.output:
+                output_file = args.output
+            else:
+                os.makedirs("result", exist_ok=True)
+                output_file = default_export_filename(args.month, args.user, args.opponent)
+            count = store.export_json(output_file, args.user, args.month, args.opponent)
+            print(f"Saved {count} game URLs to {output_file}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+スクレイピングの処理段階ごとの所要時間を集計し、JSONとPrometheusのtextfile形式で書き出すモジュール
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Optional
+
+
+# 処理段階（記録順に並べる）
+PHASES = [
+    "driver_start",   # ブラウザの起動
+    "login",          # ログイン（保存したセッションの確認を含む）
+    "page_get",       # driver.get / HTTPリクエスト
+    "page_wait",      # 対局リストの描画待ち
+    "page_source",    # page_sourceの取得
+    "parse",          # 履歴ページの解析
+    "combination",    # 1つの組み合わせ全体
+    "save",           # 出力ファイルの保存
+    "kifu",           # 対局ページの取得と指し手の抽出（1局ごと）
+]
+
+# page_statsのキー -> 処理段階
+PAGE_STAT_PHASES = {
+    "get_seconds": "page_get",
+    "http_seconds": "page_get",
+    "wait_seconds": "page_wait",
+    "source_seconds": "page_source",
+    "parse_seconds": "parse",
+}
+
+# Prometheusのメトリクス名の接頭辞
+METRIC_PREFIX = "shogiwars_scrape"
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """
+    並べ替え済みの値のパーセンタイル（nearest-rank法）
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """
+    所要時間の一覧を件数・合計・p50/p95/最大にまとめる
+    """
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "total": sum(ordered),
+        "p50": percentile(ordered, 0.50),
+        "p95": percentile(ordered, 0.95),
+        "max": ordered[-1] if ordered else 0.0,
+    }
+
+
+class ScrapeMetrics:
+    """
+    処理段階ごとの所要時間を、実行全体と組み合わせごとに記録する（複数スレッドから記録できる）
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._start = time.monotonic()
+        # 処理段階 -> 所要時間（秒）のリスト
+        self.samples: Dict[str, List[float]] = {}
+        # 組み合わせ -> {処理段階 -> 所要時間のリスト}
+        self.combination_samples: Dict[str, Dict[str, List[float]]] = {}
+        # 件数などのカウンター
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, phase: str, seconds: float, combination: Optional[str] = None):
+        """
+        1回分の所要時間を記録
+        """
+        with self._lock:
+            self.samples.setdefault(phase, []).append(seconds)
+            if combination is not None:
+                self.combination_samples.setdefault(combination, {}).setdefault(phase, []).append(seconds)
+
+    @contextmanager
+    def time(self, phase: str, combination: Optional[str] = None):
+        """
+        withブロックの所要時間を記録
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(phase, time.monotonic() - start, combination)
+
+    def record_page(self, page_stats: Dict, combination: Optional[str] = None):
+        """
+        scrape_pageが記録したページ単位の所要時間をまとめて記録
+        """
+        for key, phase in PAGE_STAT_PHASES.items():
+            if key in page_stats:
+                self.record(phase, page_stats[key], combination)
+        self.count("pages")
+        if "error" in page_stats:
+            self.count("page_errors")
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> Dict:
+        """
+        集計結果（JSONに書き出す内容）
+        """
+        with self._lock:
+            return {
+                "started_at": datetime.fromtimestamp(self.started_at).isoformat(timespec="seconds"),
+                "elapsed_seconds": time.monotonic() - self._start,
+                "counters": dict(sorted(self.counters.items())),
+                "phases": {
+                    phase: summarize(values) for phase, values in self._ordered(self.samples)
+                },
+                "combinations": {
+                    combination: {phase: summarize(values) for phase, values in self._ordered(samples)}
+                    for combination, samples in sorted(self.combination_samples.items())
+                },
+            }
+
+    @staticmethod
+    def _ordered(samples: Dict[str, List[float]]):
+        order = {phase: index for index, phase in enumerate(PHASES)}
+        return sorted(samples.items(), key=lambda item: (order.get(item[0], len(order)), item[0]))
+
+    def write_json(self, path: str):
+        """
+        集計結果をJSONファイルに書き出す
+        """
+        _write_atomic(path, json.dumps(self.report(), ensure_ascii=False, indent=2) + "\n")
+        print(f"Metrics saved: {path}")
+
+    def write_prometheus(self, path: str):
+        """
+        集計結果をPrometheusのnode_exporterのtextfile collector形式で書き出す
+        （組み合わせごとの値はラベルが増えすぎるため、実行全体の値だけを書き出す）
+        """
+        report = self.report()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_phase_seconds Time spent in each scrape phase.",
+            f"# TYPE {METRIC_PREFIX}_phase_seconds summary",
+        ]
+        for phase, summary in report["phases"].items():
+            lines.append(f'{METRIC_PREFIX}_phase_seconds{{phase="{phase}",quantile="0.5"}} {summary["p50"]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_phase_seconds{{phase="{phase}",quantile="0.95"}} {summary["p95"]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_phase_seconds_sum{{phase="{phase}"}} {summary["total"]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_phase_seconds_count{{phase="{phase}"}} {summary["count"]}')
+
+        lines.append(f"# HELP {METRIC_PREFIX}_phase_max_seconds Longest single sample of each scrape phase.")
+        lines.append(f"# TYPE {METRIC_PREFIX}_phase_max_seconds gauge")
+        for phase, summary in report["phases"].items():
+            lines.append(f'{METRIC_PREFIX}_phase_max_seconds{{phase="{phase}"}} {summary["max"]:.6f}')
+
+        for name, value in report["counters"].items():
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+            lines.append(f"{METRIC_PREFIX}_{name}_total {value}")
+
+        lines.append(f"# TYPE {METRIC_PREFIX}_duration_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_duration_seconds {report['elapsed_seconds']:.6f}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_last_run_timestamp_seconds {self.started_at:.0f}")
+
+        _write_atomic(path, "\n".join(lines) + "\n")
+        print(f"Prometheus metrics saved: {path}")
+
+    def print_summary(self):
+        """
+        処理段階ごとの集計を表で表示
+        """
+        report = self.report()
+        print(f"\n{'phase':<14} {'count':>6} {'total':>9} {'p50':>8} {'p95':>8} {'max':>8}")
+        print("-" * 58)
+        for phase, summary in report["phases"].items():
+            print(f"{phase:<14} {summary['count']:>6} {summary['total']:>8.2f}s {summary['p50']:>7.3f}s "
+                  f"{summary['p95']:>7.3f}s {summary['max']:>7.3f}s")
+
+
+def _write_atomic(path: str, text: str):
+    """
+    一時ファイルに書いてから置き換える（textfile collectorが書きかけのファイルを読まないように）
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
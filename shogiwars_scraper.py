@@ -10,15 +10,124 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 import undetected_chromedriver as uc
+from websockets.sync.client import connect as websocket_connect
+from websockets.exceptions import ConnectionClosed
 from bs4 import BeautifulSoup
+import lxml.html
+import requests
+from requests.adapters import HTTPAdapter
 import json
 import re
-from typing import List, Dict, Optional
+import html
+import hashlib
+from typing import List, Dict, Optional, Set, Callable
 import argparse
 from datetime import datetime
 import time
 import os
 import getpass
+import queue
+import threading
+import asyncio
+import itertools
+from contextlib import ExitStack
+
+from replay_store import ReplayStore, DEFAULT_DB_PATH
+from columnar_export import export_json_file, columnar_path
+from scrape_metrics import ScrapeMetrics
+from page_archive import PageArchive, RecordingFetcher, ReplayFetcher, DEFAULT_ARCHIVE_DIR
+from kifu_cache import KifuCache, extract_moves, DEFAULT_KIFU_CACHE_DIR
+from replay_rollup import RollupUpdate, rollup_path
+import profiling
+
+
+# 将棋ウォーズのベースURL（ローカルのモックサーバーで検証する場合は環境変数で上書きする）
+BASE_URL = os.environ.get("SHOGIWARS_BASE_URL", "https://shogiwars.heroz.jp").rstrip("/")
+
+# 全組み合わせモードで巡回するパラメータ
+ALL_GTYPES = ["s1", "sb", "10min", "sf"]
+ALL_OPPONENT_TYPES = ["normal", "friend", "coach", "closed_event", "learning"]
+ALL_INIT_POS_TYPES = ["normal", "sprint"]
+
+# 履歴ページの読み込み待機の上限（秒）
+DEFAULT_PAGE_WAIT_TIMEOUT = 10.0
+
+# 対局が存在しない場合に履歴ページに表示される文言（対局なしの確認用。実際のページで文言が異なる場合は環境変数にカンマ区切りで指定する）
+# 一致しなくても、読み込みが完了して対局リストがなければ対局なしと判断する
+NO_GAMES_MARKERS = tuple(
+    marker.strip()
+    for marker in os.environ.get(
+        "SHOGIWARS_NO_GAMES_MARKERS", "対局履歴がありません,対局がありません,該当する対局はありません"
+    ).split(",")
+    if marker.strip()
+)
+
+# 履歴ページの描画状態を判定するスクリプト
+# "games"=対局リストあり, "empty"=対局なしの表示あり, "loaded"=読み込みが完了して対局リストなし, null=まだ判定できない
+# （対局リストはサーバー側で描画されるHTMLに含まれるため、readyStateが完了していれば対局なしと判断できる）
+_HISTORY_READY_SCRIPT = """
+if (document.querySelector('.game_players')) { return 'games'; }
+var text = document.body ? document.body.innerText : '';
+var markers = arguments[0];
+for (var i = 0; i < markers.length; i++) {
+    if (text.indexOf(markers[i]) !== -1) { return 'empty'; }
+}
+if (document.readyState === 'complete') { return 'loaded'; }
+return null;
+"""
+
+# 履歴ページで読み込みを止めるリソースの種類（page_sourceしか使わないため、画像・フォント・CSS・メディアは不要）
+# 勝敗の画像はsrc属性だけを見ており、画像そのものは読み込まなくてよい
+# 拡張子ではなくChromeのリソース種別で判定するため、クエリ文字列付きのURL（foo.png?v=1）も止まる
+BLOCKED_RESOURCE_TYPES = ["Image", "Font", "Stylesheet", "Media"]
+
+# --block-third-party で止める外部のスクリプト（広告・アクセス解析）のURLパターン
+THIRD_PARTY_SCRIPT_PATTERNS = [
+    "*googletagmanager.com*", "*google-analytics.com*", "*googlesyndication.com*",
+    "*doubleclick.net*", "*googleadservices.com*", "*adservice.google.*",
+    "*facebook.net*", "*twitter.com/widgets*", "*platform.twitter.com*",
+]
+
+# ページの読み込みで転送されたリソースの数とバイト数を返すスクリプト（Resource Timing API）
+_RESOURCE_TIMING_SCRIPT = """
+var entries = performance.getEntriesByType('resource');
+var bytes = 0;
+for (var i = 0; i < entries.length; i++) { bytes += entries[i].transferSize || 0; }
+var nav = performance.getEntriesByType('navigation')[0];
+if (nav) { bytes += nav.transferSize || 0; }
+return {requests: entries.length, transfer_bytes: bytes};
+"""
+
+# HTTPフェッチャーのリクエストタイムアウト（秒）
+HTTP_FETCH_TIMEOUT = 15.0
+
+# Cloudflareのチャレンジページのタイトル（通常のページもチャレンジ用の検出スクリプトを読み込むため、本文の文字列では判定しない）
+_CHALLENGE_TITLE_RE = re.compile(r"<title>\s*Just a moment\.\.\.\s*</title>", re.IGNORECASE)
+
+# チャレンジページとして扱うHTTPステータス
+CHALLENGE_STATUS_CODES = (403, 503)
+
+# 空の組み合わせキャッシュの保存先
+EMPTY_CACHE_DIR = "cache"
+
+# 空だった組み合わせの記録を信頼する期間（秒）
+# 月が終わった後に確認した記録は対局が増えないため長く、月の途中に確認した記録は新しい対局が増えうるため短くする
+EMPTY_CACHE_TTL_PAST = 30 * 24 * 3600
+EMPTY_CACHE_TTL_CURRENT = 6 * 3600
+
+# ログイン済みセッション（Cookieとブラウザのプロファイル）の保存先
+SESSION_CACHE_DIR = "cache"
+
+# 保存したセッションを再利用する期間（秒）。過ぎたら有効性を確認せずにログインし直す
+SESSION_CACHE_MAX_AGE = 7 * 24 * 3600
+
+# 非同期エンジンのデフォルト設定
+DEFAULT_LOOKAHEAD = 3         # 組み合わせごとに先読みするページ数
+DEFAULT_CONCURRENCY = 4       # 同時に実行するリクエスト数の上限
+DEFAULT_RATE_LIMIT = 2.0      # サイト全体へのリクエスト数の上限（件/秒）
+
+# 棋譜のダウンロードの進捗を表示する間隔（局数）
+KIFU_PROGRESS_INTERVAL = 100
 
 
 def login_to_shogiwars(driver, username: str, password: str, manual_captcha: bool = False) -> tuple[bool, str]:
@@ -38,7 +147,7 @@ def login_to_shogiwars(driver, username: str, password: str, manual_captcha: boo
         print("Logging in to 将棋ウォーズ...")
 
         # ログインページにアクセス（/loginmにリダイレクトされる）
-        login_url = "https://shogiwars.heroz.jp/loginm?locale=ja"
+        login_url = f"{BASE_URL}/loginm?locale=ja"
         driver.get(login_url)
 
         # ページの読み込みを待機
@@ -170,139 +279,671 @@ def login_to_shogiwars(driver, username: str, password: str, manual_captcha: boo
         return False, ""
 
 
-def scrape_page(
-    driver,
-    user: str,
-    opponent: str,
-    month: str,
-    gtype: str,
-    opponent_type: str,
-    init_pos_type: str,
-    page: int
-) -> tuple[List[Dict[str, str]], bool]:
+def create_driver(headless: bool = False, user_data_dir: Optional[str] = None):
     """
-    1ページ分の棋譜URLを抽出
+    Undetected Chrome WebDriverを起動
+
+    Args:
+        headless: Trueならヘッドレスモードで起動
+        user_data_dir: 指定された場合、このディレクトリのChromeプロファイルを使う（実行をまたいで保持される）
+
+    Returns:
+        Seleniumのwebdriver
+    """
+    # ChromeOptionsは使い回せないため毎回作成する
+    options = uc.ChromeOptions()
+    if headless:
+        options.add_argument("--headless=new")
+    if user_data_dir:
+        options.add_argument(f"--user-data-dir={os.path.abspath(user_data_dir)}")
+
+    # 基本的な設定
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--window-size=1920,1080")
+
+    # version_mainを指定せずに自動検出させる
+    return uc.Chrome(options=options)
+
+
+def copy_session_cookies(source_driver, target_driver):
+    """
+    ログイン済みのdriverのセッションCookieを別のdriverにコピー
+
+    Args:
+        source_driver: ログイン済みのwebdriver
+        target_driver: Cookieのコピー先のwebdriver
+    """
+    cookies = source_driver.get_cookies()
+
+    # Cookieを設定するには対象ドメインのページを開いている必要がある
+    target_driver.get(f"{BASE_URL}/robots.txt")
+
+    for cookie in cookies:
+        try:
+            target_driver.add_cookie(cookie)
+        except Exception as e:
+            print(f"Warning: Could not copy cookie {cookie.get('name')}: {e}")
+
+
+class SessionCache:
+    """
+    ログイン済みのセッションを保存し、次回の実行でログインを省くためのキャッシュ
+    Cookie（JSON）とChromeのプロファイルをログインユーザー名ごとに保存する
+    """
+
+    def __init__(self, path: str, profile_dir: str, max_age: float = SESSION_CACHE_MAX_AGE):
+        """
+        Args:
+            path: Cookieを保存するファイルのパス
+            profile_dir: Chromeのプロファイルのディレクトリ
+            max_age: 保存したセッションを再利用する期間（秒）
+        """
+        self.path = path
+        self.profile_dir = profile_dir
+        self.max_age = max_age
+
+    @classmethod
+    def for_login(cls, username: str, **kwargs) -> "SessionCache":
+        """
+        ログインユーザー名ごとのキャッシュを開く（メールアドレスもファイル名に使える形にする）
+        """
+        key = re.sub(r"[^\w.-]", "_", username)
+        return cls(
+            os.path.join(SESSION_CACHE_DIR, f"session_{key}.json"),
+            os.path.join(SESSION_CACHE_DIR, f"chrome_profile_{key}"),
+            **kwargs
+        )
+
+    def restore(self, driver) -> Optional[str]:
+        """
+        保存したセッションをdriverに復元し、有効ならログインユーザーのIDを返す
+
+        Args:
+            driver: Seleniumのwebdriver
+
+        Returns:
+            ログインユーザーのID（セッションがない・期限切れ・無効ならNone）
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        age = time.time() - data.get("saved_at", 0)
+        if age > self.max_age:
+            print(f"Cached session expired ({age / 3600:.0f}h old) - logging in again")
+            return None
+
+        # 期限切れのCookieは除く
+        now = time.time()
+        cookies = [cookie for cookie in data.get("cookies", []) if cookie.get("expiry", now + 1) > now]
+        user = data.get("user")
+        if not cookies or not user:
+            print("Cached session has no valid cookies - logging in again")
+            return None
+
+        # Cookieを設定するには対象ドメインのページを開いている必要がある
+        driver.get(f"{BASE_URL}/robots.txt")
+        for cookie in cookies:
+            try:
+                driver.add_cookie(cookie)
+            except Exception as e:
+                print(f"Warning: Could not restore cookie {cookie.get('name')}: {e}")
+
+        # マイページを開き、ログインページにリダイレクトされなければ有効
+        driver.get(f"{BASE_URL}/users/mypage/{user}?locale=ja")
+        if "login" in driver.current_url:
+            print("Cached session is no longer valid - logging in again")
+            return None
+
+        print(f"Reusing cached session for user: {user} (saved {age / 3600:.1f}h ago)")
+        return user
+
+    def save(self, driver, user: str):
+        """
+        ログイン直後のセッションを保存（Cookieは本人以外が読めない権限で書き込む）
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = {
+            "user": user,
+            "saved_at": time.time(),
+            "cookies": driver.get_cookies()
+        }
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        print(f"Session saved: {self.path}")
+
+
+def _fail_paused_request(connection, message: Dict, request_id: int):
+    """
+    Fetch.enableで一時停止したリクエストを、読み込みを止めたものとして失敗させる
+    """
+    connection.send(json.dumps({
+        "id": request_id,
+        "method": "Fetch.failRequest",
+        "params": {"requestId": message["params"]["requestId"], "errorReason": "BlockedByClient"}
+    }))
+
+
+def _fail_paused_requests(connection, request_ids):
+    """
+    DevToolsの接続が閉じる（ブラウザが終了する）まで、一時停止したリクエストを失敗させ続ける
+    """
+    try:
+        for raw in connection:
+            message = json.loads(raw)
+            if message.get("method") == "Fetch.requestPaused":
+                _fail_paused_request(connection, message, next(request_ids))
+    except ConnectionClosed:
+        pass
+
+
+def block_page_resources(driver, block_third_party: bool = False) -> List[Dict]:
+    """
+    Chrome DevTools ProtocolのFetch.enableで、履歴ページの解析に不要な種類のリソースの読み込みを止める
+    ログインには影響しないように、ログイン後のdriverに対して呼び出す
+
+    Fetch.enableに一致したリクエストは応答するまで一時停止したままになるが、ChromeDriverは
+    Fetchのイベントを返さないため、タブのDevToolsに別の接続を張り、バックグラウンドのスレッドで失敗させる
+
+    Args:
+        driver: ログイン済みのwebdriver
+        block_third_party: Trueなら広告・アクセス解析などの外部スクリプトも止める
+
+    Returns:
+        Fetch.enableに渡したパターン
+    """
+    patterns = [
+        {"urlPattern": "*", "resourceType": resource_type, "requestStage": "Request"}
+        for resource_type in BLOCKED_RESOURCE_TYPES
+    ]
+    if block_third_party:
+        patterns.extend(
+            {"urlPattern": pattern, "resourceType": "Script", "requestStage": "Request"}
+            for pattern in THIRD_PARTY_SCRIPT_PATTERNS
+        )
+
+    # driverが操作しているタブ（ChromeDriverのウィンドウハンドルはDevToolsのターゲットID）に接続する
+    address = driver.capabilities["goog:chromeOptions"]["debuggerAddress"]
+    targets = requests.get(f"http://{address}/json/list", timeout=10).json()
+    handle = driver.current_window_handle
+    target = next((t for t in targets if t.get("id") == handle), None)
+    if target is None:
+        target = next(t for t in targets if t.get("type") == "page")
+    connection = websocket_connect(target["webSocketDebuggerUrl"], max_size=None)
+
+    # 次のページの読み込みより前に有効になるように、Fetch.enableの応答を待ってから戻る
+    request_ids = itertools.count(1)
+    enable_id = next(request_ids)
+    connection.send(json.dumps({"id": enable_id, "method": "Fetch.enable", "params": {"patterns": patterns}}))
+    while True:
+        message = json.loads(connection.recv(timeout=10))
+        if message.get("method") == "Fetch.requestPaused":
+            _fail_paused_request(connection, message, next(request_ids))
+        elif message.get("id") == enable_id:
+            if "error" in message:
+                connection.close()
+                raise RuntimeError(f"Fetch.enable failed: {message['error']}")
+            break
+
+    threading.Thread(target=_fail_paused_requests, args=(connection, request_ids), daemon=True).start()
+    return patterns
+
+
+def wait_for_history_page(driver, timeout: float = DEFAULT_PAGE_WAIT_TIMEOUT) -> tuple[str, float]:
+    """
+    履歴ページの対局リストが描画されるまで待機
+
+    game_players要素が現れるか、対局なしの表示（NO_GAMES_MARKERS）が見つかるか、
+    ページの読み込みが完了した時点ですぐに戻る。読み込みが完了しない間だけ上限まで待ち続ける
 
     Args:
         driver: Seleniumのwebdriver
-        user: ユーザーID
-        opponent: 対戦相手のID
-        month: 対象月（YYYY-MM形式）
-        gtype: ゲームタイプ
-        opponent_type: 対戦相手タイプ
-        init_pos_type: 初期配置タイプ
+        timeout: 待機時間の上限（秒）
+
+    Returns:
+        (待機結果 "games"/"empty"/"loaded"/"timeout", 実際に待機した秒数)
+    """
+    start = time.monotonic()
+
+    def _history_ready(d):
+        return d.execute_script(_HISTORY_READY_SCRIPT, list(NO_GAMES_MARKERS)) or False
+
+    try:
+        state = WebDriverWait(driver, timeout, poll_frequency=0.1).until(_history_ready)
+    except TimeoutException:
+        state = "timeout"
+
+    return state, time.monotonic() - start
+
+
+class SeleniumFetcher:
+    """
+    Seleniumのwebdriverで履歴ページを描画して取得する
+    """
+
+    def __init__(self, driver, page_wait_timeout: float = DEFAULT_PAGE_WAIT_TIMEOUT):
+        """
+        Args:
+            driver: ログイン済みのwebdriver
+            page_wait_timeout: ページ描画待機の上限（秒）
+        """
+        self.driver = driver
+        self.page_wait_timeout = page_wait_timeout
+        # HTTPフェッチャーのフォールバックとして複数スレッドから共有される場合がある
+        self._lock = threading.Lock()
+
+    def fetch(self, url: str, page_stats: Optional[Dict] = None) -> str:
+        """
+        URLを開いて対局リストの描画を待ち、ページのHTMLを返す
+
+        Args:
+            url: 取得するURL
+            page_stats: 指定された場合、待機時間などを書き込む
+
+        Returns:
+            ページのHTML
+        """
+        with self._lock:
+            start = time.monotonic()
+            self.driver.get(url)
+            get_seconds = time.monotonic() - start
+            # 対局リストが描画されるまで待機
+            wait_state, waited = wait_for_history_page(self.driver, self.page_wait_timeout)
+            if wait_state == "timeout":
+                print(f"Warning: history page did not finish loading within {self.page_wait_timeout:.1f}s "
+                      f"- treating the combination as incomplete: {url}")
+            if page_stats is not None:
+                page_stats["get_seconds"] = get_seconds
+                page_stats["wait_state"] = wait_state
+                page_stats["wait_seconds"] = waited
+                # 読み込んだリソースの数と転送量（リソースの読み込みを止めた効果の確認用）
+                resources = self.driver.execute_script(_RESOURCE_TIMING_SCRIPT)
+                if isinstance(resources, dict):
+                    page_stats["resource_requests"] = resources.get("requests", 0)
+                    page_stats["transfer_bytes"] = resources.get("transfer_bytes", 0)
+            start = time.monotonic()
+            page_source = self.driver.page_source
+            if page_stats is not None:
+                page_stats["source_seconds"] = time.monotonic() - start
+            return page_source
+
+    def copy_cookies(self, session: requests.Session):
+        """
+        ブラウザの現在のCookieをHTTPセッションにコピー
+        """
+        with self._lock:
+            copy_browser_cookies(self.driver, session)
+
+
+def looks_like_challenge(status_code: int, final_url: str, headers, text: str) -> bool:
+    """
+    HTTPレスポンスがCloudflareのチャレンジやログイン画面かどうかを判定
+    （cf-mitigated: challenge ヘッダー、403/503のステータス、"Just a moment..." のタイトルのいずれか）
+
+    Args:
+        status_code: HTTPステータスコード
+        final_url: リダイレクト後のURL
+        headers: レスポンスヘッダー
+        text: レスポンス本文
+
+    Returns:
+        ブラウザで取得し直すべきならTrue
+    """
+    if headers.get("cf-mitigated", "").lower() == "challenge":
+        return True
+    if status_code in CHALLENGE_STATUS_CODES:
+        return True
+    # セッションが引き継げていない場合はログインページにリダイレクトされる
+    if "/login" in final_url:
+        return True
+    return _CHALLENGE_TITLE_RE.search(text) is not None
+
+
+def copy_browser_cookies(driver, session: requests.Session):
+    """
+    webdriverのCookieをHTTPセッションにコピー（同じ名前のCookieは上書きする）
+    """
+    for cookie in driver.get_cookies():
+        session.cookies.set(
+            cookie["name"],
+            cookie["value"],
+            domain=cookie.get("domain"),
+            path=cookie.get("path", "/")
+        )
+
+
+def create_http_session(driver, pool_size: int = 4) -> requests.Session:
+    """
+    ログイン済みのdriverのCookieとUser-Agentを引き継いだHTTPセッションを作成
+
+    Args:
+        driver: ログイン済みのwebdriver
+        pool_size: keep-aliveで保持する接続数
+
+    Returns:
+        requestsのセッション
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    session.headers["User-Agent"] = driver.execute_script("return navigator.userAgent")
+    session.headers["Accept-Language"] = "ja,en-US;q=0.9,en;q=0.8"
+
+    copy_browser_cookies(driver, session)
+    return session
+
+
+class HttpFetcher:
+    """
+    ブラウザのセッションを引き継いだHTTPクライアントで履歴ページを取得する
+    チャレンジページが返ってきた場合はSeleniumでの取得にフォールバックする
+    """
+
+    def __init__(self, session: requests.Session, fallback: Optional[SeleniumFetcher] = None,
+                 timeout: float = HTTP_FETCH_TIMEOUT):
+        """
+        Args:
+            session: ログイン済みのCookieを持つHTTPセッション
+            fallback: チャレンジページ検出時に使うSeleniumFetcher
+            timeout: リクエストタイムアウト（秒）
+        """
+        self.session = session
+        self.fallback = fallback
+        self.timeout = timeout
+
+    def fetch(self, url: str, page_stats: Optional[Dict] = None) -> str:
+        """
+        URLのHTMLを取得
+
+        Args:
+            url: 取得するURL
+            page_stats: 指定された場合、取得時間やフォールバックの有無を書き込む
+
+        Returns:
+            ページのHTML
+        """
+        start = time.monotonic()
+        response = self.session.get(url, timeout=self.timeout)
+        if page_stats is not None:
+            page_stats["http_seconds"] = time.monotonic() - start
+            page_stats["http_status"] = response.status_code
+
+        # Content-Typeにcharsetがない場合、requestsはtext/*をISO-8859-1として復号し、段位やバッジの日本語が文字化けする
+        # （サイトのページはUTF-8）
+        if "charset" not in response.headers.get("Content-Type", "").lower():
+            response.encoding = "utf-8"
+
+        if looks_like_challenge(response.status_code, response.url, response.headers, response.text):
+            if self.fallback is None:
+                raise RuntimeError(f"Challenge page returned for {url} (status {response.status_code})")
+            print(f"Challenge page detected (status {response.status_code}) - falling back to browser")
+            if page_stats is not None:
+                page_stats["fallback"] = True
+            page_source = self.fallback.fetch(url, page_stats)
+            # ブラウザがチャレンジを通過して更新したCookie（cf_clearanceなど）を引き継ぎ、以降のページはHTTPで取得する
+            self.fallback.copy_cookies(self.session)
+            return page_source
+
+        response.raise_for_status()
+        return response.text
+
+
+# 対局履歴のリンク（パターン: https://shogiwars.heroz.jp/games/ohakado-guranola_oisi-20251028_220236）
+_GAME_HREF_RE = re.compile(r"/games/[^/]+")
+
+# 対戦IDの形式（user1-user2-YYYYMMDD_HHMMSS）
+_GAME_ID_RE = re.compile(r'^[^-]+-[^-]+-\d{8}_\d{6}')
+
+
+def _parse_game_link(href: Optional[str]) -> Optional[tuple[str, str]]:
+    """
+    リンク先が対局ページなら (完全なURL, 対戦ID) を返す
+
+    Args:
+        href: リンクのhref属性
+
+    Returns:
+        (完全なURL, 対戦ID)。対局ページへのリンクでなければNone
+    """
+    if not href:
+        return None
+
+    # ページネーションリンクは除外（"history"や"page="を含む）
+    if "history" in href or "page=" in href:
+        return None
+
+    # 完全なURLに変換
+    if href.startswith("/games/"):
+        full_url = f"https://shogiwars.heroz.jp{href}"
+    elif href.startswith("https://"):
+        full_url = href
+    else:
+        return None
+
+    # URLから対戦相手を確認
+    # URL形式: /games/{user1}-{user2}-{timestamp}
+    game_id = href.split("/games/")[-1]
+
+    # クエリパラメータを削除（?locale=jaなど）
+    game_id = game_id.split("?")[0]
+
+    # 対戦IDが正しい形式かチェック（user1-user2-timestampの形式）
+    # timestampは YYYYMMDD_HHMMSS の形式
+    if not _GAME_ID_RE.match(game_id):
+        return None
+
+    return full_url, game_id
+
+
+# リンクのhref属性
+_HREF_RE = re.compile(r"""href=["']([^"']*)["']""")
+
+# ページネーションリンクのページ番号
+_PAGE_PARAM_RE = re.compile(r"[?&]page=(\d+)")
+
+
+def inspect_history_page(page_source: str) -> Dict:
+    """
+    最終ページの判定に使う情報を履歴ページから取り出す（パーサーエンジンによらない）
+
+    Args:
+        page_source: 履歴ページのHTML
+
+    Returns:
+        games_on_page: ページ上の対局数（対戦相手で絞り込む前）
+        content_hash: ページ上の対局IDの並びのハッシュ
+        last_linked_page: ページネーションでリンクされている最大のページ番号（リンクがなければNone）
+    """
+    game_ids = []
+    seen_game_ids = set()
+    last_linked_page = None
+
+    for href in _HREF_RE.findall(page_source):
+        href = html.unescape(href)
+        if "history" in href:
+            match = _PAGE_PARAM_RE.search(href)
+            if match:
+                linked_page = int(match.group(1))
+                last_linked_page = linked_page if last_linked_page is None else max(last_linked_page, linked_page)
+            continue
+
+        link = _parse_game_link(href)
+        if link and link[1] not in seen_game_ids:
+            seen_game_ids.add(link[1])
+            game_ids.append(link[1])
+
+    return {
+        "games_on_page": len(game_ids),
+        "content_hash": hashlib.sha1("\n".join(game_ids).encode("utf-8")).hexdigest(),
+        "last_linked_page": last_linked_page,
+    }
+
+
+def detect_last_page(page: int, page_stats: Dict, page_size: int, previous_hash: Optional[str]) -> Optional[str]:
+    """
+    取得したページが最終ページかを判定（次のページを取得せずに巡回を打ち切るため）
+
+    Args:
         page: ページ番号
+        page_stats: scrape_pageが記録したページの情報
+        page_size: これまでのページの最大の対局数（1ページ目では0）
+        previous_hash: 前のページのcontent_hash
 
     Returns:
-        (棋譜URLのリスト, ページに対局が存在するか)
+        最終ページと判定した理由（"repeat"/"pagination"/"short page"）。判定できなければNone
     """
-    base_url = "https://shogiwars.heroz.jp/games/history"
+    if "content_hash" not in page_stats:
+        return None
 
-    params = {
-        "animal": "false",
-        "init_pos_type": init_pos_type,
-        "is_latest": "false",
-        "locale": "ja",
-        "month": month,
-        "opponent_type": opponent_type,
-        "user_id": user,
-        "page": page
+    # 範囲外のページで最終ページと同じ内容が返ってきた
+    if previous_hash is not None and page_stats["content_hash"] == previous_hash:
+        return "repeat"
+
+    # 次のページへのリンクがない
+    last_linked_page = page_stats.get("last_linked_page")
+    if last_linked_page is not None and last_linked_page <= page:
+        return "pagination"
+
+    # 前のページより対局が少ない
+    if page_size and page_stats["games_on_page"] < page_size:
+        return "short page"
+
+    return None
+
+
+def _build_game_info(
+    full_url: str,
+    game_id: str,
+    winner: str,
+    sente_class: Optional[str],
+    gote_class: Optional[str],
+    badges: List[str]
+) -> Dict:
+    """
+    1対局分の出力データを組み立てる
+
+    Args:
+        full_url: 棋譜の完全なURL
+        game_id: 対戦ID
+        winner: 勝者（"sente"/"gote"/"draw"）
+        sente_class: 先手の段位
+        gote_class: 後手の段位
+        badges: 戦型バッジ（先頭の#を除いたもの）
+
+    Returns:
+        対局データ
+    """
+    # game_idから情報を抽出
+    # 形式: [先手]-[後手]-YYYYMMDD_HHMMSS
+    parts = game_id.split("-")
+    if len(parts) >= 3:
+        sente = parts[0]  # 先手
+        gote = parts[1]   # 後手
+        timestamp_str = parts[2]
+
+        # タイムスタンプをISO形式に変換
+        # YYYYMMDD_HHMMSS → YYYY-MM-DDTHH:MM:SS
+        if "_" in timestamp_str:
+            date_part, time_part = timestamp_str.split("_")
+            if len(date_part) == 8 and len(time_part) == 6:
+                iso_datetime = f"{date_part[:4]}-{date_part[4:6]}-{date_part[6:8]}T{time_part[:2]}:{time_part[2:4]}:{time_part[4:6]}"
+            else:
+                iso_datetime = None
+        else:
+            iso_datetime = None
+    else:
+        sente = None
+        gote = None
+        iso_datetime = None
+
+    # winnerから各プレイヤーのresultを計算
+    if winner == "sente":
+        sente_result = "win"
+        gote_result = "lose"
+    elif winner == "gote":
+        sente_result = "lose"
+        gote_result = "win"
+    else:  # draw
+        sente_result = "draw"
+        gote_result = "draw"
+
+    return {
+        "url": full_url,
+        "game_id": game_id,
+        "sente": {
+            "name": sente,
+            "class": sente_class,
+            "result": sente_result
+        },
+        "gote": {
+            "name": gote,
+            "class": gote_class,
+            "result": gote_result
+        },
+        "datetime": iso_datetime,
+        "badges": badges
     }
 
-    # gtypeが指定されている場合のみパラメータに追加
-    # "10min"の場合はgtypeパラメータを送信しない（デフォルトが10分切れ負け）
-    if gtype is not None and gtype != "10min":
-        params["gtype"] = gtype
 
-    # URLを構築
-    param_str = "&".join([f"{k}={v}" for k, v in params.items()])
-    url = f"{base_url}?{param_str}"
+def opponent_filters(opponent: str) -> List[str]:
+    """
+    対戦相手の指定（カンマ区切りで複数指定可）を小文字のIDのリストにする
+    """
+    return [name.strip().lower() for name in (opponent or "").split(",") if name.strip()]
 
-    try:
-        driver.get(url)
-        # ページの読み込みを待機
-        time.sleep(2)
-        page_source = driver.page_source
-    except Exception as e:
-        print(f"Error fetching page {page}: {e}")
-        return [], False
 
-    soup = BeautifulSoup(page_source, "html.parser")
+def matches_opponent(game_id: str, filters: List[str]) -> bool:
+    """
+    対局がいずれかの対戦相手のIDを含むか（filtersが空なら全ての対局が一致する）
+    """
+    if not filters:
+        return True
+    game_id = game_id.lower()
+    return any(name in game_id for name in filters)
+
 
-    # デバッグ用: 一時的にHTMLを保存
-    if page == 1:
-        with open("tmp/history_page_for_badges.html", "w", encoding="utf-8") as f:
-            f.write(page_source)
+def parse_history_page_bs4(page_source: str, opponent: str) -> tuple[List[Dict[str, str]], bool]:
+    """
+    履歴ページのHTMLから棋譜URLを抽出（BeautifulSoup/html.parser版）
+
+    Args:
+        page_source: 履歴ページのHTML
+        opponent: 対戦相手のID（空文字なら全ての対局、カンマ区切りならいずれかに一致する対局）
+
+    Returns:
+        (棋譜URLのリスト, ページに対局が存在するか)
+    """
+    soup = BeautifulSoup(page_source, "html.parser")
+    filters = opponent_filters(opponent)
 
     # 棋譜URLを抽出
     game_urls = []
 
     # 対局履歴のリンクを探す
-    # パターン: https://shogiwars.heroz.jp/games/ohakado-guranola_oisi-20251028_220236
-    game_links = soup.find_all("a", href=re.compile(r"/games/[^/]+"))
+    game_links = soup.find_all("a", href=_GAME_HREF_RE)
 
     # ページに対局が存在するかを記録（フィルタリング前）
     total_games_on_page = 0
 
     for link in game_links:
-        href = link.get("href")
-        if not href:
-            continue
-
-        # ページネーションリンクは除外（"history"や"page="を含む）
-        if "history" in href or "page=" in href:
-            continue
-
-        # 完全なURLに変換
-        if href.startswith("/games/"):
-            full_url = f"https://shogiwars.heroz.jp{href}"
-        elif href.startswith("https://"):
-            full_url = href
-        else:
-            continue
-
-        # URLから対戦相手を確認
-        # URL形式: /games/{user1}-{user2}-{timestamp}
-        game_id = href.split("/games/")[-1]
-
-        # クエリパラメータを削除（?locale=jaなど）
-        game_id = game_id.split("?")[0]
-
-        # 対戦IDが正しい形式かチェック（user1-user2-timestampの形式）
-        # timestampは YYYYMMDD_HHMMSS の形式
-        if not re.match(r'^[^-]+-[^-]+-\d{8}_\d{6}', game_id):
+        parsed = _parse_game_link(link.get("href"))
+        if parsed is None:
             continue
+        full_url, game_id = parsed
 
         # ここまで来たら有効な対局
         total_games_on_page += 1
 
         # 対戦相手が指定されている場合はフィルタリング
-        if opponent and opponent.lower() not in game_id.lower():
+        if not matches_opponent(game_id, filters):
             continue
 
-        # game_idから情報を抽出
-        # 形式: [先手]-[後手]-YYYYMMDD_HHMMSS
-        parts = game_id.split("-")
-        if len(parts) >= 3:
-            sente = parts[0]  # 先手
-            gote = parts[1]   # 後手
-            timestamp_str = parts[2]
-
-            # タイムスタンプをISO形式に変換
-            # YYYYMMDD_HHMMSS → YYYY-MM-DDTHH:MM:SS
-            if "_" in timestamp_str:
-                date_part, time_part = timestamp_str.split("_")
-                if len(date_part) == 8 and len(time_part) == 6:
-                    iso_datetime = f"{date_part[:4]}-{date_part[4:6]}-{date_part[6:8]}T{time_part[:2]}:{time_part[2:4]}:{time_part[4:6]}"
-                else:
-                    iso_datetime = None
-            else:
-                iso_datetime = None
-        else:
-            sente = None
-            gote = None
-            iso_datetime = None
-
         # 勝敗情報を取得
         winner = "draw"  # デフォルトは引き分け
         # リンクの親要素（game_players）から勝敗画像を探す
@@ -363,107 +1004,1751 @@ def scrape_page(
                             # 先頭の#を除去して追加
                             badges.append(badge_text[1:])
 
-        # winnerから各プレイヤーのresultを計算
-        if winner == "sente":
-            sente_result = "win"
-            gote_result = "lose"
-        elif winner == "gote":
-            sente_result = "lose"
-            gote_result = "win"
-        else:  # draw
-            sente_result = "draw"
-            gote_result = "draw"
-
-        game_info = {
-            "url": full_url,
-            "game_id": game_id,
-            "sente": {
-                "name": sente,
-                "class": sente_class,
-                "result": sente_result
-            },
-            "gote": {
-                "name": gote,
-                "class": gote_class,
-                "result": gote_result
-            },
-            "datetime": iso_datetime,
-            "badges": badges
-        }
-
-        game_urls.append(game_info)
+        game_urls.append(_build_game_info(full_url, game_id, winner, sente_class, gote_class, badges))
 
     # ページに対局が存在したかを返す
     has_games = total_games_on_page > 0
     return game_urls, has_games
 
 
-def scrape_game_urls(
-    driver,
-    user: str,
-    opponent: str,
-    month: str = None,
-    gtype: str = None,
-    opponent_type: str = "normal",
-    init_pos_type: str = "normal",
-    limit: int = None
-) -> List[Dict[str, str]]:
-    """
-    将棋ウォーズの対局履歴ページから特定の対戦相手との棋譜URLを抽出
-    複数ページを自動的に巡回して全ての対局を取得
+# lxml版で「ドキュメント全体」を表す目印（BeautifulSoupのルートオブジェクトに相当）
+_LXML_DOCUMENT = object()
 
-    Args:
-        driver: Seleniumのwebdriver
-        user: ユーザーID
-        opponent: 対戦相手のID
-        month: 対象月（YYYY-MM形式、Noneの場合は現在月）
-        gtype: ゲームタイプ（None=10分切れ負け, s1=1手10秒, sb=3分切れ負け）
-        opponent_type: 対戦相手タイプ（normal=ランク, friend=友達, etc.）
-        init_pos_type: 初期配置タイプ（normal=通常, sprint=スプリント）
-        limit: 最大ページ数（Noneの場合は全ページを取得）
 
-    Returns:
-        棋譜URLのリスト
-    """
-    # monthが指定されていない場合は現在月を使用
-    if month is None:
-        month = datetime.now().strftime("%Y-%m")
+def _lxml_has_class(element, class_name: str) -> bool:
+    if element is _LXML_DOCUMENT:
+        return False
+    class_attr = element.get("class")
+    return bool(class_attr) and (class_name in class_attr.split() or class_attr == class_name)
 
-    print(f"Fetching game history for {user} vs {opponent} in {month} (type: {opponent_type}, pos: {init_pos_type})...")
 
-    all_game_urls = []
-    page = 1
+def _lxml_descendants(container, root, tag: str):
+    # BeautifulSoupのfind_allと同じく、要素自身を含めずに子孫を文書順にたどる
+    if container is _LXML_DOCUMENT:
+        return root.iter(tag)
+    return container.iterdescendants(tag)
 
-    while True:
-        if limit is not None and page > limit:
-            print(f"Reached limit: {limit}")
-            break
 
-        print(f"Fetching page {page}...")
-        game_urls, has_games = scrape_page(driver, user, opponent, month, gtype, opponent_type, init_pos_type, page)
+def _lxml_find(container, root, tag: str, class_name: str):
+    for element in _lxml_descendants(container, root, tag):
+        if _lxml_has_class(element, class_name):
+            return element
+    return None
+
+
+def _lxml_text(element) -> str:
+    # BeautifulSoupの get_text(strip=True) と同じく、各テキストを前後の空白を除いて連結する
+    return "".join(text.strip() for text in element.itertext() if text.strip())
+
+
+def _lxml_game_container(link):
+    """
+    BeautifulSoup版と同じ規則でリンクを含むgame_players要素を探す
+    """
+    # 祖先を近い順に並べ、最後にドキュメント全体を置く
+    ancestors = list(link.iterancestors()) + [_LXML_DOCUMENT]
+
+    for ancestor in ancestors:
+        if ancestor is not _LXML_DOCUMENT and ancestor.tag == "div" and _lxml_has_class(ancestor, "game_players"):
+            return ancestor
 
-        # ページに対局が全く存在しない場合は終了
-        if not has_games:
-            print(f"No more games found at page {page}")
+    # game_players が見つからない場合は、最大5階層上までの親要素を使う
+    for depth in range(6):
+        if depth >= len(ancestors):
+            return None
+        if depth == 5 or _lxml_has_class(ancestors[depth], "game_players"):
+            return ancestors[depth]
+    return None
+
+
+def _lxml_container_info(container, root) -> tuple[str, Optional[str], Optional[str], List[str]]:
+    """
+    game_players要素から (勝者, 先手の段位, 後手の段位, バッジ) をまとめて取り出す
+    """
+    winner = "draw"
+    sente_class = None
+    gote_class = None
+    badges = []
+
+    if container is None:
+        return winner, sente_class, gote_class, badges
+
+    for img in _lxml_descendants(container, root, "img"):
+        src = img.get("src", "")
+        if "sente_win" in src:
+            winner = "sente"
+            break
+        elif "sente_lose" in src:
+            winner = "gote"
             break
 
-        # フィルタリング後の結果を追加
-        for game in game_urls:
-            print(f"Found: {game['url']}")
+    player_names_div = _lxml_find(container, root, "div", "player_names")
+    if player_names_div is not None:
+        player_dan_text_left = _lxml_find(player_names_div, root, "div", "player_dan_text_left")
+        if player_dan_text_left is not None:
+            sente_class = _lxml_text(player_dan_text_left)
+        player_dan_text_right = _lxml_find(player_names_div, root, "div", "player_dan_text_right")
+        if player_dan_text_right is not None:
+            gote_class = _lxml_text(player_dan_text_right)
+
+    if container is _LXML_DOCUMENT:
+        parent_container = None
+    else:
+        parent_container = container.getparent()
+        if parent_container is None:
+            parent_container = _LXML_DOCUMENT
+    if parent_container is not None:
+        game_badges_div = _lxml_find(parent_container, root, "div", "game_badges")
+        if game_badges_div is not None:
+            for badge_link in _lxml_descendants(game_badges_div, root, "a"):
+                if not _lxml_has_class(badge_link, "badge_text"):
+                    continue
+                badge_text = _lxml_text(badge_link)
+                if badge_text and badge_text.startswith("#"):
+                    badges.append(badge_text[1:])
+
+    return winner, sente_class, gote_class, badges
+
+
+def parse_history_page_lxml(page_source: str, opponent: str) -> tuple[List[Dict[str, str]], bool]:
+    """
+    履歴ページのHTMLから棋譜URLを抽出（lxml版）
+
+    リンクを1回だけ走査し、game_players要素ごとの勝敗・段位・バッジは最初の1回だけ取り出す
+    出力はBeautifulSoup版と同一になる
+
+    Args:
+        page_source: 履歴ページのHTML
+        opponent: 対戦相手のID（空文字なら全ての対局、カンマ区切りならいずれかに一致する対局）
+
+    Returns:
+        (棋譜URLのリスト, ページに対局が存在するか)
+    """
+    if not page_source or not page_source.strip():
+        return [], False
+
+    root = lxml.html.document_fromstring(page_source)
+    filters = opponent_filters(opponent)
+
+    game_urls = []
+    total_games_on_page = 0
+    # game_players要素 -> 取り出した情報
+    container_info: Dict = {}
+
+    for link in root.iter("a"):
+        href = link.get("href")
+        if not href or not _GAME_HREF_RE.search(href):
+            continue
+        parsed = _parse_game_link(href)
+        if parsed is None:
+            continue
+        full_url, game_id = parsed
+
+        total_games_on_page += 1
+
+        if not matches_opponent(game_id, filters):
+            continue
+
+        container = _lxml_game_container(link)
+        if container not in container_info:
+            container_info[container] = _lxml_container_info(container, root)
+        winner, sente_class, gote_class, badges = container_info[container]
+
+        # バッジのリストは対局ごとに別のオブジェクトにする
+        game_urls.append(_build_game_info(full_url, game_id, winner, sente_class, gote_class, list(badges)))
+
+    return game_urls, total_games_on_page > 0
+
+
+# 選択可能なパーサーエンジン
+PARSER_ENGINES = {
+    "bs4": parse_history_page_bs4,
+    "lxml": parse_history_page_lxml,
+}
+DEFAULT_PARSER_ENGINE = "bs4"
+
+
+def parse_history_page(page_source: str, opponent: str, engine: str = DEFAULT_PARSER_ENGINE) -> tuple[List[Dict[str, str]], bool]:
+    """
+    履歴ページのHTMLから棋譜URLを抽出
+
+    Args:
+        page_source: 履歴ページのHTML
+        opponent: 対戦相手のID（空文字なら全ての対局、カンマ区切りならいずれかに一致する対局）
+        engine: パーサーエンジン（"bs4" または "lxml"）
+
+    Returns:
+        (棋譜URLのリスト, ページに対局が存在するか)
+    """
+    return PARSER_ENGINES[engine](page_source, opponent)
+
+
+def scrape_page(
+    fetcher,
+    user: str,
+    opponent: str,
+    month: str,
+    gtype: str,
+    opponent_type: str,
+    init_pos_type: str,
+    page: int,
+    page_stats: Optional[Dict] = None,
+    parser_engine: str = DEFAULT_PARSER_ENGINE
+) -> tuple[List[Dict[str, str]], bool]:
+    """
+    1ページ分の棋譜URLを抽出
+
+    Args:
+        fetcher: 履歴ページを取得するフェッチャー（SeleniumFetcher/HttpFetcher）
+        user: ユーザーID
+        opponent: 対戦相手のID
+        month: 対象月（YYYY-MM形式）
+        gtype: ゲームタイプ
+        opponent_type: 対戦相手タイプ
+        init_pos_type: 初期配置タイプ
+        page: ページ番号
+        page_stats: 指定された場合、待機時間や最終ページの判定に使う情報などのページ単位の記録を書き込む
+        parser_engine: パーサーエンジン（"bs4" または "lxml"）
+
+    Returns:
+        (棋譜URLのリスト, ページに対局が存在するか)
+    """
+    base_url = f"{BASE_URL}/games/history"
 
-        all_game_urls.extend(game_urls)
+    params = {
+        "animal": "false",
+        "init_pos_type": init_pos_type,
+        "is_latest": "false",
+        "locale": "ja",
+        "month": month,
+        "opponent_type": opponent_type,
+        "user_id": user,
+        "page": page
+    }
+
+    # gtypeが指定されている場合のみパラメータに追加
+    # "10min"の場合はgtypeパラメータを送信しない（デフォルトが10分切れ負け）
+    if gtype is not None and gtype != "10min":
+        params["gtype"] = gtype
 
-        # フィルタリング後が0件でも、ページに対局があれば次へ進む
-        if not game_urls and opponent:
-            print(f"No games with opponent '{opponent}' on page {page}, checking next page...")
+    # URLを構築
+    param_str = "&".join([f"{k}={v}" for k, v in params.items()])
+    url = f"{base_url}?{param_str}"
+
+    if page_stats is None:
+        page_stats = {}
+
+    try:
+        page_source = fetcher.fetch(url, page_stats)
+        if "transfer_bytes" in page_stats:
+            print(f"Page {page} ready in {page_stats['wait_seconds']:.2f}s ({page_stats['wait_state']}, "
+                  f"{page_stats['resource_requests']} requests, {page_stats['transfer_bytes'] / 1024:.0f} KB)")
+        elif "wait_seconds" in page_stats:
+            print(f"Page {page} ready in {page_stats['wait_seconds']:.2f}s ({page_stats['wait_state']})")
+        elif "http_seconds" in page_stats:
+            print(f"Page {page} fetched in {page_stats['http_seconds']:.2f}s")
+    except Exception as e:
+        print(f"Error fetching page {page}: {e}")
+        page_stats["error"] = str(e)
+        return [], False
+
+    # 最終ページの判定に使う情報
+    page_stats.update(inspect_history_page(page_source))
+
+    start = time.monotonic()
+    with profiling.phase("parse"):
+        result = parse_history_page(page_source, opponent, parser_engine)
+    page_stats["parse_seconds"] = time.monotonic() - start
+    return result
+
+
+class Checkpoint:
+    """
+    完了したページと取得済みの対局を記録するチェックポイント（追記型のNDJSON）
+    中断後に --resume で再実行すると、各組み合わせの最後に完了したページの次から再開する
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        """
+        Args:
+            path: チェックポイントファイルのパス
+            resume: Trueなら既存のチェックポイントを読み込む（Falseなら破棄して新しく始める）
+        """
+        self.path = path
+        # 組み合わせ -> 最後に完了したページ
+        self.last_pages: Dict[tuple[str, str, str], int] = {}
+        # 組み合わせ -> 取得済みの対局
+        self.games: Dict[tuple[str, str, str], List[Dict[str, str]]] = {}
+        # 全ページの取得が完了した組み合わせ
+        self.finished: Set[tuple[str, str, str]] = set()
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            if resume:
+                self._load()
+            else:
+                os.remove(path)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        # 中断時に途中まで書かれた最終行は切り捨てる（残すと次の記録がその行に続けて書かれてしまう）
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                combination = tuple(record["combination"])
+                if record["type"] == "page":
+                    self.last_pages[combination] = record["page"]
+                    self.games.setdefault(combination, []).extend(record["games"])
+                elif record["type"] == "finished":
+                    self.finished.add(combination)
+                valid_size += len(line)
+
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_size)
+
+        total_games = sum(len(games) for games in self.games.values())
+        print(f"Resuming from checkpoint {self.path}: {len(self.finished)} combinations finished, "
+              f"{len(self.last_pages)} started, {total_games} games collected")
+
+    def _append(self, record: Dict):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def resume_point(self, combination: tuple[str, str, str]) -> tuple[int, List[Dict[str, str]], bool]:
+        """
+        組み合わせの再開位置を返す
+
+        Returns:
+            (次に取得するページ, 取得済みの対局, 全ページ取得済みか)
+        """
+        with self._lock:
+            return (
+                self.last_pages.get(combination, 0) + 1,
+                list(self.games.get(combination, [])),
+                combination in self.finished
+            )
+
+    def record_page(self, combination: tuple[str, str, str], page: int, game_urls: List[Dict[str, str]]):
+        """
+        ページの取得完了を記録
+        """
+        self._append({"type": "page", "combination": list(combination), "page": page, "games": game_urls})
+
+    def record_finished(self, combination: tuple[str, str, str]):
+        """
+        組み合わせの全ページの取得完了を記録
+        """
+        self._append({"type": "finished", "combination": list(combination)})
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def remove(self):
+        """
+        出力の保存が完了したらチェックポイントを削除
+        """
+        with self._lock:
+            self._file.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class NdjsonSink:
+    """
+    取得した対局をページごとにNDJSONファイルへ追記するストリーミング出力
+    中断しても取得済みの対局はファイルに残り、finalizeで従来のJSON形式に変換する
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        """
+        Args:
+            path: NDJSONファイルのパス
+            resume: Trueなら既存のファイルの続きから追記する（Falseなら破棄して新しく始める。チェックポイントと同じ）
+        """
+        self.path = path
+        # 書き込み済みのgame_id（重複排除用）
+        self.seen_game_ids: Set[str] = set()
+        # 組み合わせ -> その組み合わせの行のファイル内の位置（書き込み順）
+        self.offsets: Dict[tuple[str, str, str], List[int]] = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            if resume:
+                self._load_existing()
+            else:
+                os.remove(path)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "ab")
+
+    def _load_existing(self):
+        # 中断時に途中まで書かれた最終行は切り捨てる
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                self.seen_game_ids.add(record["replay"]["game_id"])
+                self.offsets.setdefault(tuple(record["combination"]), []).append(valid_size)
+                valid_size += len(line)
+
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_size)
+
+        print(f"Resuming stream {self.path}: {len(self.seen_game_ids)} games already written")
+
+    def write_page(self, combination: tuple[str, str, str], page: int, game_urls: List[Dict[str, str]]) -> int:
+        """
+        1ページ分の対局を追記（書き込み済みのgame_idは飛ばす）
+
+        Args:
+            combination: (gtype, opponent_type, init_pos_type)
+            page: ページ番号
+            game_urls: ページから抽出した対局
+
+        Returns:
+            新しく書き込んだ対局数
+        """
+        written = 0
+        with self._lock:
+            for game in game_urls:
+                if game["game_id"] in self.seen_game_ids:
+                    continue
+                self.seen_game_ids.add(game["game_id"])
+                record = {"combination": list(combination), "page": page, "replay": game}
+                self.offsets.setdefault(tuple(combination), []).append(self._file.tell())
+                self._file.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                written += 1
+            # ページ単位でディスクに書き出し、中断しても残るようにする
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        return written
+
+    @property
+    def count(self) -> int:
+        return len(self.seen_game_ids)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def iter_replays(self, combinations: List[tuple[str, str, str]],
+                     replay_filter: Optional[Callable[[Dict], bool]] = None):
+        """
+        書き込んだ対局を組み合わせの順に読み出す
+        書き込み時に記録した行の位置を組み合わせの順にたどるので、ファイルを走査し直さず、メモリにも溜めない
+
+        Args:
+            combinations: 出力する組み合わせの順序
+            replay_filter: 指定された場合、Trueを返す対局だけを読み出す
+
+        Yields:
+            対局データ
+        """
+        self.close()
+        with open(self.path, "rb") as f:
+            for combination in combinations:
+                for offset in self.offsets.get(tuple(combination), []):
+                    f.seek(offset)
+                    record = json.loads(f.readline())
+                    if replay_filter is None or replay_filter(record["replay"]):
+                        yield record["replay"]
+
+    def finalize(self, output_file: str, query_params: Dict[str, str],
+                 combinations: List[tuple[str, str, str]],
+                 rollup_combinations: Optional[Dict[str, tuple[str, str]]] = None,
+                 replay_filter: Optional[Callable[[Dict], bool]] = None) -> int:
+        """
+        NDJSONファイルから従来の {"params", "replays"} 形式のJSONを書き出す
+        出力はsave_to_jsonと同一で、処理順によらず組み合わせの順に並ぶ
+
+        Args:
+            output_file: 出力ファイル名
+            query_params: 検索に使用したパラメータ
+            combinations: 出力する組み合わせの順序
+            rollup_combinations: 指定された場合、game_id -> (gtype, opponent_type) を使って集計ファイルを更新する
+            replay_filter: 指定された場合、Trueを返す対局だけを書き出す（複数の対戦相手の出力に振り分ける場合）
+
+        Returns:
+            書き出した対局数
+        """
+        def indent_json(value, level: int) -> str:
+            return json.dumps(value, ensure_ascii=False, indent=2).replace("\n", "\n" + " " * level)
+
+        # 集計は書き出しと同じ走査で更新し、出力ファイルを読み直さない
+        update = start_rollup(output_file, query_params, rollup_combinations) if rollup_combinations is not None else None
+
+        count = 0
+        tmp_file = output_file + ".tmp"
+        with profiling.phase("save"), open(tmp_file, "w", encoding="utf-8") as f:
+            f.write('{\n  "params": ' + indent_json(query_params, 2) + ',\n  "replays": [')
+            for replay in self.iter_replays(combinations, replay_filter):
+                f.write(("\n" if count == 0 else ",\n") + "    " + indent_json(replay, 4))
+                count += 1
+                if update is not None:
+                    update.add(replay)
+            f.write("\n  ]\n}" if count else "]\n}")
+        os.replace(tmp_file, output_file)
+
+        if update is not None:
+            finish_rollup(update, output_file, lambda: self.iter_replays(combinations, replay_filter))
+
+        print(f"\nSaved {count} game URLs to {output_file}")
+        return count
+
+
+class KnownGames:
+    """
+    差分取得で、出力先（対戦相手）ごとの既存の対局から新しい対局と巡回の打ち切り位置を判定する
+    対戦相手ごとに前回の取得時期が違う場合もあるため、既存の対局は出力先ごとに分けて持つ
+    """
 
-        page += 1
+    def __init__(self):
+        # (対局が出力先に含まれるかの判定, 出力先の既存のgame_id) のリスト
+        self.routes: List[tuple[Callable[[Dict], bool], Set[str]]] = []
+
+    def add_route(self, matches: Callable[[Dict], bool], game_ids: Set[str]):
+        self.routes.append((matches, game_ids))
+
+    def is_known(self, game: Dict[str, str]) -> bool:
+        """
+        対局が、その対局を含む全ての出力先で取得済みかどうか
+        """
+        matched = False
+        for matches, game_ids in self.routes:
+            if matches(game):
+                matched = True
+                if game["game_id"] not in game_ids:
+                    return False
+        return matched
+
+    def caught_up_routes(self, game_urls: List[Dict[str, str]]) -> Set[int]:
+        """
+        ページに対局が1件以上あり、その全てが取得済みの出力先のインデックス
+        （履歴は新しい順なので、その出力先の以降のページの対局は取得済み）
+        """
+        caught_up = set()
+        for index, (matches, game_ids) in enumerate(self.routes):
+            route_games = [game for game in game_urls if matches(game)]
+            if route_games and all(game["game_id"] in game_ids for game in route_games):
+                caught_up.add(index)
+        return caught_up
+
+
+def scrape_game_urls(
+    fetcher,
+    user: str,
+    opponent: str,
+    month: str = None,
+    gtype: str = None,
+    opponent_type: str = "normal",
+    init_pos_type: str = "normal",
+    limit: int = None,
+    known_games: Optional[KnownGames] = None,
+    stats: Optional[Dict] = None,
+    parser_engine: str = DEFAULT_PARSER_ENGINE,
+    sink: Optional[NdjsonSink] = None,
+    checkpoint: Optional[Checkpoint] = None
+) -> List[Dict[str, str]]:
+    """
+    将棋ウォーズの対局履歴ページから特定の対戦相手との棋譜URLを抽出
+    複数ページを自動的に巡回して全ての対局を取得
+
+    Args:
+        fetcher: 履歴ページを取得するフェッチャー
+        user: ユーザーID
+        opponent: 対戦相手のID
+        month: 対象月（YYYY-MM形式、Noneの場合は現在月）
+        gtype: ゲームタイプ（None=10分切れ負け, s1=1手10秒, sb=3分切れ負け）
+        opponent_type: 対戦相手タイプ（normal=ランク, friend=友達, etc.）
+        init_pos_type: 初期配置タイプ（normal=通常, sprint=スプリント）
+        limit: 最大ページ数（Noneの場合は全ページを取得）
+        known_games: 出力先ごとの取得済みの対局（指定時は全ての出力先が既知の対局に達したページで巡回を打ち切る）
+        stats: 指定された場合、取得したページ数、組み合わせが空だったか、取得エラーで打ち切ったか、最終ページの判定で省いた取得数、ページごとの記録を書き込む
+        parser_engine: パーサーエンジン（"bs4" または "lxml"）
+        sink: 指定された場合、ページごとに対局を追記する出力先
+        checkpoint: 指定された場合、完了したページを記録し、記録済みのページの次から再開する
+
+    Returns:
+        棋譜URLのリスト（known_games指定時は新規の対局のみ）
+    """
+    # monthが指定されていない場合は現在月を使用
+    if month is None:
+        month = datetime.now().strftime("%Y-%m")
+
+    print(f"Fetching game history for {user} vs {opponent} in {month} (type: {opponent_type}, pos: {init_pos_type})...")
+
+    combination = (gtype, opponent_type, init_pos_type)
+    all_game_urls = []
+    page = 1
+    # ページごとの待機時間（秒）
+    page_waits = []
+    # ページごとに読み込んだリソースの数と転送量（バイト）
+    page_requests = []
+    page_bytes = []
+    # 取得エラーで打ち切った場合はFalse（チェックポイントで完了扱いにしない）
+    completed = True
+    # 最終ページの判定に使う、これまでのページの最大の対局数と前のページの内容
+    page_size = 0
+    previous_hash = None
+    # 差分取得で、既知の対局に達した出力先
+    caught_up: Set[int] = set()
+
+    if checkpoint is not None:
+        page, all_game_urls, finished = checkpoint.resume_point(combination)
+        if finished:
+            print(f"Already finished (checkpoint): {len(all_game_urls)} games")
+            return all_game_urls
+        if page > 1:
+            print(f"Resuming from page {page} (checkpoint: {len(all_game_urls)} games)")
+
+    # ページの巡回（取得の待ち時間を含む。解析は "parse" の段階に分けて計測される）
+    with profiling.phase("page_loop"):
+        while True:
+            if limit is not None and page > limit:
+                print(f"Reached limit: {limit}")
+                break
+
+            print(f"Fetching page {page}...")
+            page_stats = {}
+            game_urls, has_games = scrape_page(
+                fetcher, user, opponent, month, gtype, opponent_type, init_pos_type, page,
+                page_stats=page_stats, parser_engine=parser_engine
+            )
+            if "wait_seconds" in page_stats:
+                page_waits.append(page_stats["wait_seconds"])
+            if "transfer_bytes" in page_stats:
+                page_requests.append(page_stats["resource_requests"])
+                page_bytes.append(page_stats["transfer_bytes"])
+            if stats is not None:
+                stats.setdefault("page_records", []).append(page_stats)
+                stats["pages_fetched"] = page
+                # 1ページ目に対局がないことが確定した場合だけ空の組み合わせ
+                stats["empty"] = page == 1 and not has_games and is_definitely_empty(page_stats)
+
+            # ページに対局が全く存在しない場合は終了
+            if not has_games:
+                print(f"No more games found at page {page}")
+                # 取得エラーや描画待ちのタイムアウトでは、対局がないとは限らない
+                completed = "error" not in page_stats and page_stats.get("wait_state") != "timeout"
+                break
+
+            last_page_reason = detect_last_page(page, page_stats, page_size, previous_hash)
+            page_stats["last_page"] = last_page_reason
+            if last_page_reason == "repeat":
+                # 前のページと同じ内容なので対局は取得済み
+                print(f"Page {page} repeats page {page - 1} - stopping")
+                break
+            page_size = max(page_size, page_stats.get("games_on_page", 0))
+            previous_hash = page_stats.get("content_hash")
+
+            # 差分取得: 履歴は新しい順なので、全ての出力先が既知の対局に達したページ以降は取得済み
+            page_fully_known = is_page_fully_known(game_urls, known_games, caught_up)
+            if known_games is not None:
+                if stats is not None:
+                    # 既知の対局も含めた履歴の順（マージで新しい対局を組み合わせの位置に挿入するのに使う）
+                    stats.setdefault("fetched_game_ids", []).extend(game["game_id"] for game in game_urls)
+                game_urls = [game for game in game_urls if not known_games.is_known(game)]
+
+            # フィルタリング後の結果を追加
+            for game in game_urls:
+                print(f"Found: {game['url']}")
+
+            all_game_urls.extend(game_urls)
+            if sink is not None:
+                sink.write_page(combination, page, game_urls)
+            if checkpoint is not None:
+                checkpoint.record_page(combination, page, game_urls)
+
+            if page_fully_known:
+                print(f"All games on page {page} are already known - stopping")
+                break
+
+            if last_page_reason is not None and (limit is None or page < limit):
+                # 対局のない次のページを取得せずに終了する
+                print(f"Last page detected at page {page} ({last_page_reason}) - skipped 1 page fetch")
+                if stats is not None:
+                    stats["fetches_saved"] = 1
+                break
+
+            # フィルタリング後が0件でも、ページに対局があれば次へ進む
+            if not game_urls and opponent:
+                print(f"No games with opponent '{opponent}' on page {page}, checking next page...")
+
+            page += 1
+
+    if checkpoint is not None and completed:
+        checkpoint.record_finished(combination)
+    if stats is not None and not completed:
+        stats["incomplete"] = True
+
+    if page_waits:
+        print(f"Page wait: {sum(page_waits):.2f}s total over {len(page_waits)} pages "
+              f"(avg {sum(page_waits) / len(page_waits):.2f}s, max {max(page_waits):.2f}s)")
+    if page_bytes:
+        print(f"Page resources: {sum(page_requests)} requests, {sum(page_bytes) / 1024:.0f} KB transferred "
+              f"over {len(page_bytes)} pages (avg {sum(page_requests) / len(page_requests):.1f} requests, "
+              f"{sum(page_bytes) / len(page_bytes) / 1024:.0f} KB per page)")
 
     print(f"\nTotal games found: {len(all_game_urls)}")
     return all_game_urls
 
 
-def save_to_json(data: List[Dict[str, str]], output_file: str, query_params: Dict[str, str]):
+def is_definitely_empty(page_stats: Dict) -> bool:
+    """
+    対局のないページが、確かに対局なしの結果だったかどうか（空の組み合わせとして記録してよいか）
+
+    ブラウザでの取得は対局なしの表示が見つかったか読み込みが完了した場合（待機のタイムアウトは含まない）、
+    HTTPでの取得はステータス200のページの場合だけTrue。取得エラーやアーカイブからの読み込みはFalse
+    """
+    if "error" in page_stats:
+        return False
+    if "wait_state" in page_stats:
+        return page_stats["wait_state"] in ("empty", "loaded")
+    return page_stats.get("http_status") == 200
+
+
+def is_page_fully_known(game_urls: List[Dict[str, str]], known_games: Optional[KnownGames],
+                        caught_up: Set[int]) -> bool:
+    """
+    このページまでで全ての出力先が取得済みの対局に達したかどうかを判定（差分取得の打ち切り条件）
+
+    Args:
+        game_urls: ページから抽出した棋譜URLのリスト
+        known_games: 出力先ごとの取得済みの対局（Noneなら差分取得しない）
+        caught_up: 前のページまでに既知の対局に達した出力先（このページで達した出力先を追加する）
+
+    Returns:
+        全ての出力先が、対局が1件以上あり全て取得済みのページに達していればTrue
+        （既存の出力ファイルがない出力先は達しないため、全ページを取得する）
+    """
+    if known_games is None or not game_urls:
+        return False
+    caught_up.update(known_games.caught_up_routes(game_urls))
+    return len(caught_up) == len(known_games.routes)
+
+
+def month_end_timestamp(month: str) -> float:
+    """
+    月の終わり（翌月1日の0時、ローカル時刻）のUNIX時間
+    """
+    start = datetime.strptime(month, "%Y-%m")
+    next_month = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return next_month.timestamp()
+
+
+class EmptyCombinationCache:
+    """
+    ユーザーごとに、対局が1件もなかった (月, 組み合わせ) を記録するキャッシュ
+    記録が有効期間内の組み合わせは取得をスキップする
+    """
+
+    def __init__(self, path: str, ttl_past: float = EMPTY_CACHE_TTL_PAST,
+                 ttl_current: float = EMPTY_CACHE_TTL_CURRENT):
+        """
+        Args:
+            path: キャッシュファイルのパス
+            ttl_past: 過去の月の記録の有効期間（秒）
+            ttl_current: 当月の記録の有効期間（秒）
+        """
+        self.path = path
+        self.ttl_past = ttl_past
+        self.ttl_current = ttl_current
+        # 月 -> {組み合わせのキー -> 空だと確認した時刻（UNIX時間）}
+        self.entries: Dict[str, Dict[str, float]] = {}
+        # スキップした組み合わせの数（=節約した取得回数）
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    @classmethod
+    def for_user(cls, user: str, **kwargs) -> "EmptyCombinationCache":
+        """
+        ユーザーごとのキャッシュファイルを開く
+        """
+        return cls(os.path.join(EMPTY_CACHE_DIR, f"empty_combinations_{user}.json"), **kwargs)
+
+    @staticmethod
+    def _key(combination: tuple[str, str, str]) -> str:
+        return "/".join(combination)
+
+    def is_empty(self, month: str, combination: tuple[str, str, str]) -> bool:
+        """
+        有効期間内に空だと確認済みの組み合わせかどうか
+        """
+        with self._lock:
+            checked_at = self.entries.get(month, {}).get(self._key(combination))
+        if checked_at is None:
+            return False
+
+        # 月が終わった後に確認した記録だけを過去の月の有効期間で扱う
+        # （月の途中に確認した記録は、その後も月末までに対局が増えている可能性がある）
+        ttl = self.ttl_past if checked_at >= month_end_timestamp(month) else self.ttl_current
+        return time.time() - checked_at < ttl
+
+    def skip(self, month: str, combination: tuple[str, str, str]) -> bool:
+        """
+        組み合わせをスキップすべきならTrueを返し、節約した取得回数を数える
+        """
+        if not self.is_empty(month, combination):
+            return False
+        with self._lock:
+            self.skipped += 1
+        return True
+
+    def record(self, month: str, combination: tuple[str, str, str], empty: bool):
+        """
+        取得結果を記録（対局があった組み合わせは記録から外す）
+        """
+        key = self._key(combination)
+        with self._lock:
+            if empty:
+                self.entries.setdefault(month, {})[key] = time.time()
+            elif key in self.entries.get(month, {}):
+                del self.entries[month][key]
+
+    def save(self):
+        """
+        キャッシュをファイルに保存
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+def all_combinations() -> List[tuple[str, str, str]]:
+    """
+    全組み合わせモードで巡回する (gtype, opponent_type, init_pos_type) の一覧を返す
+    """
+    return [
+        (gt, ot, ipt)
+        for gt in ALL_GTYPES
+        for ot in ALL_OPPONENT_TYPES
+        for ipt in ALL_INIT_POS_TYPES
+    ]
+
+
+def month_range(start: str, end: str) -> List[str]:
+    """
+    開始月から終了月までの月の一覧を返す（両端を含む）
+
+    Args:
+        start: 開始月（YYYY-MM形式）
+        end: 終了月（YYYY-MM形式）
+
+    Returns:
+        YYYY-MM形式の月のリスト（古い順）
+    """
+    start_date = datetime.strptime(start, "%Y-%m")
+    end_date = datetime.strptime(end, "%Y-%m")
+
+    months = []
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        months.append(f"{year:04d}-{month:02d}")
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    return months
+
+
+class OutputRoute:
+    """
+    1人の対戦相手（未指定なら全ての対局）の出力先
+    """
+
+    def __init__(self, opponent: str, output_filename: str, existing_replays: Optional[List[Dict[str, str]]] = None):
+        """
+        Args:
+            opponent: 対戦相手のID（空文字なら全ての対局）
+            output_filename: 出力ファイル名
+            existing_replays: 差分取得で読み込んだ既存の対局
+        """
+        self.opponent = opponent
+        self.output_filename = output_filename
+        self.existing_replays = existing_replays or []
+        self._filters = opponent_filters(opponent)
+
+    def matches(self, replay: Dict) -> bool:
+        return matches_opponent(replay["game_id"], self._filters)
+
+
+class MonthTarget:
+    """
+    1か月分の取得対象と、その月の出力先（差分取得の索引、ストリーミング出力、チェックポイント）
+    複数の対戦相手を指定した場合、各ページは1回だけ取得し、対局を対戦相手ごとの出力先（routes）に振り分ける
+    """
+
+    def __init__(
+        self,
+        month: str,
+        routes: Optional[List[OutputRoute]] = None,
+        known_games: Optional[KnownGames] = None,
+        sink: Optional[NdjsonSink] = None,
+        checkpoint: Optional[Checkpoint] = None,
+        user: Optional[str] = None,
+        empty_cache: Optional[EmptyCombinationCache] = None
+    ):
+        self.month = month
+        self.routes = routes or []
+        # 一括モードで対象のユーザー（Noneならスケジューラに渡したユーザー）
+        self.user = user
+        # ユーザーごとの空の組み合わせキャッシュ（Noneならスケジューラに渡したキャッシュ）
+        self.empty_cache = empty_cache
+        # 差分取得では出力先ごとの既存の対局
+        self.known_games = known_games
+        self.sink = sink
+        self.checkpoint = checkpoint
+        # 取得した対局の game_id -> (gtype, opponent_type)（集計ファイルの更新に使う）
+        self.game_combinations: Dict[str, tuple[str, str]] = {}
+        # 差分取得で、組み合わせごとに取得したページの game_id（既知の対局も含む履歴の順）
+        self.fetched_game_ids: Dict[tuple[str, str, str], List[str]] = {}
+        # 失敗した、または取得エラーで途中で打ち切った組み合わせ（出力が不完全になる）
+        self.incomplete: List[tuple[str, str, str]] = []
+
+    def record_combination(self, combination: tuple[str, str, str], game_urls: List[Dict[str, str]],
+                           fetched_game_ids: Optional[List[str]] = None):
+        gt, ot, _ = combination
+        for game in game_urls:
+            self.game_combinations[game["game_id"]] = (gt, ot)
+        if fetched_game_ids is not None:
+            self.fetched_game_ids[combination] = fetched_game_ids
+
+    @property
+    def label(self) -> str:
+        """
+        ログとメトリクスでの表示名（一括モードでは "ユーザー/月"）
+        """
+        return f"{self.user}/{self.month}" if self.user else self.month
+
+
+def schedule_jobs(targets: List[MonthTarget], combinations: List[tuple[str, str, str]]) -> List[tuple[int, int, tuple[str, str, str]]]:
+    """
+    (対象のインデックス, 組み合わせのインデックス, 組み合わせ) のジョブを、ユーザーごとに1つずつ順番に並べる
+    （一括モードで、先に並んだユーザーのジョブが後のユーザーを待たせないようにする。ユーザーが1人なら従来の順）
+    """
+    user_jobs: Dict[Optional[str], List] = {}
+    for target_index, target in enumerate(targets):
+        jobs = user_jobs.setdefault(target.user, [])
+        for index, combination in enumerate(combinations):
+            jobs.append((target_index, index, combination))
+
+    scheduled = []
+    queues = list(user_jobs.values())
+    for position in range(max((len(jobs) for jobs in queues), default=0)):
+        for jobs in queues:
+            if position < len(jobs):
+                scheduled.append(jobs[position])
+    return scheduled
+
+
+class UserProgress:
+    """
+    一括モードのユーザーごとの進捗とスループット（複数スレッド・コルーチンから記録できる）
+    スループットは、そのユーザーの最初のジョブの開始から最後のジョブの完了までの経過時間（並行に処理した時間は重ねない）で割る
+    """
+
+    def __init__(self, targets: List[MonthTarget], combinations_count: int):
+        self.start = time.monotonic()
+        # ユーザー -> [完了したジョブ, 全ジョブ, ページ数, 対局数, 最初のジョブの開始時刻, 最後のジョブの完了時刻]
+        # （時刻は self.start からの秒数、最初のジョブの開始時刻はジョブが完了するまでNone）
+        self.users: Dict[str, List] = {}
+        for target in targets:
+            record = self.users.setdefault(target.user, [0, 0, 0, 0, None, 0.0])
+            record[1] += combinations_count
+        self._lock = threading.Lock()
+
+    def job_done(self, user: str, pages: int, games: int, seconds: float):
+        """
+        1つのジョブ（スキップ・失敗を含む）の完了を記録して進捗を表示
+
+        Args:
+            user: ユーザー
+            pages: 取得したページ数
+            games: 取得した対局数
+            seconds: ジョブの所要時間（開始時刻の算出に使う）
+        """
+        with self._lock:
+            now = time.monotonic() - self.start
+            record = self.users[user]
+            record[0] += 1
+            record[2] += pages
+            record[3] += games
+            started = now - seconds
+            record[4] = started if record[4] is None else min(record[4], started)
+            record[5] = now
+            done, total, user_pages, user_games, first_start, _ = record
+        elapsed = now - first_start
+        rate = user_pages / elapsed if elapsed > 0 else 0.0
+        print(f"[{user}] {done}/{total} jobs, {user_pages} pages, {user_games} games ({rate:.2f} pages/s)")
+
+    def print_summary(self):
+        """
+        ユーザーごとのページ数・対局数・経過時間・スループットを表で表示
+        """
+        print(f"\n{'user':<20} {'jobs':>9} {'pages':>6} {'games':>6} {'elapsed':>8} {'pages/s':>8} {'done at':>8}")
+        print("-" * 71)
+        with self._lock:
+            for user, (done, total, pages, games, first_start, finished) in self.users.items():
+                elapsed = finished - first_start if first_start is not None else 0.0
+                rate = pages / elapsed if elapsed > 0 else 0.0
+                print(f"{user:<20} {f'{done}/{total}':>9} {pages:>6} {games:>6} {elapsed:>7.1f}s {rate:>8.2f} {finished:>7.1f}s")
+
+
+def record_combination_metrics(
+    metrics: ScrapeMetrics,
+    month: str,
+    combination: tuple[str, str, str],
+    combination_stats: Dict,
+    seconds: float,
+    games: int
+):
+    """
+    1つの組み合わせのページごとの記録と所要時間をメトリクスに記録
+    """
+    label = "/".join([month, *combination])
+    for page_stats in combination_stats.get("page_records", []):
+        metrics.record_page(page_stats, label)
+    metrics.record("combination", seconds, label)
+    metrics.count("combinations")
+    metrics.count("games", games)
+    metrics.count("fetches_saved", combination_stats.get("fetches_saved", 0))
+
+
+def scrape_months(
+    fetchers: List,
+    user: str,
+    opponent: str,
+    targets: List[MonthTarget],
+    combinations: List[tuple[str, str, str]],
+    limit: int = None,
+    empty_cache: Optional[EmptyCombinationCache] = None,
+    parser_engine: str = DEFAULT_PARSER_ENGINE,
+    metrics: Optional[ScrapeMetrics] = None
+) -> List[List[Dict[str, str]]]:
+    """
+    (月, 組み合わせ) の全てのジョブをフェッチャーのプールで分担してスクレイピング
+    各フェッチャーは作業キューからジョブを1つずつ取り出して処理する
+
+    Args:
+        fetchers: フェッチャーのリスト（1つなら逐次処理）
+        user: ユーザーID
+        opponent: 対戦相手のID
+        targets: 対象月ごとの取得対象
+        combinations: (gtype, opponent_type, init_pos_type) のリスト
+        limit: 最大ページ数（Noneの場合は全ページを取得）
+        empty_cache: 空の組み合わせキャッシュ（指定時は空と確認済みの組み合わせをスキップ）
+        parser_engine: パーサーエンジン（"bs4" または "lxml"）
+        metrics: 指定された場合、ページと組み合わせごとの所要時間を記録する
+
+    Returns:
+        取得対象ごとの棋譜URLのリスト（targetsの順。処理順によらず組み合わせの順に並ぶ、sink指定時は空）
+    """
+    total_combinations = len(combinations)
+    jobs = queue.Queue()
+    for job in schedule_jobs(targets, combinations):
+        jobs.put(job)
+    # 一括モードではユーザーごとの進捗を表示する
+    progress = UserProgress(targets, total_combinations) if len({target.user for target in targets}) > 1 else None
+
+    # (月のインデックス, 組み合わせのインデックス) -> 棋譜URLのリスト
+    results: Dict[tuple[int, int], List[Dict[str, str]]] = {}
+    failed: List[tuple[str, str, str, str]] = []
+    # 最終ページの判定で省いたページ取得の数
+    fetches_saved = 0
+    lock = threading.Lock()
+
+    def worker(worker_id: int, fetcher):
+        nonlocal fetches_saved
+        while True:
+            try:
+                target_index, index, (gt, ot, ipt) = jobs.get_nowait()
+            except queue.Empty:
+                return
+
+            target = targets[target_index]
+            target_user = target.user or user
+            target_cache = target.empty_cache if target.empty_cache is not None else empty_cache
+            month_label = f"{target.label} " if len(targets) > 1 else ""
+            print(f"\n{'='*80}")
+            print(f"[worker {worker_id}] {month_label}組み合わせ [{index + 1}/{total_combinations}]: gtype={gt}, opponent_type={ot}, init_pos_type={ipt}")
+            print(f"{'='*80}\n")
+
+            if target_cache is not None and target_cache.skip(target.month, (gt, ot, ipt)):
+                print("Skipped: no games for this combination (empty-combination cache)")
+                if metrics is not None:
+                    metrics.count("combinations_skipped")
+                if progress is not None:
+                    progress.job_done(target.user, 0, 0, 0.0)
+                continue
+
+            combination_stats = {}
+            combination_start = time.monotonic()
+            try:
+                game_urls = scrape_game_urls(
+                    fetcher=fetcher,
+                    user=target_user,
+                    opponent=opponent,
+                    month=target.month,
+                    gtype=gt,
+                    opponent_type=ot,
+                    init_pos_type=ipt,
+                    limit=limit,
+                    known_games=target.known_games,
+                    stats=combination_stats,
+                    parser_engine=parser_engine,
+                    sink=target.sink,
+                    checkpoint=target.checkpoint
+                )
+            except Exception as e:
+                print(f"[worker {worker_id}] Error in {month_label}gtype={gt}, opponent_type={ot}, init_pos_type={ipt}: {e}")
+                with lock:
+                    failed.append((target.label, gt, ot, ipt))
+                    target.incomplete.append((gt, ot, ipt))
+                if metrics is not None:
+                    metrics.count("combinations_failed")
+                if progress is not None:
+                    progress.job_done(target.user, 0, 0, time.monotonic() - combination_start)
+                continue
+
+            combination_seconds = time.monotonic() - combination_start
+            if combination_stats.get("incomplete"):
+                with lock:
+                    target.incomplete.append((gt, ot, ipt))
+            if metrics is not None:
+                record_combination_metrics(
+                    metrics, target.label, (gt, ot, ipt), combination_stats,
+                    combination_seconds, len(game_urls)
+                )
+            if progress is not None:
+                progress.job_done(
+                    target.user, len(combination_stats.get("page_records", [])), len(game_urls), combination_seconds
+                )
+
+            if target_cache is not None and "empty" in combination_stats:
+                target_cache.record(target.month, (gt, ot, ipt), combination_stats["empty"])
+            with lock:
+                fetches_saved += combination_stats.get("fetches_saved", 0)
+                target.record_combination((gt, ot, ipt), game_urls, combination_stats.get("fetched_game_ids"))
+
+            if game_urls:
+                print(f"Found {len(game_urls)} games for this combination")
+            else:
+                print(f"No games found for this combination")
+
+            # ストリーミング出力時は書き込み済みなので保持しない
+            if target.sink is None:
+                with lock:
+                    results[(target_index, index)] = game_urls
+
+    if len(fetchers) == 1:
+        worker(0, fetchers[0])
+    else:
+        threads = [
+            threading.Thread(target=worker, args=(worker_id, fetcher), daemon=True)
+            for worker_id, fetcher in enumerate(fetchers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    if fetches_saved:
+        print(f"Last-page detection saved {fetches_saved} page fetches")
+
+    if failed:
+        if len(targets) > 1:
+            print(f"Warning: {len(failed)} jobs failed: {sorted(failed)}")
+        else:
+            print(f"Warning: {len(failed)} combinations failed: {sorted(job[1:] for job in failed)}")
+
+    if progress is not None:
+        progress.print_summary()
+
+    # 完了順ではなく組み合わせの順に結合して結果を決定的にする
+    target_game_urls: List[List[Dict[str, str]]] = []
+    for target_index in range(len(targets)):
+        all_game_urls = []
+        for index in range(total_combinations):
+            all_game_urls.extend(results.get((target_index, index), []))
+        target_game_urls.append(all_game_urls)
+    return target_game_urls
+
+
+def create_fetchers(
+    driver,
+    fetcher_kind: str,
+    count: int,
+    headless: bool,
+    page_wait_timeout: float,
+    pool_drivers: List,
+    http_pool_size: int = 4,
+    block_resources: bool = False,
+    block_third_party: bool = False
+) -> List:
+    """
+    ログイン済みのdriverからフェッチャーのプールを作成
+
+    Args:
+        driver: ログイン済みのwebdriver
+        fetcher_kind: "selenium" または "http"
+        count: 作成するフェッチャーの数
+        headless: 追加のブラウザをヘッドレスモードで起動するか
+        page_wait_timeout: ページ描画待機の上限（秒）
+        pool_drivers: 追加で起動したdriverを追記するリスト（終了時に閉じるため）
+        http_pool_size: HTTPセッションごとに保持する接続数
+        block_resources: Trueなら追加のブラウザでも画像・フォント・CSS・メディアの読み込みを止める
+        block_third_party: Trueなら追加のブラウザでも外部スクリプトの読み込みを止める
+
+    Returns:
+        フェッチャーのリスト
+    """
+    browser_fetcher = SeleniumFetcher(driver, page_wait_timeout)
+
+    if fetcher_kind == "http":
+        # ブラウザは1つだけ残し、チャレンジページ検出時のフォールバックとして共有する
+        return [
+            HttpFetcher(create_http_session(driver, pool_size=http_pool_size), fallback=browser_fetcher)
+            for _ in range(count)
+        ]
+
+    # 並列モードではログイン済みのセッションを追加のdriverにコピーする
+    fetchers = [browser_fetcher]
+    if count > 1:
+        print(f"Starting {count - 1} additional browsers for parallel scraping...")
+        for _ in range(count - 1):
+            pool_driver = create_driver(headless)
+            pool_drivers.append(pool_driver)
+            copy_session_cookies(driver, pool_driver)
+            if block_resources:
+                block_page_resources(pool_driver, block_third_party)
+            fetchers.append(SeleniumFetcher(pool_driver, page_wait_timeout))
+    return fetchers
+
+
+class TokenBucket:
+    """
+    全てのリクエストで共有するトークンバケット方式のレートリミッター（asyncio用）
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        """
+        Args:
+            rate: 1秒あたりに補充するトークン数（=最大リクエスト数/秒）
+            capacity: バケットの容量（連続して許可するリクエスト数）
+        """
+        if rate <= 0:
+            raise ValueError(f"rate must be positive: {rate}")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        トークンを1つ取得できるまで待機
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def scrape_game_urls_async(
+    fetcher,
+    user: str,
+    opponent: str,
+    month: str,
+    gtype: str,
+    opponent_type: str,
+    init_pos_type: str,
+    limit: Optional[int],
+    lookahead: int,
+    semaphore: asyncio.Semaphore,
+    rate_limiter: TokenBucket,
+    known_games: Optional[KnownGames] = None,
+    stats: Optional[Dict] = None,
+    parser_engine: str = DEFAULT_PARSER_ENGINE,
+    sink: Optional[NdjsonSink] = None,
+    checkpoint: Optional[Checkpoint] = None
+) -> List[Dict[str, str]]:
+    """
+    1つの組み合わせの全ページを、次のページを先読みしながら非同期に取得
+
+    Args:
+        fetcher: 履歴ページを取得するフェッチャー（スレッドから呼び出される）
+        user: ユーザーID
+        opponent: 対戦相手のID
+        month: 対象月（YYYY-MM形式）
+        gtype: ゲームタイプ
+        opponent_type: 対戦相手タイプ
+        init_pos_type: 初期配置タイプ
+        limit: 最大ページ数（Noneの場合は全ページを取得）
+        lookahead: 同時に取得しにいくページ数
+        semaphore: 全体の同時実行数を制限するセマフォ
+        rate_limiter: 全体のリクエスト頻度を制限するレートリミッター
+        known_games: 出力先ごとの取得済みの対局（差分取得する場合）
+        stats: 指定された場合、取得したページ数、組み合わせが空だったか、取得エラーで打ち切ったか、最終ページの判定で省いた取得数、ページごとの記録を書き込む
+        parser_engine: パーサーエンジン（"bs4" または "lxml"）
+        sink: 指定された場合、ページごとに対局を追記する出力先
+        checkpoint: 指定された場合、完了したページを記録し、記録済みのページの次から再開する
+
+    Returns:
+        棋譜URLのリスト（ページ順）
+    """
+    label = f"gtype={gtype}, opponent_type={opponent_type}, init_pos_type={init_pos_type}"
+    # リクエストを送り始めたページ（最終ページの判定で取り消したページのうち、未送信のものを数えるため）
+    started_pages: Set[int] = set()
+
+    async def fetch_page(page: int):
+        async with semaphore:
+            await rate_limiter.acquire()
+            started_pages.add(page)
+            page_stats = {}
+            game_urls, has_games = await asyncio.to_thread(
+                scrape_page, fetcher, user, opponent, month, gtype, opponent_type, init_pos_type, page,
+                page_stats, parser_engine
+            )
+            return game_urls, has_games, page_stats
+
+    combination = (gtype, opponent_type, init_pos_type)
+    all_game_urls = []
+    # ページ番号 -> 取得中のタスク
+    pending: Dict[int, asyncio.Task] = {}
+    page = 1
+    # 取得エラーで打ち切った場合はFalse（チェックポイントで完了扱いにしない）
+    completed = True
+    # 最終ページの判定に使う、これまでのページの最大の対局数と前のページの内容
+    page_size = 0
+    previous_hash = None
+    # 最終ページの判定で、次のページを取得開始する前に打ち切れた場合は1
+    skipped_next_page = 0
+    # 差分取得で、既知の対局に達した出力先
+    caught_up: Set[int] = set()
+
+    if checkpoint is not None:
+        page, all_game_urls, finished = checkpoint.resume_point(combination)
+        if finished:
+            print(f"[{label}] Already finished (checkpoint): {len(all_game_urls)} games")
+            return all_game_urls
+
+    next_page_to_fetch = page
+
+    try:
+        while limit is None or page <= limit:
+            # 現在のページから lookahead ページ先まで取得を開始しておく
+            while next_page_to_fetch < page + lookahead and (limit is None or next_page_to_fetch <= limit):
+                pending[next_page_to_fetch] = asyncio.create_task(fetch_page(next_page_to_fetch))
+                next_page_to_fetch += 1
+
+            game_urls, has_games, page_stats = await pending.pop(page)
+            if stats is not None:
+                stats.setdefault("page_records", []).append(page_stats)
+                stats["pages_fetched"] = page
+                stats["empty"] = page == 1 and not has_games and is_definitely_empty(page_stats)
+
+            # ページに対局が全く存在しない場合は終了
+            if not has_games:
+                print(f"[{label}] No more games found at page {page}")
+                # 取得エラーや描画待ちのタイムアウトでは、対局がないとは限らない
+                completed = "error" not in page_stats and page_stats.get("wait_state") != "timeout"
+                break
+
+            last_page_reason = detect_last_page(page, page_stats, page_size, previous_hash)
+            page_stats["last_page"] = last_page_reason
+            if last_page_reason == "repeat":
+                print(f"[{label}] Page {page} repeats page {page - 1} - stopping")
+                break
+            page_size = max(page_size, page_stats.get("games_on_page", 0))
+            previous_hash = page_stats.get("content_hash")
+
+            page_fully_known = is_page_fully_known(game_urls, known_games, caught_up)
+            if known_games is not None:
+                if stats is not None:
+                    stats.setdefault("fetched_game_ids", []).extend(game["game_id"] for game in game_urls)
+                game_urls = [game for game in game_urls if not known_games.is_known(game)]
+
+            all_game_urls.extend(game_urls)
+            if sink is not None:
+                sink.write_page(combination, page, game_urls)
+            if checkpoint is not None:
+                checkpoint.record_page(combination, page, game_urls)
+
+            if page_fully_known:
+                print(f"[{label}] All games on page {page} are already known - stopping")
+                break
+
+            if last_page_reason is not None and (limit is None or page < limit):
+                print(f"[{label}] Last page detected at page {page} ({last_page_reason})")
+                if next_page_to_fetch <= page + 1:
+                    skipped_next_page = 1
+                break
+
+            page += 1
+
+        if checkpoint is not None and completed:
+            checkpoint.record_finished(combination)
+        if stats is not None and not completed:
+            stats["incomplete"] = True
+    finally:
+        # 最終ページを越えて先読みしたページの結果は破棄する
+        # まだリクエストを送っていないページは取り消すことで取得を省ける
+        saved = skipped_next_page + sum(1 for pending_page in pending if pending_page not in started_pages)
+        if stats is not None:
+            stats["fetches_saved"] = saved
+        if saved:
+            print(f"[{label}] Skipped {saved} page fetches past the last page")
+        for task in pending.values():
+            task.cancel()
+        if pending:
+            outcomes = await asyncio.gather(*pending.values(), return_exceptions=True)
+            discarded = sum(1 for outcome in outcomes if not isinstance(outcome, BaseException))
+            print(f"[{label}] Discarded {discarded} speculative pages past the last page")
+
+    print(f"[{label}] Total games found: {len(all_game_urls)}")
+    return all_game_urls
+
+
+async def scrape_months_async(
+    fetcher,
+    user: str,
+    opponent: str,
+    targets: List[MonthTarget],
+    combinations: List[tuple[str, str, str]],
+    limit: int = None,
+    lookahead: int = DEFAULT_LOOKAHEAD,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rate: float = DEFAULT_RATE_LIMIT,
+    empty_cache: Optional[EmptyCombinationCache] = None,
+    parser_engine: str = DEFAULT_PARSER_ENGINE,
+    metrics: Optional[ScrapeMetrics] = None
+) -> List[List[Dict[str, str]]]:
+    """
+    (月, 組み合わせ) の全てのジョブを並行に取得する非同期エンジン
+    同時実行数とリクエスト頻度は全ジョブで共有する上限に従う
+
+    Args:
+        fetcher: スレッドセーフなフェッチャー（HttpFetcher）
+        user: ユーザーID
+        opponent: 対戦相手のID
+        targets: 対象月ごとの取得対象
+        combinations: (gtype, opponent_type, init_pos_type) のリスト
+        limit: 最大ページ数（Noneの場合は全ページを取得）
+        lookahead: 組み合わせごとに先読みするページ数
+        concurrency: 同時に実行するリクエスト数の上限
+        rate: 1秒あたりのリクエスト数の上限
+        empty_cache: 空の組み合わせキャッシュ（指定時は空と確認済みの組み合わせをスキップ）
+        parser_engine: パーサーエンジン（"bs4" または "lxml"）
+        metrics: 指定された場合、ページと組み合わせごとの所要時間を記録する
+
+    Returns:
+        取得対象ごとの棋譜URLのリスト（targetsの順。組み合わせの順に並ぶ、sink指定時は空）
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    rate_limiter = TokenBucket(rate)
+    # 最終ページの判定で省いたページ取得の数
+    fetches_saved = 0
+
+    # 一括モードではユーザーごとの進捗を表示する
+    progress = UserProgress(targets, len(combinations)) if len({target.user for target in targets}) > 1 else None
+    # 例外で失敗したジョブ（1つのジョブの失敗で他のジョブは止めない）
+    failed = []
+
+    async def scrape_combination(target: MonthTarget, combination: tuple[str, str, str]) -> List[Dict[str, str]]:
+        nonlocal fetches_saved
+        target_cache = target.empty_cache if target.empty_cache is not None else empty_cache
+        if target_cache is not None and target_cache.skip(target.month, combination):
+            if metrics is not None:
+                metrics.count("combinations_skipped")
+            if progress is not None:
+                progress.job_done(target.user, 0, 0, 0.0)
+            return []
+
+        gt, ot, ipt = combination
+        combination_stats = {}
+        combination_start = time.monotonic()
+        try:
+            game_urls = await scrape_game_urls_async(
+                fetcher, target.user or user, opponent, target.month, gt, ot, ipt, limit,
+                lookahead, semaphore, rate_limiter, target.known_games, combination_stats,
+                parser_engine, target.sink, target.checkpoint
+            )
+        except Exception as e:
+            print(f"Error in {target.label} gtype={gt}, opponent_type={ot}, init_pos_type={ipt}: {e}")
+            failed.append((target.label, gt, ot, ipt))
+            target.incomplete.append(combination)
+            if metrics is not None:
+                metrics.count("combinations_failed")
+            if progress is not None:
+                progress.job_done(target.user, 0, 0, time.monotonic() - combination_start)
+            return []
+        if target_cache is not None and "empty" in combination_stats:
+            target_cache.record(target.month, combination, combination_stats["empty"])
+        fetches_saved += combination_stats.get("fetches_saved", 0)
+        if combination_stats.get("incomplete"):
+            target.incomplete.append(combination)
+        target.record_combination(combination, game_urls, combination_stats.get("fetched_game_ids"))
+        combination_seconds = time.monotonic() - combination_start
+        if metrics is not None:
+            record_combination_metrics(
+                metrics, target.label, combination, combination_stats,
+                combination_seconds, len(game_urls)
+            )
+        if progress is not None:
+            progress.job_done(
+                target.user, len(combination_stats.get("page_records", [])), len(game_urls), combination_seconds
+            )
+        # ストリーミング出力時は書き込み済みなので保持しない
+        return game_urls if target.sink is None else []
+
+    # セマフォの待ち行列は作成順に進むため、ユーザーごとに交互に並べたジョブの順で作成する
+    jobs = schedule_jobs(targets, combinations)
+    start = time.monotonic()
+    job_results = await asyncio.gather(*(
+        scrape_combination(targets[target_index], combination)
+        for target_index, _, combination in jobs
+    ))
+    elapsed = time.monotonic() - start
+
+    results = {
+        (target_index, index): game_urls
+        for (target_index, index, _), game_urls in zip(jobs, job_results)
+    }
+    target_game_urls: List[List[Dict[str, str]]] = []
+    for target_index in range(len(targets)):
+        all_game_urls = []
+        for index in range(len(combinations)):
+            all_game_urls.extend(results[(target_index, index)])
+        target_game_urls.append(all_game_urls)
+
+    print(f"Async engine finished {len(targets) * len(combinations)} jobs in {elapsed:.1f}s")
+    if fetches_saved:
+        print(f"Last-page detection saved {fetches_saved} page fetches")
+    if failed:
+        print(f"Warning: {len(failed)} jobs failed: {sorted(failed)}")
+    if progress is not None:
+        progress.print_summary()
+    return target_game_urls
+
+
+async def download_kifus_async(
+    fetcher,
+    game_ids: List[str],
+    cache: KifuCache,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    rate: float = DEFAULT_RATE_LIMIT,
+    metrics: Optional[ScrapeMetrics] = None
+) -> Dict[str, int]:
+    """
+    対局ページを並行に取得して指し手を抽出し、キャッシュに保存する（キャッシュ済みの対局は取得しない）
+
+    Args:
+        fetcher: スレッドセーフなフェッチャー（HttpFetcher）
+        game_ids: 対象の対局のgame_id
+        cache: 指し手のキャッシュ
+        concurrency: 同時に実行するリクエスト数の上限
+        rate: 1秒あたりのリクエスト数の上限
+        metrics: 指定された場合、対局ごとの所要時間を記録する
+
+    Returns:
+        {"cached": キャッシュ済みの数, "downloaded": 取得した数, "failed": 失敗した数}
+    """
+    missing = cache.missing(game_ids)
+    result = {"cached": len(set(game_ids)) - len(missing), "downloaded": 0, "failed": 0}
+    print(f"Kifu: {result['cached']} games cached, downloading {len(missing)} games "
+          f"(concurrency {concurrency}, {rate} req/s)")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    rate_limiter = TokenBucket(rate)
+
+    async def download(game_id: str):
+        async with semaphore:
+            await rate_limiter.acquire()
+            start = time.monotonic()
+            try:
+                page_source = await asyncio.to_thread(fetcher.fetch, f"{BASE_URL}/games/{game_id}")
+                moves = extract_moves(page_source)
+                cache.put(game_id, moves)
+            except Exception as e:
+                # キャッシュしないので次回の実行で取得し直す
+                print(f"Error downloading kifu {game_id}: {e}")
+                result["failed"] += 1
+                return
+            result["downloaded"] += 1
+            if metrics is not None:
+                metrics.record("kifu", time.monotonic() - start)
+            done = result["downloaded"] + result["failed"]
+            if done % KIFU_PROGRESS_INTERVAL == 0:
+                print(f"Kifu: {done}/{len(missing)} games processed")
+
+    start = time.monotonic()
+    await asyncio.gather(*(download(game_id) for game_id in missing))
+    if metrics is not None:
+        for name, value in result.items():
+            metrics.count(f"kifus_{name}", value)
+    print(f"Kifu: downloaded {result['downloaded']}, failed {result['failed']} "
+          f"in {time.monotonic() - start:.1f}s")
+    return result
+
+
+def load_replays(input_file: str) -> List[Dict[str, str]]:
+    """
+    保存済みのJSONファイルから対局データを読み込む
+
+    Args:
+        input_file: save_to_jsonで保存したファイル
+
+    Returns:
+        対局データのリスト（ファイルが存在しない場合は空）
+    """
+    if not os.path.exists(input_file):
+        return []
+
+    with open(input_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    return data.get("replays", [])
+
+
+def merge_replays(
+    existing: List[Dict[str, str]],
+    new: List[Dict[str, str]],
+    fetched_game_ids: List[List[str]]
+) -> List[Dict[str, str]]:
+    """
+    既存の対局データに新しい対局データをマージ（game_idで重複排除する）
+
+    全件取得と同じ順（組み合わせの順、各組み合わせの中は履歴の新しい順）になるように、組み合わせごとの新しい対局を、
+    その組み合わせの既存の対局のうち最も新しいもの（取得したページで最初に見つかった既知の対局）の直前に挿入する
+    既存の対局がない組み合わせの新しい対局は、後の組み合わせの挿入位置にまとめて挿入する
+
+    Args:
+        existing: 既存の対局データ（全件取得と同じ順）
+        new: 新しく取得した対局データ
+        fetched_game_ids: 組み合わせの順に、各組み合わせで取得したページの game_id（既知の対局も含む履歴の順）
+
+    Returns:
+        マージした対局データ
+    """
+    existing_game_ids = {replay.get("game_id") for replay in existing}
+    new_replays: Dict[str, Dict[str, str]] = {}
+    for replay in new:
+        game_id = replay.get("game_id")
+        if game_id not in existing_game_ids and game_id not in new_replays:
+            new_replays[game_id] = replay
+
+    # 既存の対局の game_id -> その直前に挿入する新しい対局
+    inserts: Dict[str, List[Dict[str, str]]] = {}
+    pending: List[Dict[str, str]] = []
+    for game_ids in fetched_game_ids:
+        pending.extend(new_replays.pop(game_id) for game_id in game_ids if game_id in new_replays)
+        anchor = next((game_id for game_id in game_ids if game_id in existing_game_ids), None)
+        if anchor is not None and pending:
+            inserts.setdefault(anchor, []).extend(pending)
+            pending = []
+
+    merged = []
+    for replay in existing:
+        merged.extend(inserts.pop(replay.get("game_id"), []))
+        merged.append(replay)
+    # 以降の組み合わせに既存の対局がない場合と、取得したページが分からない対局（--resume で前回の実行から引き継いだ対局）は末尾に追加する
+    merged.extend(pending)
+    merged.extend(new_replays.values())
+    return merged
+
+
+def default_output_filename(month: str, user: str, opponent: str) -> str:
+    """
+    出力ファイル名を生成（resultディレクトリがなければ作成する）
+
+    Args:
+        month: 対象月（YYYY-MM形式）
+        user: ユーザーID
+        opponent: 対戦相手のID（空文字なら全対局）
+
+    Returns:
+        出力ファイルのパス
+    """
+    result_dir = "result"
+    os.makedirs(result_dir, exist_ok=True)
+
+    if opponent:
+        # 対戦相手が指定されている場合
+        filename = f"game_replays_{month}_{user}_{opponent}.json"
+    else:
+        # 対戦相手が未指定（全検索）の場合
+        filename = f"game_replays_{month}_{user}.json"
+
+    return os.path.join(result_dir, filename)
+
+
+def start_rollup(
+    output_file: str,
+    query_params: Dict[str, str],
+    rollup_combinations: Dict[str, tuple[str, str]]
+) -> RollupUpdate:
+    """
+    出力ファイルの集計の更新を始める（書き出す対局を add に渡し、finish_rollup で保存する）
+
+    Args:
+        output_file: 出力ファイル名
+        query_params: 検索に使用したパラメータ（視点となるユーザーと、組み合わせが不明な対局の組み合わせ）
+        rollup_combinations: 今回取得した対局の game_id -> (gtype, opponent_type)
+    """
+    # 今回取得していない対局（差分取得の既存の対局）は、前回集計したときの組み合わせかパラメータの値になる
+    return RollupUpdate(
+        output_file, query_params["user"], (query_params["gtype"], query_params["opponent_type"]),
+        rollup_combinations, month=query_params["month"], opponent=query_params["opponent"]
+    )
+
+
+def finish_rollup(update: RollupUpdate, output_file: str, iter_replays):
+    """
+    集計ファイルを保存
+
+    Args:
+        update: start_rollupで始めた更新
+        output_file: 出力ファイル名
+        iter_replays: 出力ファイルの全ての対局を返す関数（集計を作り直す場合だけ呼ばれる）
+    """
+    added, rebuilt = update.finish(iter_replays)
+    if rebuilt:
+        print(f"Rebuilt rollup {rollup_path(output_file)} ({added} games)")
+    else:
+        print(f"Updated rollup {rollup_path(output_file)} (+{added} games)")
+
+
+def save_to_json(data: List[Dict[str, str]], output_file: str, query_params: Dict[str, str],
+                 rollup_combinations: Optional[Dict[str, tuple[str, str]]] = None):
     """
     抽出したデータをJSONファイルに保存
 
@@ -471,17 +2756,45 @@ def save_to_json(data: List[Dict[str, str]], output_file: str, query_params: Dic
         data: 保存するデータ
         output_file: 出力ファイル名
         query_params: 検索に使用したパラメータ
+        rollup_combinations: 指定された場合、game_id -> (gtype, opponent_type) を使って集計ファイルを更新する
     """
     output_data = {
         "params": query_params,
         "replays": data
     }
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
+    with profiling.phase("save"):
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(output_data, f, ensure_ascii=False, indent=2)
 
     print(f"\nSaved {len(data)} game URLs to {output_file}")
 
+    if rollup_combinations is not None:
+        update = start_rollup(output_file, query_params, rollup_combinations)
+        for replay in data:
+            update.add(replay)
+        finish_rollup(update, output_file, lambda: data)
+
+
+def positive_int(value: str) -> int:
+    """
+    argparseの型: 1以上の整数
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer: {value}")
+    return number
+
+
+def positive_float(value: str) -> float:
+    """
+    argparseの型: 0より大きい数
+    """
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"must be a positive number: {value}")
+    return number
+
 
 def main():
     """
@@ -505,13 +2818,40 @@ def main():
     parser.add_argument(
         "--opponent",
         default="",
-        help="対戦相手のID（未指定の場合は全ての対局を取得）"
+        help="対戦相手のID（未指定の場合は全ての対局を取得）。カンマ区切りで複数指定すると、各ページを1回だけ取得して対戦相手ごとのファイルに振り分ける"
+    )
+    parser.add_argument(
+        "--opponent-file",
+        default=None,
+        help="対戦相手のIDを1行に1つ書いたファイル（#以降はコメント）。--opponent と合わせて指定できる"
+    )
+    parser.add_argument(
+        "--users",
+        default="",
+        help="履歴を取得するユーザーのID（カンマ区切り、未指定の場合はログインユーザー）。複数指定すると1つのログイン済みセッションで全ユーザーのジョブを交互に処理し、ユーザーごとのファイルに保存する"
+    )
+    parser.add_argument(
+        "--users-file",
+        default=None,
+        help="履歴を取得するユーザーのIDを1行に1つ書いたファイル（#以降はコメント）。--users と合わせて指定できる"
     )
     parser.add_argument(
         "--month",
         default=current_month,
         help=f"対象月 YYYY-MM形式 (default: {current_month})"
     )
+    parser.add_argument(
+        "--from",
+        dest="from_month",
+        default=None,
+        help="期間指定の開始月 YYYY-MM形式（--to までの各月を1回のログインで取得し、月ごとにファイルを出力）"
+    )
+    parser.add_argument(
+        "--to",
+        dest="to_month",
+        default=None,
+        help=f"期間指定の終了月 YYYY-MM形式 (default: {current_month})"
+    )
     parser.add_argument(
         "--gtype",
         default=None,
@@ -541,17 +2881,227 @@ def main():
         default=None,
         help="出力ファイル名（未指定の場合は自動生成）"
     )
+    parser.add_argument(
+        "--page-wait",
+        type=float,
+        default=DEFAULT_PAGE_WAIT_TIMEOUT,
+        help=f"履歴ページの描画を待つ最大秒数 (default: {DEFAULT_PAGE_WAIT_TIMEOUT})"
+    )
+    parser.add_argument(
+        "--workers",
+        type=positive_int,
+        default=1,
+        help="全組み合わせモードで並列に使うブラウザ数 (default: 1)"
+    )
+    parser.add_argument(
+        "--fetcher",
+        default="selenium",
+        choices=["selenium", "http"],
+        help="履歴ページの取得方法: selenium=ブラウザで描画, http=ログインCookieを引き継いだHTTPで取得 (default: selenium)"
+    )
+    parser.add_argument(
+        "--engine",
+        default="sync",
+        choices=["sync", "async"],
+        help="ページ巡回エンジン: sync=1ページずつ, async=先読みしながら並行取得（--fetcher http が必要） (default: sync)"
+    )
+    parser.add_argument(
+        "--lookahead",
+        type=positive_int,
+        default=DEFAULT_LOOKAHEAD,
+        help=f"asyncエンジンで組み合わせごとに先読みするページ数 (default: {DEFAULT_LOOKAHEAD})"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=positive_int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"asyncエンジンと --kifu の同時リクエスト数の上限 (default: {DEFAULT_CONCURRENCY})"
+    )
+    parser.add_argument(
+        "--rate",
+        type=positive_float,
+        default=DEFAULT_RATE_LIMIT,
+        help=f"asyncエンジンと --kifu のリクエスト数の上限（件/秒） (default: {DEFAULT_RATE_LIMIT})"
+    )
+    parser.add_argument(
+        "--parser",
+        default=DEFAULT_PARSER_ENGINE,
+        choices=sorted(PARSER_ENGINES),
+        help=f"履歴ページのパーサー: bs4=BeautifulSoup(html.parser), lxml=lxmlによる1パス抽出 (default: {DEFAULT_PARSER_ENGINE})"
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="対局をページごとにNDJSONファイルへ追記し、最後にJSONへ変換する（中断しても取得済みの対局が残る）"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="前回中断した実行のチェックポイントから、各組み合わせの最後に完了したページの次から再開する"
+    )
+    parser.add_argument(
+        "--empty-cache",
+        action="store_true",
+        help="対局がなかった組み合わせを記録し、有効期間内は取得をスキップする"
+    )
+    parser.add_argument(
+        "--db",
+        nargs="?",
+        const=DEFAULT_DB_PATH,
+        default=None,
+        help=f"取得した対局をSQLiteのストアにもupsertする（パス省略時: {DEFAULT_DB_PATH}）"
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="JSONに加えて、ビューアが高速に読み込める列指向ファイル（.columnar）も書き出す"
+    )
+    parser.add_argument(
+        "--block-resources",
+        action="store_true",
+        help="ログイン後の履歴ページで画像・フォント・CSS・メディアの読み込みを止める（Chrome DevTools Protocol）"
+    )
+    parser.add_argument(
+        "--block-third-party",
+        action="store_true",
+        help="--block-resources に加えて広告・アクセス解析などの外部スクリプトも止める"
+    )
+    parser.add_argument(
+        "--session-cache",
+        action="store_true",
+        help="ログイン済みのセッションを cache/ に保存し、次回以降は有効なうちはログインを省く"
+    )
+    parser.add_argument(
+        "--metrics",
+        default=None,
+        help="処理段階ごとの所要時間（p50/p95/最大、組み合わせごとの内訳）をJSONで書き出すファイル"
+    )
+    parser.add_argument(
+        "--prometheus-textfile",
+        default=None,
+        help="処理段階ごとの所要時間をPrometheus（node_exporterのtextfile collector）形式で書き出すファイル"
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="",
+        default=None,
+        help="cProfileとtracemallocで処理段階ごとの関数の処理時間とメモリ確保を計測し、レポートを書き出す（ディレクトリ省略時: tmp/profile/日時）"
+    )
+    parser.add_argument(
+        "--rollup",
+        action="store_true",
+        help="出力ファイルごとに、月・gtype・opponent_type・先手/後手・戦型バッジ・相手の段位ごとの勝敗数の集計（.rollup）を更新する"
+    )
+    parser.add_argument(
+        "--kifu",
+        action="store_true",
+        help=f"保存した全ての対局の対局ページから指し手を取得し、{DEFAULT_KIFU_CACHE_DIR} にキャッシュする（キャッシュ済みの対局は取得しない）"
+    )
+    parser.add_argument(
+        "--record",
+        nargs="?",
+        const=DEFAULT_ARCHIVE_DIR,
+        default=None,
+        help=f"取得した全ての履歴ページを圧縮してアーカイブに記録する（ディレクトリ省略時: {DEFAULT_ARCHIVE_DIR}）"
+    )
+    parser.add_argument(
+        "--replay",
+        nargs="?",
+        const=DEFAULT_ARCHIVE_DIR,
+        default=None,
+        help=f"サイトにアクセスせず、--record で記録したアーカイブから履歴ページを読み込んで解析し直す（ディレクトリ省略時: {DEFAULT_ARCHIVE_DIR}）"
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="既存の出力ファイルにない新しい対局だけを取得してマージする"
+    )
 
     args = parser.parse_args()
 
+    if args.engine == "async" and args.fetcher != "http" and not args.replay:
+        parser.error("--engine async requires --fetcher http")
+    if args.record and args.replay:
+        parser.error("--record cannot be used with --replay")
+    if args.kifu and args.replay:
+        parser.error("--kifu cannot be used with --replay (it needs a logged-in session)")
+
+    # 対戦相手（複数指定した場合は対戦相手ごとにファイルを出力）
+    opponents = [name.strip() for name in args.opponent.split(",") if name.strip()]
+    if args.opponent_file:
+        try:
+            with open(args.opponent_file, "r", encoding="utf-8") as f:
+                opponents.extend(line.split("#", 1)[0].strip() for line in f)
+        except OSError as e:
+            parser.error(f"cannot read --opponent-file: {e}")
+    opponents = [name for name in dict.fromkeys(opponents) if name]
+    if len(opponents) > 1 and args.output:
+        parser.error("--output cannot be used with multiple opponents (one file is written per opponent)")
+
+    # 一括モードで履歴を取得するユーザー（未指定ならログインユーザー）
+    batch_users = [name.strip() for name in args.users.split(",") if name.strip()]
+    if args.users_file:
+        try:
+            with open(args.users_file, "r", encoding="utf-8") as f:
+                batch_users.extend(line.split("#", 1)[0].strip() for line in f)
+        except OSError as e:
+            parser.error(f"cannot read --users-file: {e}")
+    batch_users = [name for name in dict.fromkeys(batch_users) if name]
+    if len(batch_users) > 1 and args.output:
+        parser.error("--output cannot be used with multiple users (one file is written per user)")
+
+    # 期間指定モードの対象月
+    months = [args.month]
+    if args.to_month and not args.from_month:
+        parser.error("--to requires --from")
+    if args.from_month:
+        if args.output:
+            parser.error("--output cannot be used with --from/--to (one file is written per month)")
+        try:
+            months = month_range(args.from_month, args.to_month or current_month)
+        except ValueError:
+            parser.error("--from/--to must be in YYYY-MM format")
+        if not months:
+            parser.error("--from must not be later than --to")
+
     # 引数から値を取得
-    opponent = args.opponent
-    month = args.month
+    # 取得時のフィルタはいずれかの対戦相手に一致する対局（カンマ区切り）
+    opponent = ",".join(opponents)
     gtype = args.gtype
     opponent_type = args.opponent_type
     init_pos_type = args.init_pos_type
     limit = args.limit
     output_file = args.output
+    page_wait_timeout = args.page_wait
+    workers = args.workers
+    fetcher_kind = args.fetcher
+    engine = args.engine
+    lookahead = args.lookahead
+    concurrency = args.concurrency
+    rate = args.rate
+    incremental = args.incremental
+    use_empty_cache = args.empty_cache
+    parser_engine = args.parser
+    stream = args.stream
+    resume = args.resume
+    db_path = args.db
+    columnar = args.columnar
+    use_session_cache = args.session_cache
+    block_third_party = args.block_third_party
+    block_resources = args.block_resources or block_third_party
+    metrics_file = args.metrics
+    prometheus_file = args.prometheus_textfile
+    record_dir = args.record
+    replay_dir = args.replay
+    download_kifu = args.kifu
+    rollup = args.rollup
+
+    # 実行全体を "run" の段階として計測する（ページの巡回・解析・保存はそれぞれの段階に分かれる）
+    profile_stack = ExitStack()
+    if args.profile is not None:
+        profiling.start(args.profile or None)
+        profile_stack.enter_context(profiling.phase("run"))
 
     # 環境変数から認証情報と実行オプションを取得
     login_username = os.environ.get("SHOGIWARS_USERNAME")
@@ -560,38 +3110,93 @@ def main():
     manual_captcha = os.environ.get("SHOGIWARS_MANUAL_CAPTCHA", "").lower() in ("true", "1", "yes")
 
     # 認証情報が設定されていない場合は対話的に入力を求める
-    if not login_username:
+    # （セッションを再利用する場合、パスワードはログインが必要になったときに入力する）
+    # リプレイモードではログインしない
+    if not login_username and not replay_dir:
         login_username = input("将棋ウォーズのユーザー名を入力してください: ")
-    if not login_password:
+    if not login_password and not use_session_cache and not replay_dir:
         login_password = getpass.getpass("将棋ウォーズのパスワードを入力してください: ")
 
-    # WebDriverの初期化（undetected_chromedriverを使用）
-    options = uc.ChromeOptions()
-    if headless:
-        options.add_argument("--headless=new")
-
-    # 基本的な設定
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--window-size=1920,1080")
+    session_cache = SessionCache.for_login(login_username) if use_session_cache and not replay_dir else None
 
     driver = None
+    # 並列モードで追加起動したdriver
+    pool_drivers = []
+    store = None
+    metrics = ScrapeMetrics()
     try:
-        print("Initializing Undetected Chrome WebDriver...")
-        # version_mainを指定せずに自動検出させる
-        driver = uc.Chrome(options=options)
-
-        # ログイン
-        login_success, user = login_to_shogiwars(driver, login_username, login_password, manual_captcha=manual_captcha)
-        if not login_success:
-            print("ログインに失敗しました。")
-            return
+        archive = None
+        if replay_dir:
+            # ブラウザを起動せず、アーカイブに記録されたユーザーの履歴ページを解析する
+            if not os.path.isdir(replay_dir):
+                print(f"エラー: アーカイブが見つかりません: {replay_dir}")
+                return
+            archive = PageArchive(replay_dir)
+            users = archive.users()
+            if batch_users:
+                # 一括モードでは指定した全てのユーザーを順に読み込む（対象のユーザーは (ユーザー, 月) ごとのMonthTargetが持つ）
+                missing_users = [batch_user for batch_user in batch_users if batch_user not in users]
+                if missing_users:
+                    print(f"エラー: アーカイブ {replay_dir} に記録されていないユーザーがあります: {', '.join(missing_users)} "
+                          f"(記録されているユーザー: {', '.join(users) or 'なし'})")
+                    return
+                user = None
+            elif login_username in users:
+                user = login_username
+            elif len(users) == 1:
+                user = users[0]
+            else:
+                print(f"エラー: アーカイブ {replay_dir} から対象のユーザーを決められません "
+                      f"(記録されているユーザー: {', '.join(users) or 'なし'})。"
+                      f"SHOGIWARS_USERNAME で指定してください。")
+                return
+            if batch_users:
+                print(f"\n=== Replaying game history for users: {', '.join(batch_users)} from {replay_dir} ===\n")
+            else:
+                print(f"\n=== Replaying game history for user: {user} from {replay_dir} ===\n")
+        else:
+            print("Initializing Undetected Chrome WebDriver...")
+            with metrics.time("driver_start"):
+                driver = create_driver(headless, user_data_dir=session_cache.profile_dir if session_cache else None)
+
+            # 保存したセッションが有効ならログインを省く
+            user = None
+            if session_cache:
+                with metrics.time("login"):
+                    user = session_cache.restore(driver)
+
+            if not user:
+                if not login_password:
+                    login_password = getpass.getpass("将棋ウォーズのパスワードを入力してください: ")
+
+                # ログイン
+                with metrics.time("login"):
+                    login_success, user = login_to_shogiwars(driver, login_username, login_password, manual_captcha=manual_captcha)
+                if not login_success:
+                    print("ログインに失敗しました。")
+                    return
+
+                if session_cache and user:
+                    session_cache.save(driver, user)
+
+            if not user:
+                print("エラー: ログインユーザーのIDを取得できませんでした。")
+                return
+
+            if batch_users:
+                print(f"\n=== Logged in as {user}, scraping game history for users: {', '.join(batch_users)} ===\n")
+            else:
+                print(f"\n=== Scraping game history for user: {user} ===\n")
 
-        if not user:
-            print("エラー: ログインユーザーのIDを取得できませんでした。")
-            return
+            # ログインが済んでから、履歴ページに不要なリソースの読み込みを止める
+            if block_resources:
+                patterns = block_page_resources(driver, block_third_party)
+                print(f"Blocking {len(patterns)} resource patterns on history pages "
+                      f"({', '.join(BLOCKED_RESOURCE_TYPES)}{', third-party scripts' if block_third_party else ''})")
 
-        print(f"\n=== Scraping game history for user: {user} ===\n")
+            if record_dir:
+                archive = PageArchive(record_dir)
+                print(f"Recording history pages to {record_dir}")
 
         # 全組み合わせをループするかどうかを判定
         all_combinations_mode = (gtype is None and opponent_type is None and init_pos_type is None)
@@ -599,78 +3204,13 @@ def main():
         if all_combinations_mode:
             print("全組み合わせモード: gtype, opponent_type, init_pos_type の全ての組み合わせをスクレイピングします\n")
 
-            # 全ての組み合わせを定義
-            all_gtypes = ["s1", "sb", "10min", "sf"]
-            all_opponent_types = ["normal", "friend", "coach", "closed_event", "learning"]
-            all_init_pos_types = ["normal", "sprint"]
-
-            total_combinations = len(all_gtypes) * len(all_opponent_types) * len(all_init_pos_types)
-            current_combination = 0
-
-            # 全ての棋譜を1つのリストに集約
-            all_game_urls = []
-
-            # 全組み合わせをループ
-            for gt in all_gtypes:
-                for ot in all_opponent_types:
-                    for ipt in all_init_pos_types:
-                        current_combination += 1
-                        print(f"\n{'='*80}")
-                        print(f"組み合わせ [{current_combination}/{total_combinations}]: gtype={gt}, opponent_type={ot}, init_pos_type={ipt}")
-                        print(f"{'='*80}\n")
-
-                        # 棋譜URLを抽出
-                        game_urls = scrape_game_urls(
-                            driver=driver,
-                            user=user,
-                            opponent=opponent,
-                            month=month,
-                            gtype=gt,
-                            opponent_type=ot,
-                            init_pos_type=ipt,
-                            limit=limit
-                        )
-
-                        if game_urls:
-                            print(f"Found {len(game_urls)} games for this combination")
-                            all_game_urls.extend(game_urls)
-                        else:
-                            print(f"No games found for this combination")
-
-            print(f"\n{'='*80}")
-            print(f"全組み合わせのスクレイピングが完了しました！ ({total_combinations}個)")
-            print(f"Total games found: {len(all_game_urls)}")
-            print(f"{'='*80}\n")
-
-            if all_game_urls:
-                # 出力ファイル名を生成
-                result_dir = "result"
-                os.makedirs(result_dir, exist_ok=True)
-
-                if opponent:
-                    filename = f"game_replays_{month}_{user}_{opponent}.json"
-                else:
-                    filename = f"game_replays_{month}_{user}.json"
-
-                output_filename = os.path.join(result_dir, filename)
-                print(f"Output file: {output_filename}")
-
-                # 検索パラメータを記録（全組み合わせ）
-                query_params = {
-                    "user": user,
-                    "opponent": opponent if opponent else "(all)",
-                    "month": month,
-                    "gtype": "(all)",
-                    "opponent_type": "(all)",
-                    "init_pos_type": "(all)",
-                    "limit": limit if limit else "(all)"
-                }
-
-                # JSONに保存
-                save_to_json(all_game_urls, output_filename, query_params)
-            else:
-                print(f"\nNo games found")
-
+            combinations = all_combinations()
+            # 検索パラメータを記録（全組み合わせ）
+            combination_params = {
+                "gtype": "(all)",
+                "opponent_type": "(all)",
+                "init_pos_type": "(all)"
+            }
         else:
             # 単一パラメータモード（従来の動作）
             # デフォルト値を設定
@@ -681,59 +3221,278 @@ def main():
             if init_pos_type is None:
                 init_pos_type = "normal"
 
-            # 出力ファイル名を生成（未指定の場合）
-            if output_file is None:
-                # resultディレクトリを作成（存在しない場合）
-                result_dir = "result"
-                os.makedirs(result_dir, exist_ok=True)
-
-                # ファイル名を生成（シンプルな形式）
-                if opponent:
-                    # 対戦相手が指定されている場合
-                    filename = f"game_replays_{month}_{user}_{opponent}.json"
+            combinations = [(gtype, opponent_type, init_pos_type)]
+            combination_params = {
+                "gtype": gtype,
+                "opponent_type": opponent_type,
+                "init_pos_type": init_pos_type
+            }
+
+        if len(months) > 1:
+            print(f"期間指定モード: {months[0]} 〜 {months[-1]} の{len(months)}か月 "
+                  f"({len(months) * len(combinations)} ジョブ) をスクレイピングします\n")
+
+        if len(opponents) > 1:
+            print(f"複数の対戦相手: {', '.join(opponents)} の対局を1回の取得で振り分けます\n")
+
+        target_users = batch_users or [user]
+        if len(target_users) > 1:
+            print(f"一括モード: {len(target_users)}人のユーザー × {len(months)}か月 × {len(combinations)}組み合わせ "
+                  f"({len(target_users) * len(months) * len(combinations)} ジョブ) をユーザーごとに交互に処理します\n")
+
+        # ユーザーごとの空の組み合わせキャッシュ
+        empty_caches = {
+            target_user: EmptyCombinationCache.for_user(target_user) for target_user in target_users
+        } if use_empty_cache else {}
+
+        # (ユーザー, 月) ごとの出力先を準備
+        targets = []
+        for target_user, target_month in itertools.product(target_users, months):
+            routes = []
+            known_games = KnownGames() if incremental else None
+            for route_opponent in opponents or [""]:
+                # 全組み合わせモードと期間指定モードでは常に自動生成したファイル名を使う
+                if output_file and not all_combinations_mode:
+                    output_filename = output_file
                 else:
-                    # 対戦相手が未指定（全検索）の場合
-                    filename = f"game_replays_{month}_{user}.json"
-
-                output_filename = os.path.join(result_dir, filename)
+                    output_filename = default_output_filename(target_month, target_user, route_opponent)
                 print(f"Output file: {output_filename}")
-            else:
-                output_filename = output_file
 
-            # 棋譜URLを抽出
-            game_urls = scrape_game_urls(
-                driver=driver,
+                # 差分取得モードでは既存ファイルのgame_idを索引として読み込む
+                existing_replays = []
+                route_game_ids = set()
+                if incremental:
+                    existing_replays = load_replays(output_filename)
+                    route_game_ids = {replay["game_id"] for replay in existing_replays if replay.get("game_id")}
+                    if os.path.exists(output_filename):
+                        print(f"Incremental mode: {len(route_game_ids)} known games in {output_filename}")
+                    else:
+                        print(f"Incremental mode: {output_filename} does not exist yet - fetching all pages for it")
+
+                route = OutputRoute(route_opponent, output_filename, existing_replays)
+                if known_games is not None:
+                    known_games.add_route(route.matches, route_game_ids)
+                routes.append(route)
+
+            # 複数の対戦相手の出力先は、チェックポイントと途中経過を1つにまとめる
+            if len(routes) == 1:
+                shared_filename = routes[0].output_filename
+            else:
+                shared_filename = default_output_filename(target_month, target_user, "+".join(opponents))
+
+            # 完了したページをチェックポイントに記録し、中断しても --resume で再開できるようにする
+            checkpoint_name = os.path.splitext(os.path.basename(shared_filename))[0]
+            checkpoint = Checkpoint(os.path.join("tmp", f"checkpoint_{checkpoint_name}.ndjson"), resume=resume)
+
+            # ストリーミング出力では出力ファイルと同じ場所に途中経過のNDJSONを書く
+            sink = None
+            if stream:
+                stream_path = os.path.splitext(shared_filename)[0] + ".ndjson"
+                sink = NdjsonSink(stream_path, resume=resume)
+                print(f"Streaming games to {stream_path}")
+
+            targets.append(MonthTarget(
+                target_month,
+                routes=routes,
+                known_games=known_games,
+                sink=sink,
+                checkpoint=checkpoint,
+                user=target_user if batch_users else None,
+                empty_cache=empty_caches.get(target_user)
+            ))
+
+        if db_path:
+            store = ReplayStore(db_path)
+            print(f"Replay store: {db_path} ({store.count()} games)")
+
+        # 棋譜URLを抽出（(月, 組み合わせ) の全ジョブを1つのスケジューラで処理する）
+        if engine == "async":
+            if replay_dir:
+                fetcher = ReplayFetcher(archive)
+            else:
+                fetcher = create_fetchers(
+                    driver, fetcher_kind, 1, headless, page_wait_timeout, pool_drivers,
+                    http_pool_size=concurrency
+                )[0]
+                if record_dir:
+                    fetcher = RecordingFetcher(fetcher, archive)
+            target_game_urls = asyncio.run(scrape_months_async(
+                fetcher=fetcher,
+                user=user,
+                opponent=opponent,
+                targets=targets,
+                combinations=combinations,
+                limit=limit,
+                lookahead=lookahead,
+                concurrency=concurrency,
+                rate=rate,
+                parser_engine=parser_engine,
+                metrics=metrics
+            ))
+        else:
+            if replay_dir:
+                # アーカイブの読み込みは共有できるのでブラウザは起動しない
+                fetchers = [ReplayFetcher(archive)] * min(workers, len(targets) * len(combinations))
+            else:
+                fetchers = create_fetchers(
+                    driver, fetcher_kind, min(workers, len(targets) * len(combinations)), headless,
+                    page_wait_timeout, pool_drivers,
+                    block_resources=block_resources, block_third_party=block_third_party
+                )
+                if record_dir:
+                    fetchers = [RecordingFetcher(fetcher, archive) for fetcher in fetchers]
+            target_game_urls = scrape_months(
+                fetchers=fetchers,
                 user=user,
                 opponent=opponent,
-                month=month,
-                gtype=gtype,
-                opponent_type=opponent_type,
-                init_pos_type=init_pos_type,
-                limit=limit
+                targets=targets,
+                combinations=combinations,
+                limit=limit,
+                parser_engine=parser_engine,
+                metrics=metrics
             )
 
-            if game_urls:
+        if empty_caches:
+            for empty_cache in empty_caches.values():
+                empty_cache.save()
+            skipped = sum(empty_cache.skipped for empty_cache in empty_caches.values())
+            print(f"Empty-combination cache: skipped {skipped} combinations "
+                  f"(saved at least {skipped} page fetches)")
+
+        for target_index, target in enumerate(targets):
+            month_games = target_game_urls[target_index]
+            sink = target.sink
+
+            # 取得した対局数（ストリーミング出力時はNDJSONに書き込んだ数）
+            total_found = sink.count if sink is not None else len(month_games)
+
+            if all_combinations_mode:
+                print(f"\n{'='*80}")
+                print(f"全組み合わせのスクレイピングが完了しました！ ({len(combinations)}個)")
+                if len(targets) > 1:
+                    print(f"Month: {target.label}")
+                print(f"Total games found: {total_found}")
+                print(f"{'='*80}\n")
+
+            for route in target.routes:
+                output_filename = route.output_filename
+                game_urls = month_games
+                found = total_found
+                # 複数の対戦相手を指定した場合は、その対戦相手の対局だけを振り分ける
+                replay_filter = route.matches if len(target.routes) > 1 else None
+                if replay_filter is not None:
+                    if sink is not None:
+                        found = sum(1 for _ in sink.iter_replays(combinations, replay_filter))
+                    else:
+                        game_urls = [game for game in month_games if replay_filter(game)]
+                        found = len(game_urls)
+                    print(f"\n{route.opponent}: {found} games")
+
                 # 検索パラメータを記録
                 query_params = {
-                    "user": user,
-                    "opponent": opponent if opponent else "(all)",
-                    "month": month,
-                    "gtype": gtype,
-                    "opponent_type": opponent_type,
-                    "init_pos_type": init_pos_type,
+                    "user": target.user or user,
+                    "opponent": route.opponent if route.opponent else "(all)",
+                    "month": target.month,
+                    **combination_params,
                     "limit": limit if limit else "(all)"
                 }
 
-                # JSONに保存
-                save_to_json(game_urls, output_filename, query_params)
-            else:
-                print(f"\nNo games found with opponent: {opponent}")
+                save_start = time.monotonic()
+
+                if found and store is not None:
+                    # ストリーミング出力時はNDJSONから読み出す
+                    stored = store.upsert(
+                        sink.iter_replays(combinations, replay_filter) if sink is not None else game_urls
+                    )
+                    print(f"Upserted {stored} games into {db_path}")
+
+                if found and sink is not None and not incremental:
+                    # NDJSONから従来のJSON形式に変換
+                    sink.finalize(output_filename, query_params, combinations,
+                                  rollup_combinations=target.game_combinations if rollup else None,
+                                  replay_filter=replay_filter)
+                elif found:
+                    if sink is not None:
+                        # 差分取得では新しい対局だけなので読み込んでマージする
+                        game_urls = list(sink.iter_replays(combinations, replay_filter))
+
+                    if incremental:
+                        print(f"Merging {len(game_urls)} new games into {len(route.existing_replays)} existing games")
+                        game_urls = merge_replays(
+                            route.existing_replays, game_urls,
+                            [target.fetched_game_ids.get(combination, []) for combination in combinations]
+                        )
+
+                    # JSONに保存
+                    save_to_json(game_urls, output_filename, query_params,
+                                 rollup_combinations=target.game_combinations if rollup else None)
+                elif incremental:
+                    print(f"\nNo new games since the last run")
+                elif route.opponent:
+                    print(f"\nNo games found with opponent: {route.opponent}")
+                else:
+                    print(f"\nNo games found")
+
+                if found and columnar:
+                    # 保存したJSONを少しずつ読み込んで列指向ファイルに変換
+                    export_json_file(output_filename, columnar_path(output_filename))
+
+                if found:
+                    metrics.record("save", time.monotonic() - save_start)
+
+            if target.incomplete:
+                # 失敗した組み合わせがある場合は、--resume で続きから取得できるように途中経過を残す
+                print(f"\nWarning: {target.label} is incomplete ({len(target.incomplete)} combinations failed or stopped "
+                      f"on a fetch error). The saved output is partial; the checkpoint is kept - rerun with --resume")
+                if sink is not None:
+                    sink.close()
+                target.checkpoint.close()
+                continue
+
+            # 全ての出力先に変換したら途中経過のファイルは不要
+            if sink is not None and os.path.exists(sink.path):
+                sink.close()
+                os.remove(sink.path)
+
+            # 出力の保存まで完了したのでチェックポイントは不要
+            target.checkpoint.remove()
+
+        if download_kifu:
+            # 保存した出力ファイルの全ての対局（差分取得では既存の対局も含む）のうち、未取得のものだけを取得する
+            game_ids = [
+                replay["game_id"]
+                for target in targets
+                for route in target.routes
+                for replay in load_replays(route.output_filename)
+                if replay.get("game_id")
+            ]
+            kifu_fetcher = HttpFetcher(create_http_session(driver, pool_size=concurrency))
+            asyncio.run(download_kifus_async(
+                kifu_fetcher, game_ids, KifuCache(), concurrency=concurrency, rate=rate, metrics=metrics
+            ))
 
     except Exception as e:
         print(f"Error: {e}")
         import traceback
         traceback.print_exc()
     finally:
+        if args.profile is not None:
+            profile_stack.close()
+            profiling.stop()
+        # 途中で失敗した場合も、そこまでの所要時間を書き出す
+        if metrics_file or prometheus_file:
+            metrics.print_summary()
+        if metrics_file:
+            metrics.write_json(metrics_file)
+        if prometheus_file:
+            metrics.write_prometheus(prometheus_file)
+        if store is not None:
+            store.close()
+        for pool_driver in pool_drivers:
+            try:
+                pool_driver.quit()
+            except Exception:
+                pass
         if driver:
             print("Closing browser...")
             driver.quit()
@@ -0,0 +1,111 @@
+"""
+チェックポイント（--resume）からの再開を、ローカルのモック履歴サーバーに対して確認するテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shogiwars_scraper
+from mock_history_server import MockHistoryServer
+from shogiwars_scraper import Checkpoint, HttpFetcher
+
+
+COMBINATION = ("sb", "normal", "normal")
+
+GAMES = {
+    COMBINATION: 45,
+}
+
+
+class InterruptedFetcher(HttpFetcher):
+    """
+    指定したページ以降の取得に失敗する（実行の中断の代わり）
+    """
+
+    def __init__(self, session: requests.Session, fail_from_page: int):
+        super().__init__(session)
+        self.fail_from_page = fail_from_page
+
+    def fetch(self, url, page_stats=None):
+        page = int(url.rsplit("page=", 1)[1].split("&", 1)[0])
+        if page >= self.fail_from_page:
+            raise requests.ConnectionError("connection reset")
+        return super().fetch(url, page_stats)
+
+
+class CheckpointResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "checkpoint.ndjson")
+        self.server = MockHistoryServer(GAMES).start()
+        self.base_url = shogiwars_scraper.BASE_URL
+        shogiwars_scraper.BASE_URL = self.server.base_url
+
+    def tearDown(self):
+        shogiwars_scraper.BASE_URL = self.base_url
+        self.server.stop()
+        self.tmp_dir.cleanup()
+
+    def scrape(self, fetcher, checkpoint=None, stats=None):
+        return shogiwars_scraper.scrape_game_urls(
+            fetcher, "ohakado", "", "2024-10", *COMBINATION, stats=stats, checkpoint=checkpoint
+        )
+
+    def requested_pages(self) -> list:
+        return [int(path.rsplit("page=", 1)[1].split("&", 1)[0]) for path in self.server.requests]
+
+    def test_resume_continues_after_last_completed_page(self):
+        full = self.scrape(HttpFetcher(requests.Session()))
+        self.server.requests.clear()
+
+        # 3ページ目で中断した実行: 2ページ分が記録され、組み合わせは完了扱いにならない
+        checkpoint = Checkpoint(self.path)
+        stats = {}
+        partial = self.scrape(InterruptedFetcher(requests.Session(), 3), checkpoint, stats)
+        checkpoint.close()
+        self.assertEqual(partial, full[:20])
+        self.assertTrue(stats["incomplete"])
+
+        # 中断時に途中まで書かれた行は再開時に切り捨てる
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write('{"type": "page", "combination": ["sb", "nor')
+
+        self.server.requests.clear()
+        checkpoint = Checkpoint(self.path, resume=True)
+        self.assertEqual(checkpoint.resume_point(COMBINATION), (3, full[:20], False))
+        resumed = self.scrape(HttpFetcher(requests.Session()), checkpoint)
+        checkpoint.close()
+        self.assertEqual(resumed, full)
+        self.assertEqual(self.requested_pages(), [3, 4, 5])
+
+        # 完了した組み合わせは取得し直さない
+        self.server.requests.clear()
+        checkpoint = Checkpoint(self.path, resume=True)
+        self.assertEqual(self.scrape(HttpFetcher(requests.Session()), checkpoint), full)
+        checkpoint.close()
+        self.assertEqual(self.server.requests, [])
+
+    def test_without_resume_discards_existing_checkpoint(self):
+        checkpoint = Checkpoint(self.path)
+        checkpoint.record_page(COMBINATION, 1, [{"game_id": "stale", "url": "https://example.com/stale"}])
+        checkpoint.record_finished(COMBINATION)
+        checkpoint.close()
+
+        checkpoint = Checkpoint(self.path)
+        self.assertEqual(checkpoint.resume_point(COMBINATION), (1, [], False))
+        games = self.scrape(HttpFetcher(requests.Session()), checkpoint)
+        checkpoint.close()
+        self.assertEqual(len(games), 45)
+        self.assertNotIn("stale", {game["game_id"] for game in games})
+
+
+if __name__ == "__main__":
+    unittest.main()
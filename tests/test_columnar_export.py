@@ -0,0 +1,92 @@
+"""
+列指向ファイル（columnar_export.py）のテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from columnar_export import URL_TEMPLATE, columnar_path, export_json_file, load_columnar, read_manifest
+from shogiwars_scraper import save_to_json
+
+
+PARAMS = {"user": "ohakado", "opponent": "(all)", "month": "2024-10",
+          "gtype": "(all)", "opponent_type": "(all)", "init_pos_type": "(all)", "limit": "(all)"}
+
+
+def replay(index: int, badges: list, datetime=None) -> dict:
+    game_id = f"ohakado-rival{index % 3}-202410{index + 1:02d}_120000"
+    return {
+        "url": URL_TEMPLATE.format(game_id=game_id),
+        "game_id": game_id,
+        "sente": {"name": "ohakado", "class": "五段", "result": "win" if index % 2 else "lose"},
+        "gote": {"name": f"rival{index % 3}", "class": ["四段", "1級"][index % 2], "result": "lose" if index % 2 else "win"},
+        "datetime": datetime if datetime is not None else f"2024-10-{index + 1:02d}T12:00:00",
+        "badges": badges,
+    }
+
+
+class ColumnarExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.json_file = os.path.join(self.tmp_dir.name, "game_replays_2024-10_ohakado.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def export(self, replays: list):
+        save_to_json(replays, self.json_file, PARAMS)
+        count = export_json_file(self.json_file)
+        return count, columnar_path(self.json_file)
+
+    def test_round_trip_and_manifest(self):
+        replays = [replay(index, [["角換わり"], [], ["角換わり", "腰掛け銀"]][index % 3]) for index in range(7)]
+        count, path = self.export(replays)
+
+        self.assertEqual(count, 7)
+        manifest = read_manifest(path)
+        self.assertEqual(manifest["count"], 7)
+        self.assertEqual(manifest["params"], PARAMS)
+        self.assertEqual(manifest["url_template"], URL_TEMPLATE)
+        self.assertEqual(manifest["datetime"]["min"], "2024-10-01T12:00:00")
+        self.assertEqual(manifest["datetime"]["max"], "2024-10-07T12:00:00")
+        self.assertEqual(manifest["dictionaries"]["badges"], ["角換わり", "腰掛け銀"])
+        # 辞書符号化した列と、CSR形式のバッジの長さ
+        self.assertEqual(manifest["columns"]["sente_name"]["length"], 7)
+        self.assertEqual(manifest["columns"]["badge_offsets"]["length"], 8)
+        self.assertEqual(manifest["columns"]["badge_codes"]["length"], sum(len(game["badges"]) for game in replays))
+        self.assertNotIn("url_offsets", manifest["columns"])
+
+        loaded = load_columnar(path)
+        self.assertEqual(len(loaded), 7)
+        self.assertEqual(loaded.to_replays(), replays)
+
+    def test_custom_urls_and_missing_datetime(self):
+        replays = [replay(0, []), replay(1, ["右四間飛車"], datetime="")]
+        replays[0]["url"] = "https://example.com/games/custom"
+        _, path = self.export(replays)
+
+        manifest = read_manifest(path)
+        self.assertIsNone(manifest["url_template"])
+        self.assertIn("url_offsets", manifest["columns"])
+
+        loaded = load_columnar(path).to_replays()
+        self.assertEqual(loaded[0]["url"], "https://example.com/games/custom")
+        # 日時のない対局はNoneに戻る
+        self.assertIsNone(loaded[1]["datetime"])
+        self.assertEqual(loaded[1]["badges"], ["右四間飛車"])
+
+    def test_empty_file(self):
+        count, path = self.export([])
+        self.assertEqual(count, 0)
+        self.assertEqual(read_manifest(path)["count"], 0)
+        self.assertEqual(load_columnar(path).to_replays(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+空の組み合わせキャッシュ（--empty-cache）の有効期間のテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shogiwars_scraper import EmptyCombinationCache
+
+
+COMBINATION = ("sf", "coach", "sprint")
+
+
+class EmptyCacheTtlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = EmptyCombinationCache(os.path.join(self.tmp_dir.name, "empty.json"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def checked(self, month: str, checked_at: float):
+        self.cache.entries = {month: {"/".join(COMBINATION): checked_at}}
+
+    def is_empty_at(self, now: datetime) -> bool:
+        with mock.patch("shogiwars_scraper.time.time", return_value=now.timestamp()):
+            return self.cache.is_empty("2024-10", COMBINATION)
+
+    def test_entry_checked_during_the_month_keeps_the_short_ttl(self):
+        # 月の最終日に確認した記録は、月が変わっても当月の有効期間
+        self.checked("2024-10", datetime(2024, 10, 31, 23, 0).timestamp())
+        self.assertTrue(self.is_empty_at(datetime(2024, 11, 1, 4, 0)))
+        self.assertFalse(self.is_empty_at(datetime(2024, 11, 1, 7, 0)))
+
+    def test_entry_checked_after_the_month_ended_uses_the_long_ttl(self):
+        self.checked("2024-10", datetime(2024, 11, 1, 1, 0).timestamp())
+        self.assertTrue(self.is_empty_at(datetime(2024, 11, 20)))
+        self.assertFalse(self.is_empty_at(datetime(2024, 12, 2)))
+
+    def test_round_trip(self):
+        self.cache.record("2000-01", COMBINATION, True)
+        self.cache.save()
+        self.assertTrue(EmptyCombinationCache(self.cache.path).is_empty("2000-01", COMBINATION))
+        self.cache.record("2000-01", COMBINATION, False)
+        self.assertFalse(self.cache.is_empty("2000-01", COMBINATION))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+HTTPフェッチャーのチャレンジページの判定とブラウザへのフォールバックを、ローカルのモック履歴サーバーに対して確認するテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import os
+import sys
+import unittest
+from urllib.parse import urlsplit
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shogiwars_scraper
+from mock_history_server import MockHistoryServer
+from shogiwars_scraper import HttpFetcher, SeleniumFetcher, looks_like_challenge
+
+
+GAMES = {
+    ("10min", "normal", "normal"): 25,
+}
+
+
+class FakeBrowserDriver:
+    """
+    チャレンジを通過したブラウザの代わりに、cf_clearanceのCookieを付けてページを取得するwebdriver
+    """
+
+    def __init__(self, base_url: str):
+        self.host = urlsplit(base_url).hostname
+        self.session = requests.Session()
+        self.session.cookies.set("cf_clearance", "passed", domain=self.host, path="/")
+        self.page_source = ""
+        self.gets = 0
+
+    def get(self, url: str):
+        self.gets += 1
+        self.page_source = self.session.get(url).text
+
+    def execute_script(self, script, *args):
+        return "games" if "game_players" in self.page_source else "empty"
+
+    def get_cookies(self):
+        return [{"name": "cf_clearance", "value": "passed", "domain": self.host, "path": "/"}]
+
+
+class ChallengeDetectionTest(unittest.TestCase):
+
+    def test_history_page_with_detection_script_is_not_a_challenge(self):
+        with MockHistoryServer(GAMES) as server:
+            response = requests.get(f"{server.base_url}/games/history?user_id=ohakado&month=2024-10")
+        self.assertIn("challenge-platform", response.text)
+        self.assertFalse(looks_like_challenge(response.status_code, response.url, response.headers, response.text))
+
+    def test_challenge_signals(self):
+        url = "https://shogiwars.heroz.jp/games/history"
+        self.assertTrue(looks_like_challenge(200, url, {"cf-mitigated": "challenge"}, ""))
+        self.assertTrue(looks_like_challenge(403, url, {}, ""))
+        self.assertTrue(looks_like_challenge(503, url, {}, ""))
+        self.assertTrue(looks_like_challenge(200, url, {}, "<html><head><title>Just a moment...</title></head></html>"))
+        self.assertTrue(looks_like_challenge(200, "https://shogiwars.heroz.jp/login", {}, ""))
+        self.assertFalse(looks_like_challenge(200, url, {}, "<p>Just a moment...</p>"))
+
+
+class FallbackCookieTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockHistoryServer(GAMES, challenge=True).start()
+        self.base_url = shogiwars_scraper.BASE_URL
+        shogiwars_scraper.BASE_URL = self.server.base_url
+
+    def tearDown(self):
+        shogiwars_scraper.BASE_URL = self.base_url
+        self.server.stop()
+
+    def test_fallback_copies_clearance_cookie(self):
+        driver = FakeBrowserDriver(self.server.base_url)
+        fetcher = HttpFetcher(requests.Session(), fallback=SeleniumFetcher(driver, page_wait_timeout=1.0))
+        game_urls = shogiwars_scraper.scrape_game_urls(fetcher, "ohakado", "", "2024-10", None, "normal", "normal")
+
+        self.assertEqual(len(game_urls), 25)
+        # 1ページ目だけブラウザで取得し、以降のページは引き継いだCookieでHTTPで取得する
+        self.assertEqual(self.server.challenges, 1)
+        self.assertEqual(driver.gets, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
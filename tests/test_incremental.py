@@ -0,0 +1,74 @@
+"""
+--incremental のマージが全件取得と同じ順になることを、ローカルのモック履歴サーバーに対して確認するテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import os
+import sys
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shogiwars_scraper
+from mock_history_server import MockHistoryServer
+from shogiwars_scraper import HttpFetcher, KnownGames, MonthTarget, all_combinations, merge_replays, scrape_months
+
+
+# 組み合わせごとの対局数（1ページ10局）
+GAMES = {
+    ("s1", "normal", "normal"): 12,
+    ("sb", "normal", "normal"): 35,
+    ("10min", "normal", "normal"): 20,
+    ("10min", "friend", "sprint"): 3,
+}
+
+# 前回の実行の後に増えた対局の数（履歴の先頭の対局）。対局数と同じ組み合わせは前回の実行では対局がなかった
+NEW_GAMES = {
+    ("s1", "normal", "normal"): 3,
+    ("sb", "normal", "normal"): 12,
+    ("10min", "friend", "sprint"): 3,
+}
+
+
+class IncrementalMergeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockHistoryServer(GAMES).start()
+        self.base_url = shogiwars_scraper.BASE_URL
+        shogiwars_scraper.BASE_URL = self.server.base_url
+
+    def tearDown(self):
+        shogiwars_scraper.BASE_URL = self.base_url
+        self.server.stop()
+
+    def test_merge_keeps_full_run_order(self):
+        combinations = all_combinations()
+        fetcher = HttpFetcher(requests.Session())
+        full = scrape_months([fetcher], "ohakado", "", [MonthTarget("2024-10")], combinations)[0]
+
+        # 前回の実行の出力: 各組み合わせの新しい対局を除いた全件取得の順
+        new_game_ids = set()
+        for combination, count in NEW_GAMES.items():
+            stats = {}
+            game_urls = shogiwars_scraper.scrape_game_urls(
+                fetcher, "ohakado", "", "2024-10", *combination, stats=stats
+            )
+            new_game_ids.update(game["game_id"] for game in game_urls[:count])
+        existing = [game for game in full if game["game_id"] not in new_game_ids]
+
+        known_games = KnownGames()
+        known_games.add_route(lambda game: True, {game["game_id"] for game in existing})
+        target = MonthTarget("2024-10", known_games=known_games)
+        new = scrape_months([fetcher], "ohakado", "", [target], combinations)[0]
+
+        self.assertEqual({game["game_id"] for game in new}, new_game_ids)
+        merged = merge_replays(
+            existing, new, [target.fetched_game_ids.get(combination, []) for combination in combinations]
+        )
+        self.assertEqual(merged, full)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""
+対局ページの指し手の抽出とキャッシュ（kifu_cache.py）のテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import html
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kifu_cache import KifuCache, extract_moves
+
+
+def react_page(*props: dict) -> str:
+    return "".join(
+        f'<div data-react-props="{html.escape(json.dumps(value), quote=True)}"></div>' for value in props
+    )
+
+
+class ExtractMovesTest(unittest.TestCase):
+
+    def test_react_props(self):
+        page = react_page({"gameHash": {"moves": [{"m": "+7776FU", "t": 599}, {"m": "-3334FU", "t": 597},
+                                                  {"m": "SENTE_WIN_TORYO", "t": 0}]}})
+        self.assertEqual(extract_moves(page), [{"move": "+7776FU", "time": 599}, {"move": "-3334FU", "time": 597}])
+
+    def test_empty_moves_prop_is_not_the_kifu(self):
+        # 指し手と関係ない空の "moves" は飛ばし、後ろのコンポーネントの指し手を使う
+        page = react_page({"sidebar": {"moves": []}}, {"game": {"moves": [{"m": "+2726FU", "t": 600}]}})
+        self.assertEqual(extract_moves(page), [{"move": "+2726FU", "time": 600}])
+
+    def test_page_without_moves_raises(self):
+        with self.assertRaises(ValueError):
+            extract_moves(react_page({"sidebar": {"moves": []}}))
+        with self.assertRaises(ValueError):
+            extract_moves('<script>receiveMove("")</script>')
+
+    def test_receive_move(self):
+        page = '<script>receiveMove("+7776FU,L599\\t-3334FU,L597\\tSENTE_WIN_TORYO")</script>'
+        self.assertEqual(extract_moves(page), [{"move": "+7776FU", "time": 599}, {"move": "-3334FU", "time": 597}])
+
+
+class KifuCacheTest(unittest.TestCase):
+
+    def test_put_get_and_refuse_empty(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache = KifuCache(tmp_dir)
+            moves = [{"move": "+7776FU", "time": 599}]
+            cache.put("a-b-20241005_120000", moves)
+            self.assertEqual(cache.get("a-b-20241005_120000"), moves)
+
+            with self.assertRaises(ValueError):
+                cache.put("a-c-20241005_130000", [])
+            self.assertEqual(cache.missing(["a-b-20241005_120000", "a-c-20241005_130000"]), ["a-c-20241005_130000"])
+
+
+if __name__ == "__main__":
+    unittest.main()
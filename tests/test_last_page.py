@@ -0,0 +1,75 @@
+"""
+最終ページの判定（inspect_history_page / detect_last_page）を、ローカルのモック履歴サーバーのページに対して確認するテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import os
+import sys
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shogiwars_scraper
+from mock_history_server import MockHistoryServer
+from shogiwars_scraper import HttpFetcher, detect_last_page, inspect_history_page
+
+
+GAMES = {
+    ("sb", "normal", "normal"): 25,
+    ("s1", "normal", "normal"): 30,
+}
+
+
+class InspectHistoryPageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockHistoryServer(GAMES).start()
+        self.base_url = shogiwars_scraper.BASE_URL
+        shogiwars_scraper.BASE_URL = self.server.base_url
+
+    def tearDown(self):
+        shogiwars_scraper.BASE_URL = self.base_url
+        self.server.stop()
+
+    def page_source(self, gtype: str, page: int) -> str:
+        url = (f"{self.server.base_url}/games/history?init_pos_type=normal&month=2024-10"
+               f"&opponent_type=normal&user_id=ohakado&gtype={gtype}&page={page}")
+        return requests.get(url).text
+
+    def test_inspect_counts_games_and_pagination(self):
+        pages = [inspect_history_page(self.page_source("sb", page)) for page in (1, 2, 3, 4)]
+        self.assertEqual([info["games_on_page"] for info in pages], [10, 10, 5, 0])
+        # バッジの検索リンク（historyを含むがpageのないリンク）はページ番号にも対局にも数えない
+        self.assertEqual([info["last_linked_page"] for info in pages], [3, 3, 3, 3])
+        self.assertEqual(len({info["content_hash"] for info in pages}), 4)
+        # 同じ内容のページは同じハッシュになる
+        self.assertEqual(inspect_history_page(self.page_source("sb", 2)), pages[1])
+
+    def test_detect_last_page(self):
+        first, second, third = (inspect_history_page(self.page_source("s1", page)) for page in (1, 2, 3))
+        self.assertIsNone(detect_last_page(1, first, 0, None))
+        self.assertIsNone(detect_last_page(2, second, 10, first["content_hash"]))
+        # 対局数がちょうどページの倍数でも、ページネーションで最終ページが分かる
+        self.assertEqual(detect_last_page(3, third, 10, second["content_hash"]), "pagination")
+
+        without_links = dict(third, last_linked_page=None)
+        self.assertIsNone(detect_last_page(3, without_links, 10, second["content_hash"]))
+        self.assertEqual(detect_last_page(3, dict(without_links, games_on_page=4), 10, None), "short page")
+        self.assertEqual(detect_last_page(4, without_links, 10, third["content_hash"]), "repeat")
+        self.assertIsNone(detect_last_page(1, {}, 0, None))
+
+    def test_scrape_skips_fetch_after_last_page(self):
+        stats = {}
+        game_urls = shogiwars_scraper.scrape_game_urls(
+            HttpFetcher(requests.Session()), "ohakado", "", "2024-10", "s1", "normal", "normal", stats=stats
+        )
+        self.assertEqual(len(game_urls), 30)
+        self.assertEqual(stats["pages_fetched"], 3)
+        self.assertEqual(stats["fetches_saved"], 1)
+        self.assertEqual(len(self.server.requests), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
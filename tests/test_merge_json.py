@@ -0,0 +1,114 @@
+"""
+JSONファイルのk-wayマージ（merge_json.py）のテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import glob
+import json
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from merge_json import JsonStreamReader, merge_json_files
+
+
+def replay(day: int, second: int, opponent: str, source: int) -> dict:
+    timestamp = f"202410{day:02d}_12{second // 60:02d}{second % 60:02d}"
+    return {
+        "url": f"https://shogiwars.heroz.jp/games/ohakado-{opponent}-{timestamp}",
+        "game_id": f"ohakado-{opponent}-{timestamp}",
+        "sente": {"name": "ohakado", "class": "五段", "result": "win"},
+        "gote": {"name": opponent, "class": "四段", "result": "lose"},
+        "datetime": f"2024-10-{day:02d}T12:{second // 60:02d}:{second % 60:02d}",
+        "badges": [],
+        # どのファイルの対局が残ったかの確認用
+        "source": source,
+    }
+
+
+def brute_force_merge(inputs: list) -> list:
+    """
+    全ての対局を入力の順に並べ、日時の降順に安定ソートしてから game_id で重複排除する
+    """
+    replays = [game for games in inputs for game in sorted(games, key=lambda game: game["datetime"], reverse=True)]
+    replays.sort(key=lambda game: game["datetime"], reverse=True)
+    seen = set()
+    merged = []
+    for game in replays:
+        if game["game_id"] not in seen:
+            seen.add(game["game_id"])
+            merged.append(game)
+    return merged
+
+
+class MergeJsonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_inputs(self, count: int) -> tuple[list, list]:
+        rng = random.Random(7)
+        inputs = []
+        paths = []
+        for source in range(count):
+            # 対局の一部は他のファイルと重複し、同じ日時の別の対局も含む
+            games = [
+                replay(rng.randint(1, 5), rng.randint(0, 20), f"rival{rng.randint(1, 3)}", source)
+                for _ in range(30)
+            ]
+            games = list({game["game_id"]: game for game in games}.values())
+            if source % 2:
+                # スクレイパーの出力のように日時の順に並んでいないファイル
+                rng.shuffle(games)
+            else:
+                games.sort(key=lambda game: game["datetime"], reverse=True)
+            path = os.path.join(self.tmp_dir.name, f"game_replays_2024-10_ohakado_{source:02d}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"params": {"user": "ohakado", "month": "2024-10"}, "replays": games}, f, ensure_ascii=False)
+            inputs.append(games)
+            paths.append(path)
+        return inputs, paths
+
+    def read_output(self, path: str) -> list:
+        reader = JsonStreamReader(path)
+        try:
+            return list(reader)
+        finally:
+            reader.close()
+
+    def test_merge_matches_brute_force_with_more_inputs_than_open_files(self):
+        inputs, paths = self.write_inputs(9)
+        output = os.path.join(self.tmp_dir.name, "merged.json")
+
+        count = merge_json_files(paths, output, max_open_files=2)
+
+        expected = brute_force_merge(inputs)
+        merged = self.read_output(output)
+        self.assertEqual(count, len(expected))
+        self.assertEqual(merged, expected)
+        # 重複した対局は先に指定したファイルのものが残る
+        self.assertLess(len(merged), sum(len(games) for games in inputs))
+        # 一時ファイルは残らない
+        self.assertEqual(glob.glob(os.path.join(self.tmp_dir.name, ".merge_runs_*")), [])
+        self.assertFalse(os.path.exists(output + ".tmp"))
+
+    def test_result_does_not_depend_on_open_file_limit(self):
+        _, paths = self.write_inputs(5)
+        outputs = []
+        for max_open_files in (2, 3, 64):
+            output = os.path.join(self.tmp_dir.name, f"merged_{max_open_files}.json")
+            merge_json_files(paths, output, max_open_files=max_open_files)
+            outputs.append(self.read_output(output))
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(outputs[0], outputs[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+ストリーミング出力（NdjsonSink と --stream）のテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shogiwars_scraper
+from mock_history_server import MockHistoryServer
+from shogiwars_scraper import HttpFetcher, MonthTarget, NdjsonSink, all_combinations, save_to_json, scrape_months
+
+
+GAMES = {
+    ("s1", "normal", "normal"): 12,
+    ("sb", "normal", "normal"): 35,
+    ("10min", "normal", "normal"): 20,
+    ("10min", "friend", "sprint"): 3,
+}
+
+QUERY_PARAMS = {
+    "user": "ohakado", "opponent": "(all)", "month": "2024-10", "gtype": "(all)",
+    "opponent_type": "(all)", "init_pos_type": "(all)", "limit": "(all)",
+}
+
+SB = ("sb", "normal", "normal")
+S1 = ("s1", "normal", "normal")
+
+
+def game(game_id: str) -> dict:
+    return {"url": f"https://shogiwars.heroz.jp/games/{game_id}", "game_id": game_id, "badges": ["角換わり"]}
+
+
+class NdjsonSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "game_replays_2024-10_ohakado.ndjson")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_replays_are_read_in_combination_order(self):
+        sink = NdjsonSink(self.path)
+        # 並列取得では組み合わせのページが入り混じって書き込まれる
+        self.assertEqual(sink.write_page(SB, 1, [game("sb-1"), game("sb-2")]), 2)
+        self.assertEqual(sink.write_page(S1, 1, [game("s1-1"), game("sb-1")]), 1)
+        self.assertEqual(sink.write_page(SB, 2, [game("sb-3")]), 1)
+
+        replays = list(sink.iter_replays([S1, SB]))
+        self.assertEqual([replay["game_id"] for replay in replays], ["s1-1", "sb-1", "sb-2", "sb-3"])
+        filtered = sink.iter_replays([S1, SB], lambda replay: replay["game_id"].endswith("-1"))
+        self.assertEqual([replay["game_id"] for replay in filtered], ["s1-1", "sb-1"])
+
+    def test_resume_keeps_written_games_and_drops_partial_line(self):
+        sink = NdjsonSink(self.path)
+        sink.write_page(SB, 1, [game("sb-1"), game("sb-2")])
+        sink.close()
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write('{"combination": ["sb", "normal", "normal"], "page": 2, "rep')
+
+        sink = NdjsonSink(self.path, resume=True)
+        self.assertEqual(sink.count, 2)
+        self.assertEqual(sink.write_page(SB, 2, [game("sb-2"), game("sb-3")]), 1)
+        self.assertEqual([replay["game_id"] for replay in sink.iter_replays([SB])], ["sb-1", "sb-2", "sb-3"])
+
+    def test_without_resume_starts_a_new_stream(self):
+        sink = NdjsonSink(self.path)
+        sink.write_page(SB, 1, [game("sb-1")])
+        sink.close()
+
+        sink = NdjsonSink(self.path)
+        self.assertEqual(sink.count, 0)
+        self.assertEqual(sink.write_page(SB, 1, [game("sb-1")]), 1)
+        self.assertEqual([replay["game_id"] for replay in sink.iter_replays([SB])], ["sb-1"])
+
+
+class StreamScrapeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.server = MockHistoryServer(GAMES).start()
+        self.base_url = shogiwars_scraper.BASE_URL
+        shogiwars_scraper.BASE_URL = self.server.base_url
+
+    def tearDown(self):
+        shogiwars_scraper.BASE_URL = self.base_url
+        self.server.stop()
+        self.tmp_dir.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmp_dir.name, name)
+
+    def test_finalize_matches_save_to_json(self):
+        combinations = all_combinations()
+        full = scrape_months([HttpFetcher(requests.Session())], "ohakado", "", [MonthTarget("2024-10")], combinations)[0]
+        save_to_json(full, self.path("expected.json"), QUERY_PARAMS)
+
+        # 並列に取得しても、変換した出力は組み合わせの順の全件取得と同じになる
+        sink = NdjsonSink(self.path("streamed.ndjson"))
+        fetchers = [HttpFetcher(requests.Session()) for _ in range(3)]
+        scrape_months(fetchers, "ohakado", "", [MonthTarget("2024-10", sink=sink)], combinations)
+        self.assertEqual(sink.finalize(self.path("streamed.json"), QUERY_PARAMS, combinations), len(full))
+
+        with open(self.path("expected.json"), "rb") as expected, open(self.path("streamed.json"), "rb") as streamed:
+            self.assertEqual(streamed.read(), expected.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+対局データの転置索引（replay_index.py）のテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replay_index import ReplayIndex, _game_terms, build_index
+
+
+BADGES = ["角換わり", "右四間飛車", "居飛車穴熊", "嬉野流"]
+PLAYERS = ["ohakado", "rival1", "rival2", "rival3"]
+CLASSES = ["初段", "二段", "五段"]
+
+
+def make_replays(count: int) -> list:
+    rng = random.Random(23)
+    replays = []
+    for index in range(count):
+        sente, gote = rng.sample(PLAYERS, 2)
+        sente_wins = rng.random() < 0.5
+        # 角換わりは多く（ビットマップ）、嬉野流は少なく（位置の配列）出るようにする
+        badges = [badge for badge, rate in zip(BADGES, (0.6, 0.2, 0.1, 0.01)) if rng.random() < rate]
+        month = rng.choice(["2024-09", "2024-10"])
+        replays.append({
+            "url": f"https://shogiwars.heroz.jp/games/{sente}-{gote}-{index}",
+            "game_id": f"{sente}-{gote}-{index}",
+            "sente": {"name": sente, "class": rng.choice(CLASSES), "result": "win" if sente_wins else "lose"},
+            "gote": {"name": gote, "class": rng.choice(CLASSES), "result": "lose" if sente_wins else "win"},
+            "datetime": f"{month}-{index % 28 + 1:02d}T12:00:00",
+            "badges": badges,
+        })
+    return replays
+
+
+# 検索式と、同じ条件を対局の (項目, 値) の集合に対して判定する関数
+QUERIES = [
+    ("badge:角換わり", lambda t: ("badge", "角換わり") in t),
+    ("badge:嬉野流", lambda t: ("badge", "嬉野流") in t),
+    ("badge:角換わり AND sente:ohakado", lambda t: ("badge", "角換わり") in t and ("sente", "ohakado") in t),
+    ("badge:角換わり player:ohakado", lambda t: ("badge", "角換わり") in t and ("player", "ohakado") in t),
+    ("badge:嬉野流 OR badge:居飛車穴熊", lambda t: ("badge", "嬉野流") in t or ("badge", "居飛車穴熊") in t),
+    ("NOT badge:角換わり", lambda t: ("badge", "角換わり") not in t),
+    ("NOT NOT win:ohakado", lambda t: ("win", "ohakado") in t),
+    ("badge:角換わり AND (gote:ohakado OR sente:ohakado) AND NOT class:初段",
+     lambda t: ("badge", "角換わり") in t and (("gote", "ohakado") in t or ("sente", "ohakado") in t)
+     and ("class", "初段") not in t),
+    # NOTはANDより、ANDはORより優先される
+    ("win:rival1 OR badge:右四間飛車 AND NOT month:2024-10",
+     lambda t: ("win", "rival1") in t or (("badge", "右四間飛車") in t and ("month", "2024-10") not in t)),
+    ("(win:rival1 OR badge:右四間飛車) AND NOT month:2024-10",
+     lambda t: (("win", "rival1") in t or ("badge", "右四間飛車") in t) and ("month", "2024-10") not in t),
+    ("badge:存在しない戦型", lambda t: False),
+    ("NOT badge:存在しない戦型", lambda t: True),
+]
+
+
+class ReplayIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.replays = make_replays(400)
+        # 重複した対局は最初の1件だけが索引に入る
+        path = os.path.join(cls.tmp_dir.name, "replays.index")
+        cls.count = build_index(cls.replays + cls.replays[:10], path)
+        cls.index = ReplayIndex(path)
+        cls.terms = [set(_game_terms(replay)) for replay in cls.replays]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def test_count_and_storage_kinds(self):
+        self.assertEqual(self.count, 400)
+        kinds = {spec["kind"] for spec in self.index.manifest["fields"]["badge"].values()}
+        self.assertEqual(kinds, {"array", "bitmap"})
+
+    def test_queries_match_brute_force(self):
+        for expression, predicate in QUERIES:
+            with self.subTest(expression=expression):
+                postings = self.index.query(expression)
+                expected = [replay["game_id"] for replay, terms in zip(self.replays, self.terms) if predicate(terms)]
+                self.assertEqual(self.index.game_ids(postings), expected)
+                self.assertEqual(len(postings), len(expected))
+
+    def test_limit(self):
+        postings = self.index.query("badge:角換わり")
+        self.assertEqual(self.index.game_ids(postings, limit=5), self.index.game_ids(postings)[:5])
+
+    def test_bad_syntax(self):
+        for expression in ["", "badge:角換わり AND", "(badge:角換わり", "badge:角換わり )", "角換わり",
+                           "unknown:value", "NOT", "badge:角換わり OR OR badge:嬉野流"]:
+            with self.subTest(expression=expression):
+                with self.assertRaises(ValueError):
+                    self.index.query(expression)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+"""
+対局データのSQLiteストア（replay_store.py）のテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replay_store import ReplayStore, default_export_filename, import_json_files
+from shogiwars_scraper import save_to_json
+
+
+def replay(sente: str, gote: str, timestamp: str, winner: str = "sente", badges=("角換わり",)) -> dict:
+    game_id = f"{sente}-{gote}-{timestamp}"
+    day, time_of_day = timestamp.split("_")
+    return {
+        "url": f"https://shogiwars.heroz.jp/games/{game_id}",
+        "game_id": game_id,
+        "sente": {"name": sente, "class": "五段", "result": "win" if winner == "sente" else "lose"},
+        "gote": {"name": gote, "class": "四段", "result": "lose" if winner == "sente" else "win"},
+        "datetime": f"{day[:4]}-{day[4:6]}-{day[6:]}T{time_of_day[:2]}:{time_of_day[2:4]}:{time_of_day[4:]}",
+        "badges": list(badges),
+    }
+
+
+REPLAYS = [
+    replay("ohakado", "rival1", "20241030_210000", badges=("角換わり", "腰掛け銀")),
+    replay("rival2", "ohakado", "20241015_120000", winner="gote"),
+    replay("ohakado", "rival3", "20241001_090000", winner="gote", badges=()),
+    replay("ohakado", "rival1", "20240930_230000"),
+    replay("rival4", "rival5", "20241010_100000"),
+]
+
+
+class ReplayStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = ReplayStore(os.path.join(self.tmp_dir.name, "replays.sqlite3"))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmp_dir.name, name)
+
+    def test_upsert_is_idempotent(self):
+        self.assertEqual(self.store.upsert(REPLAYS), len(REPLAYS))
+        before = self.store.query()
+        self.store.upsert(REPLAYS)
+        self.assertEqual(self.store.count(), len(REPLAYS))
+        self.assertEqual(self.store.query(), before)
+
+        # 同じgame_idの対局は上書きされ、バッジも順序ごと置き換わる
+        updated = dict(REPLAYS[0], badges=["腰掛け銀"])
+        self.store.upsert([updated])
+        self.assertEqual(self.store.count(), len(REPLAYS))
+        self.assertEqual(self.store.query(badge="角換わり", player="ohakado", since="2024-10-30"), [])
+        self.assertEqual(self.store.query(badge="腰掛け銀")[0]["badges"], ["腰掛け銀"])
+
+    def test_query_from_player_view(self):
+        self.store.upsert(REPLAYS)
+        wins = self.store.query(player="ohakado", result="win")
+        self.assertEqual([game["game_id"] for game in wins], [REPLAYS[0]["game_id"], REPLAYS[1]["game_id"], REPLAYS[3]["game_id"]])
+        october = self.store.query(player="ohakado", since="2024-10", until="2024-11")
+        self.assertEqual(len(october), 3)
+        with self.assertRaises(ValueError):
+            self.store.query(result="win")
+
+    def test_export_round_trip(self):
+        source = self.path("game_replays_2024-10_ohakado.json")
+        params = {"user": "ohakado", "opponent": "(all)", "month": "2024-10",
+                  "gtype": "(all)", "opponent_type": "(all)", "init_pos_type": "(all)", "limit": "(all)"}
+        save_to_json(REPLAYS, source, params)
+        import_json_files(self.store, [source])
+
+        exported = self.path("export.json")
+        count = self.store.export_json(exported, "ohakado", "2024-10")
+        with open(exported, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        expected = sorted(
+            (game for game in REPLAYS
+             if game["datetime"].startswith("2024-10") and "ohakado" in (game["sente"]["name"], game["gote"]["name"])),
+            key=lambda game: game["datetime"], reverse=True
+        )
+        self.assertEqual(count, len(expected))
+        self.assertEqual(data["params"], params)
+        self.assertEqual(data["replays"], expected)
+
+    def test_export_opponent_matches_like_scraper(self):
+        self.store.upsert(REPLAYS + [replay("Rival10", "ohakado", "20241020_080000")])
+        exported = self.path("export.json")
+
+        # スクレイパーの --opponent と同じく、対局IDの部分一致（大文字小文字を区別しない）
+        self.assertEqual(self.store.export_json(exported, "ohakado", "2024-10", "RIVAL1"), 2)
+        with open(exported, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.assertEqual([game["game_id"] for game in data["replays"]],
+                         ["ohakado-rival1-20241030_210000", "Rival10-ohakado-20241020_080000"])
+        self.assertEqual(data["params"]["opponent"], "RIVAL1")
+        self.assertEqual(self.store.export_json(exported, "ohakado", "2024-10", "rival2, rival3"), 2)
+
+    def test_default_export_filename_does_not_overwrite_scraper_output(self):
+        self.assertEqual(default_export_filename("2024-10", "ohakado"),
+                         os.path.join("result", "game_replays_2024-10_ohakado.export.json"))
+        self.assertEqual(default_export_filename("2024-10", "ohakado", "rival1"),
+                         os.path.join("result", "game_replays_2024-10_ohakado_rival1.export.json"))
+
+
+if __name__ == "__main__":
+    unittest.main()
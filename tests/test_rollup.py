@@ -0,0 +1,101 @@
+"""
+勝敗の集計（replay_rollup.py と --rollup）のテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import glob
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replay_rollup import ReplayRollup, default_rollup_paths, rollup_path, sum_rollups
+from shogiwars_scraper import save_to_json
+
+
+def replay(index: int, opponent: str, result: str, datetime: str = "2024-10-05T12:00:00") -> dict:
+    return {
+        "url": f"https://shogiwars.heroz.jp/games/ohakado-{opponent}-20241005_{index:06d}",
+        "game_id": f"ohakado-{opponent}-20241005_{index:06d}",
+        "sente": {"name": "ohakado", "class": "五段", "result": result},
+        "gote": {"name": opponent, "class": "四段", "result": {"win": "lose", "lose": "win"}[result]},
+        "datetime": datetime,
+        "badges": ["角換わり"],
+    }
+
+
+def query_params(opponent: str = "(all)", gtype: str = "(all)") -> dict:
+    return {
+        "user": "ohakado",
+        "opponent": opponent,
+        "month": "2024-10",
+        "gtype": gtype,
+        "opponent_type": "(all)",
+        "init_pos_type": "(all)",
+        "limit": "(all)",
+    }
+
+
+class RollupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.result_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def output(self, name: str) -> str:
+        return os.path.join(self.result_dir, name)
+
+    def test_default_query_does_not_double_count_opponent_rollups(self):
+        games = [replay(1, "rival1", "win"), replay(2, "rival1", "lose"), replay(3, "rival2", "win")]
+        combinations = {game["game_id"]: ("sb", "normal") for game in games}
+        save_to_json(games, self.output("game_replays_2024-10_ohakado.json"), query_params(),
+                     rollup_combinations=combinations)
+        save_to_json(games[:2], self.output("game_replays_2024-10_ohakado_rival1.json"), query_params("rival1"),
+                     rollup_combinations=combinations)
+
+        paths = sorted(glob.glob(os.path.join(self.result_dir, "game_replays_*.rollup")))
+        self.assertEqual(len(paths), 2)
+        selected = default_rollup_paths(paths)
+        self.assertEqual(selected, [rollup_path(self.output("game_replays_2024-10_ohakado.json"))])
+        self.assertEqual(sum_rollups(selected), {None: [2, 1, 0]})
+
+        # 全対局の集計がない月は、対戦相手ごとの集計を足し合わせる
+        os.remove(selected[0])
+        self.assertEqual(sum_rollups(default_rollup_paths(paths[1:])), {None: [1, 1, 0]})
+
+    def test_rebuild_keeps_recorded_combinations(self):
+        output_file = self.output("game_replays_2024-10_ohakado.json")
+        games = [replay(1, "rival1", "win"), replay(2, "rival2", "lose"), replay(3, "rival3", "win")]
+        save_to_json(games, output_file, query_params(),
+                     rollup_combinations={game["game_id"]: ("sb", "normal") for game in games})
+
+        # 差分取得で新しい対局を加え、取得し直して1局減った（集計を作り直す）
+        new_game = replay(4, "rival4", "win", "2024-10-06T12:00:00")
+        save_to_json([new_game] + games[:2], output_file, query_params(),
+                     rollup_combinations={new_game["game_id"]: ("10min", "normal")})
+
+        rollup = ReplayRollup.load(rollup_path(output_file), "ohakado")
+        self.assertEqual(set(rollup.games), {new_game["game_id"], games[0]["game_id"], games[1]["game_id"]})
+        by_gtype = rollup.query("gtype")
+        self.assertEqual(set(by_gtype), {"sb", "10min"})
+        self.assertEqual(by_gtype["sb"]["games"], 2)
+        self.assertEqual(by_gtype["10min"]["games"], 1)
+
+    def test_update_adds_only_new_games(self):
+        output_file = self.output("game_replays_2024-10_ohakado.json")
+        games = [replay(1, "rival1", "win"), replay(2, "rival2", "lose")]
+        combinations = {game["game_id"]: ("sb", "normal") for game in games}
+        save_to_json(games, output_file, query_params(), rollup_combinations=combinations)
+        save_to_json(games, output_file, query_params(), rollup_combinations=combinations)
+
+        rollup = ReplayRollup.load(rollup_path(output_file), "ohakado")
+        self.assertEqual(rollup.query(), {None: {"games": 2, "win": 1, "lose": 1, "draw": 0, "win_rate": 0.5}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""
+--workers のフェッチャープールを、ローカルのモック履歴サーバーに対して確認するテスト
+（python -m pytest tests または python -m unittest discover tests で実行）
+"""
+
+import os
+import sys
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shogiwars_scraper
+from mock_history_server import MockHistoryServer
+from shogiwars_scraper import HttpFetcher, MonthTarget, all_combinations, scrape_months
+
+
+# 組み合わせごとの対局数（1ページ10局）
+GAMES = {
+    ("s1", "normal", "normal"): 12,
+    ("sb", "normal", "normal"): 35,
+    ("10min", "normal", "normal"): 20,
+    ("10min", "friend", "sprint"): 3,
+}
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockHistoryServer(GAMES, delay=0.02).start()
+        self.base_url = shogiwars_scraper.BASE_URL
+        shogiwars_scraper.BASE_URL = self.server.base_url
+
+    def tearDown(self):
+        shogiwars_scraper.BASE_URL = self.base_url
+        self.server.stop()
+
+    def scrape(self, workers: int):
+        fetchers = [HttpFetcher(requests.Session()) for _ in range(workers)]
+        return scrape_months(fetchers, "ohakado", "", [MonthTarget("2024-10")], all_combinations())[0]
+
+    def test_parallel_result_matches_sequential(self):
+        sequential = self.scrape(1)
+        self.server.max_in_flight = 0
+        parallel = self.scrape(4)
+
+        self.assertEqual(len(sequential), sum(GAMES.values()))
+        self.assertEqual(len({game["game_id"] for game in sequential}), sum(GAMES.values()))
+        # 完了順によらず、組み合わせの順に結合される
+        self.assertEqual(parallel, sequential)
+        self.assertGreater(self.server.max_in_flight, 1)
+
+    def test_empty_combination_is_definite(self):
+        stats = {}
+        game_urls = shogiwars_scraper.scrape_game_urls(
+            HttpFetcher(requests.Session()), "ohakado", "", "2024-10", "sf", "coach", "normal", stats=stats
+        )
+        self.assertEqual(game_urls, [])
+        self.assertTrue(stats["empty"])
+
+
+class CharsetTest(unittest.TestCase):
+
+    def test_response_without_charset_is_decoded_as_utf8(self):
+        with MockHistoryServer(GAMES, content_type="text/html") as server:
+            base_url = shogiwars_scraper.BASE_URL
+            shogiwars_scraper.BASE_URL = server.base_url
+            try:
+                game_urls = shogiwars_scraper.scrape_game_urls(
+                    HttpFetcher(requests.Session()), "ohakado", "", "2024-10", "s1", "normal", "normal"
+                )
+            finally:
+                shogiwars_scraper.BASE_URL = base_url
+
+        self.assertEqual(len(game_urls), 12)
+        self.assertEqual({game["sente"]["class"] for game in game_urls}, {"五段"})
+        self.assertIn("角換わり", game_urls[0]["badges"])
+
+
+if __name__ == "__main__":
+    unittest.main()